@@ -0,0 +1,187 @@
+"""
+This file implements common tools for benchmarks: timing with repeats,
+description of the machine and saving of machine-readable results.
+"""
+
+import os
+import json
+import time
+import hashlib
+import platform
+import resource
+from datetime import datetime
+
+import numpy as np
+import torch
+
+
+def synchronize(device):
+    """
+    Wait for all kernels on the given device to finish.
+
+    Parameters:
+    -----------
+    device: str
+        "cuda" or "cpu".
+    """
+    if "cuda" in str(device) and torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
+def measure(function, repeats=20, warmup=3, device="cpu"):
+    """
+    Measure the execution time of a function.
+
+    Parameters:
+    -----------
+    function: Callable[[], Any]
+        A function without arguments to be measured.
+    repeats: int, optional
+        The number of measured calls.
+    warmup: int, optional
+        The number of calls before measurements (e.g. to allocate memory).
+    device: str, optional
+        "cuda" or "cpu"; the device is synchronized after each call.
+
+    Returns:
+    --------
+    dict
+        Statistics of times in seconds: median, interquartile range,
+        first and third quartile, mean, minimum and all measured times.
+    """
+    for _ in range(warmup):
+        function()
+    synchronize(device)
+
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        synchronize(device)
+        times.append(time.perf_counter() - start)
+
+    q1, median, q3 = np.percentile(times, [25, 50, 75])
+    return {
+        "median": float(median),
+        "q1": float(q1),
+        "q3": float(q3),
+        "iqr": float(q3 - q1),
+        "mean": float(np.mean(times)),
+        "min": float(np.min(times)),
+        "times": [float(t) for t in times]
+    }
+
+
+def get_peak_rss_mb():
+    """
+    Get the maximum resident set size of the current process in MB.
+
+    Returns:
+    --------
+    float
+        Peak RSS in MB.
+    """
+    # ru_maxrss is given in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+
+def get_current_rss_mb():
+    """
+    Get the current resident set size of the process in MB.
+
+    Returns:
+    --------
+    float
+        Current RSS in MB (peak RSS on systems without /proc).
+    """
+    if os.path.exists("/proc/self/status"):
+        with open("/proc/self/status") as stream:
+            for line in stream:
+                if line.startswith("VmRSS:"):
+                    # The value is given in kilobytes
+                    return int(line.split()[1]) / 2**10
+    return get_peak_rss_mb()
+
+
+def get_machine_description():
+    """
+    Describe the hardware and software used for benchmarks.
+
+    Returns:
+    --------
+    dict
+        A description of the machine together with its short fingerprint,
+        i.e. a hash of the features which influence timings.
+    """
+    cpu_model = platform.processor()
+    if os.path.exists("/proc/cpuinfo"):
+        with open("/proc/cpuinfo") as stream:
+            for line in stream:
+                if line.startswith("model name"):
+                    cpu_model = line.split(":", 1)[1].strip()
+                    break
+    description = {
+        "system": platform.system(),
+        "machine": platform.machine(),
+        "cpu_model": cpu_model,
+        "cpu_count": os.cpu_count(),
+        "torch_threads": torch.get_num_threads(),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "gpu": torch.cuda.get_device_name(0) if torch.cuda.is_available() else None
+    }
+    description["fingerprint"] = hashlib.sha1(
+        json.dumps(description, sort_keys=True).encode()
+    ).hexdigest()[:12]
+    return description
+
+
+def save_results(results, saving_folder, name):
+    """
+    Save results of benchmarks together with the description of the machine
+    into a JSON file.
+
+    Parameters:
+    -----------
+    results: List[dict]
+        Results of consecutive benchmarks.
+    saving_folder: str
+        The folder for results.
+    name: str
+        The name of the benchmark suite, used as a prefix of the file.
+
+    Returns:
+    --------
+    str
+        The path of the saved file.
+    """
+    os.makedirs(saving_folder, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    path = os.path.join(saving_folder, f"{name}_{timestamp}.json")
+    with open(path, "w") as stream:
+        json.dump({
+            "suite": name,
+            "timestamp": timestamp,
+            "machine": get_machine_description(),
+            "results": results
+        }, stream, indent=2)
+    print(f"Results saved to {path}")
+    return path
+
+
+def load_results(path):
+    """
+    Load results of benchmarks saved by save_results().
+
+    Parameters:
+    -----------
+    path: str
+        The path of the JSON file.
+
+    Returns:
+    --------
+    dict
+        The suite name, timestamp, description of the machine and results.
+    """
+    with open(path) as stream:
+        return json.load(stream)
@@ -0,0 +1,412 @@
+"""
+This file implements micro-benchmarks of interval layers, the interval
+hypernetwork and output regularizers on synthetic inputs. All benchmarks
+may be run on CPU and are reproducible (inputs are generated with a fixed seed).
+"""
+
+import os
+import sys
+from copy import deepcopy
+from itertools import product
+
+import torch
+
+# Get the parent directory path
+parent_dir = os.path.abspath(os.path.join(os.getcwd(), '.'))
+
+# Add the parent directory to sys.path
+sys.path.insert(0, parent_dir)
+
+from IntervalNets.interval_modules import (IntervalLinear, IntervalConv2d,
+                                           IntervalMaxPool2d, IntervalAvgPool2d)
+from IntervalNets.hmlp_ibp_wo_nesting import HMLP_IBP
+from IntervalNets.hmlp_ibp_with_nesting import HMLP_IBP as HMLP_IBP_with_nesting
+import Utils.hnet_middle_regularizer as middle_reg
+import Utils.hnet_interval_regularizer as interval_reg
+from Utils.handy_functions import set_seed
+from Benchmarks.benchmark_utils import measure, save_results
+
+
+def make_interval_input(shape, device):
+    """
+    Generate a non-negative interval input (e.g., after ReLU) with
+    lower <= middle <= upper.
+
+    Parameters:
+    -----------
+    shape: Tuple[int]
+        The shape of a single bound, e.g. (batch_size, features).
+    device: str
+        "cuda" or "cpu".
+
+    Returns:
+    --------
+    torch.Tensor
+        A tensor of shape (batch_size, 3, ...).
+    """
+    middle = torch.rand(shape, device=device) + 0.1
+    radius = 0.05 * torch.rand(shape, device=device)
+    lower = torch.clamp(middle - radius, min=0.0)
+    upper = middle + radius
+    return torch.stack([lower, middle, upper], dim=1)
+
+
+def make_interval_weights(shape, device, radius=0.01):
+    """
+    Generate lower, middle and upper weights of a given shape.
+
+    Parameters:
+    -----------
+    shape: Tuple[int]
+        The shape of the weights.
+    device: str
+        "cuda" or "cpu".
+    radius: float, optional
+        The maximum radius of the interval around middle weights.
+
+    Returns:
+    --------
+    Tuple[torch.Tensor, torch.Tensor, torch.Tensor]
+        Lower, middle and upper weights.
+    """
+    middle = 0.1 * torch.randn(shape, device=device)
+    radius = radius * torch.rand(shape, device=device)
+    return middle - radius, middle, middle + radius
+
+
+def get_target_shapes(input_size, hidden_size, output_size):
+    """
+    Get shapes of weights of a two-hidden-layer MLP target network.
+
+    Parameters:
+    -----------
+    input_size: int
+        The number of input features.
+    hidden_size: int
+        The number of neurons in hidden layers.
+    output_size: int
+        The number of outputs.
+
+    Returns:
+    --------
+    List[List[int]]
+        Shapes of consecutive weights and biases.
+    """
+    return [[hidden_size, input_size], [hidden_size],
+            [hidden_size, hidden_size], [hidden_size],
+            [output_size, hidden_size], [output_size]]
+
+
+def benchmark_interval_linear(batch_sizes, widths, repeats, device):
+    """
+    Benchmark IntervalLinear.apply_linear for square layers.
+
+    Parameters:
+    -----------
+    batch_sizes: List[int]
+        Swept batch sizes.
+    widths: List[int]
+        Swept numbers of input and output features.
+    repeats: int
+        The number of measured calls.
+    device: str
+        "cuda" or "cpu".
+
+    Returns:
+    --------
+    List[dict]
+        Results of consecutive settings.
+    """
+    results = []
+    for batch_size, width in product(batch_sizes, widths):
+        x = make_interval_input((batch_size, width), device)
+        w_l, w_m, w_u = make_interval_weights((width, width), device)
+        b_l, b_m, b_u = make_interval_weights((width,), device)
+        timing = measure(
+            lambda: IntervalLinear.apply_linear(x, w_u, w_m, w_l, b_u, b_m, b_l),
+            repeats=repeats, device=device
+        )
+        results.append({"benchmark": "interval_linear",
+                        "params": {"batch_size": batch_size, "width": width},
+                        **timing})
+    return results
+
+
+def benchmark_interval_conv2d(batch_sizes, channels, image_size, repeats, device):
+    """
+    Benchmark IntervalConv2d.apply_conv2d with 3x3 kernels.
+
+    Parameters:
+    -----------
+    batch_sizes: List[int]
+        Swept batch sizes.
+    channels: List[int]
+        Swept numbers of input and output channels.
+    image_size: int
+        The height and width of input images.
+    repeats: int
+        The number of measured calls.
+    device: str
+        "cuda" or "cpu".
+
+    Returns:
+    --------
+    List[dict]
+        Results of consecutive settings.
+    """
+    results = []
+    for batch_size, channel in product(batch_sizes, channels):
+        x = make_interval_input((batch_size, channel, image_size, image_size), device)
+        w_l, w_m, w_u = make_interval_weights((channel, channel, 3, 3), device)
+        b_l, b_m, b_u = make_interval_weights((channel,), device)
+        timing = measure(
+            lambda: IntervalConv2d.apply_conv2d(x, w_l, w_m, w_u, b_l, b_m, b_u,
+                                                padding=1),
+            repeats=repeats, device=device
+        )
+        results.append({"benchmark": "interval_conv2d",
+                        "params": {"batch_size": batch_size, "channels": channel,
+                                   "image_size": image_size},
+                        **timing})
+    return results
+
+
+def benchmark_interval_pooling(batch_sizes, channels, image_size, repeats, device):
+    """
+    Benchmark IntervalMaxPool2d.apply_max_pool2d and
+    IntervalAvgPool2d.apply_avg_pool2d with 2x2 windows.
+
+    Parameters:
+    -----------
+    batch_sizes: List[int]
+        Swept batch sizes.
+    channels: List[int]
+        Swept numbers of channels.
+    image_size: int
+        The height and width of input images.
+    repeats: int
+        The number of measured calls.
+    device: str
+        "cuda" or "cpu".
+
+    Returns:
+    --------
+    List[dict]
+        Results of consecutive settings.
+    """
+    results = []
+    for batch_size, channel in product(batch_sizes, channels):
+        x = make_interval_input((batch_size, channel, image_size, image_size), device)
+        params = {"batch_size": batch_size, "channels": channel,
+                  "image_size": image_size}
+        timing = measure(lambda: IntervalMaxPool2d.apply_max_pool2d(x, 2),
+                         repeats=repeats, device=device)
+        results.append({"benchmark": "interval_max_pool2d",
+                        "params": params, **timing})
+        timing = measure(lambda: IntervalAvgPool2d.apply_avg_pool2d(x, 2),
+                         repeats=repeats, device=device)
+        results.append({"benchmark": "interval_avg_pool2d",
+                        "params": params, **timing})
+    return results
+
+
+def benchmark_hypernetwork_forward(hidden_sizes, numbers_of_tasks, target_shapes,
+                                   repeats, device):
+    """
+    Benchmark HMLP_IBP.forward for a single task with and without
+    the extended output (lower and upper weights and radii).
+
+    Parameters:
+    -----------
+    hidden_sizes: List[int]
+        Swept numbers of neurons in two hidden layers of the hypernetwork.
+    numbers_of_tasks: List[int]
+        Swept numbers of task embeddings.
+    target_shapes: List[List[int]]
+        Shapes of weights of the target network.
+    repeats: int
+        The number of measured calls.
+    device: str
+        "cuda" or "cpu".
+
+    Returns:
+    --------
+    List[dict]
+        Results of consecutive settings.
+    """
+    results = []
+    for hidden_size, number_of_tasks in product(hidden_sizes, numbers_of_tasks):
+        hypernetwork = HMLP_IBP(
+            perturbated_eps=1.0,
+            target_shapes=target_shapes,
+            uncond_in_size=0,
+            cond_in_size=48,
+            layers=[hidden_size, hidden_size],
+            num_cond_embs=number_of_tasks,
+            verbose=False).to(device)
+        for extended in [False, True]:
+            timing = measure(
+                lambda: hypernetwork.forward(cond_id=number_of_tasks - 1,
+                                             return_extended_output=extended,
+                                             perturbated_eps=1.0),
+                repeats=repeats, device=device
+            )
+            results.append({"benchmark": "hmlp_ibp_forward",
+                            "params": {"hidden_size": hidden_size,
+                                       "number_of_tasks": number_of_tasks,
+                                       "return_extended_output": extended},
+                            **timing})
+    return results
+
+
+def benchmark_regularizers(numbers_of_tasks, hidden_size, target_shapes,
+                           repeats, device):
+    """
+    Benchmark forward and backward passes of calc_fix_target_reg from
+    the middle (non-forced scenario) and interval (nested scenario)
+    regularizers as a function of the current task number.
+
+    Parameters:
+    -----------
+    numbers_of_tasks: List[int]
+        Swept numbers of the current task (= number of regularized tasks).
+    hidden_size: int
+        The number of neurons in two hidden layers of the hypernetwork.
+    target_shapes: List[List[int]]
+        Shapes of weights of the target network.
+    repeats: int
+        The number of measured calls.
+    device: str
+        "cuda" or "cpu".
+
+    Returns:
+    --------
+    List[dict]
+        Results of consecutive settings.
+    """
+    results = []
+    for task_id in numbers_of_tasks:
+        hnet = HMLP_IBP(
+            perturbated_eps=1.0,
+            target_shapes=target_shapes,
+            uncond_in_size=0,
+            cond_in_size=48,
+            layers=[hidden_size, hidden_size],
+            num_cond_embs=task_id + 1,
+            verbose=False).to(device)
+        middle_targets = middle_reg.get_current_targets(task_id, hnet, eps=1.0)
+
+        def run_middle_regularizer():
+            hnet.zero_grad()
+            loss = middle_reg.calc_fix_target_reg(hnet, task_id, eps=1.0,
+                                                  middle_targets=middle_targets,
+                                                  mnet=hnet)
+            loss.backward()
+
+        timing = measure(run_middle_regularizer, repeats=repeats, device=device)
+        results.append({"benchmark": "middle_regularizer",
+                        "params": {"number_of_tasks": task_id,
+                                   "hidden_size": hidden_size},
+                        **timing})
+
+        nested_hnet = HMLP_IBP_with_nesting(
+            perturbated_eps=1.0,
+            target_shapes=target_shapes,
+            uncond_in_size=0,
+            cond_in_size=48,
+            layers=[hidden_size, hidden_size],
+            num_cond_embs=task_id + 1,
+            verbose=False).to(device)
+        nested_hnet._prev_hnet_weights = deepcopy(nested_hnet.unconditional_params)
+        lower_targets, middle_targets, upper_targets = interval_reg.get_current_targets(
+            task_id, nested_hnet, eps=1.0
+        )
+
+        def run_interval_regularizer():
+            nested_hnet.zero_grad()
+            loss = interval_reg.calc_fix_target_reg(nested_hnet, task_id, eps=1.0,
+                                                    lower_targets=lower_targets,
+                                                    middle_targets=middle_targets,
+                                                    upper_targets=upper_targets,
+                                                    mnet=nested_hnet)
+            loss.backward()
+
+        timing = measure(run_interval_regularizer, repeats=repeats, device=device)
+        results.append({"benchmark": "interval_regularizer",
+                        "params": {"number_of_tasks": task_id,
+                                   "hidden_size": hidden_size},
+                        **timing})
+    return results
+
+
+def run_micro_benchmarks(config):
+    """
+    Run all micro-benchmarks for a given configuration.
+
+    Parameters:
+    -----------
+    config: dict
+        Contains swept values ("batch_sizes", "widths", "channels",
+        "hidden_sizes", "numbers_of_tasks"), fixed sizes ("image_size",
+        "target_shapes", "regularizer_hidden_size"), "repeats",
+        "device", "seed" and the list of "benchmarks" to be run.
+
+    Returns:
+    --------
+    List[dict]
+        Results of all benchmarks.
+    """
+    set_seed(config["seed"])
+    device = config["device"]
+    results = []
+    if "interval_linear" in config["benchmarks"]:
+        results += benchmark_interval_linear(config["batch_sizes"], config["widths"],
+                                             config["repeats"], device)
+    if "interval_conv2d" in config["benchmarks"]:
+        results += benchmark_interval_conv2d(config["batch_sizes"], config["channels"],
+                                             config["image_size"], config["repeats"],
+                                             device)
+    if "interval_pooling" in config["benchmarks"]:
+        results += benchmark_interval_pooling(config["batch_sizes"], config["channels"],
+                                              config["image_size"], config["repeats"],
+                                              device)
+    if "hmlp_ibp_forward" in config["benchmarks"]:
+        results += benchmark_hypernetwork_forward(config["hidden_sizes"],
+                                                  config["numbers_of_tasks"],
+                                                  config["target_shapes"],
+                                                  config["repeats"], device)
+    if "regularizers" in config["benchmarks"]:
+        results += benchmark_regularizers(config["numbers_of_tasks"],
+                                          config["regularizer_hidden_size"],
+                                          config["target_shapes"],
+                                          config["repeats"], device)
+    for result in results:
+        print(f'{result["benchmark"]} {result["params"]}: '
+              f'median {1000 * result["median"]:.3f} ms, '
+              f'IQR {1000 * result["iqr"]:.3f} ms')
+    return results
+
+
+if __name__ == "__main__":
+    config = {
+        "benchmarks": ["interval_linear", "interval_conv2d", "interval_pooling",
+                       "hmlp_ibp_forward", "regularizers"],
+        "batch_sizes": [32, 128],
+        "widths": [100, 400, 1000],
+        "channels": [16, 64],
+        "image_size": 32,
+        "hidden_sizes": [25, 100],
+        "numbers_of_tasks": [1, 10, 50],
+        "target_shapes": get_target_shapes(784, 100, 10),
+        "regularizer_hidden_size": 50,
+        "repeats": 20,
+        "seed": 1,
+        "device": "cpu",
+        "number_of_threads": None,
+        "saving_folder": "./Results/benchmarks/"
+    }
+    if config["number_of_threads"] is not None:
+        torch.set_num_threads(config["number_of_threads"])
+
+    results = run_micro_benchmarks(config)
+    save_results(results, config["saving_folder"], "micro_benchmarks")
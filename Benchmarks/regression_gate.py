@@ -0,0 +1,297 @@
+"""
+This file implements a performance regression gate. Baseline timings and
+memory of benchmarks are stored in Benchmarks/baselines/, separately for each
+benchmark suite and machine fingerprint, and new results saved by
+save_results() are compared with them. A regression is reported only if the
+slowdown exceeds both a relative threshold and the measurement noise
+(interquartile ranges of the baseline and the new run).
+"""
+
+import os
+import sys
+import json
+import glob
+
+# Get the parent directory path
+parent_dir = os.path.abspath(os.path.join(os.getcwd(), '.'))
+
+# Add the parent directory to sys.path
+sys.path.insert(0, parent_dir)
+
+from Benchmarks.benchmark_utils import load_results
+
+BASELINES_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "baselines")
+
+# Compared metrics and whether their higher values are better
+METRICS = {
+    "median": False,
+    "evaluation_latency": False,
+    "iterations_per_second": True,
+    "peak_rss_mb": False
+}
+
+# Benchmarks on hot paths whose regressions fail the gate;
+# regressions of other benchmarks are only flagged
+CRITICAL_BENCHMARKS = [
+    "interval_linear",
+    "interval_conv2d",
+    "hmlp_ibp_forward",
+    "middle_regularizer",
+    "interval_regularizer"
+]
+
+
+def get_result_key(result):
+    """
+    Get a key identifying a benchmark together with its parameters.
+
+    Parameters:
+    -----------
+    result: dict
+        A single result, with "benchmark" and "params" entries.
+
+    Returns:
+    --------
+    str
+        A key, e.g. 'interval_linear {"batch_size": 32, "width": 100}'.
+    """
+    return f'{result["benchmark"]} {json.dumps(result["params"], sort_keys=True)}'
+
+
+def get_baseline_path(suite, fingerprint, baselines_folder=BASELINES_FOLDER):
+    """
+    Get the path of the baseline of a benchmark suite on a given machine.
+
+    Parameters:
+    -----------
+    suite: str
+        The name of the benchmark suite, e.g. "micro_benchmarks".
+    fingerprint: str
+        The fingerprint of the machine.
+    baselines_folder: str, optional
+        The folder with baselines.
+
+    Returns:
+    --------
+    str
+        The path of the JSON file.
+    """
+    return os.path.join(baselines_folder, f"{suite}_{fingerprint}.json")
+
+
+def extract_metrics(result):
+    """
+    Select metrics of a result which are stored in baselines.
+
+    Parameters:
+    -----------
+    result: dict
+        A single result of a benchmark.
+
+    Returns:
+    --------
+    dict
+        Compared metrics and, for timings, their interquartile range.
+    """
+    metrics = {name: result[name] for name in METRICS if name in result}
+    if "iqr" in result:
+        metrics["iqr"] = result["iqr"]
+    return metrics
+
+
+def update_baseline(results, baselines_folder=BASELINES_FOLDER):
+    """
+    Store results of a benchmark suite as the baseline of the machine
+    on which they were measured. Results of benchmarks absent from
+    the new run are kept.
+
+    Parameters:
+    -----------
+    results: dict
+        Results loaded by load_results().
+    baselines_folder: str, optional
+        The folder with baselines.
+
+    Returns:
+    --------
+    str
+        The path of the baseline.
+    """
+    machine = results["machine"]
+    path = get_baseline_path(results["suite"], machine["fingerprint"],
+                             baselines_folder)
+    baseline = {"suite": results["suite"], "machine": machine, "benchmarks": {}}
+    if os.path.exists(path):
+        with open(path) as stream:
+            baseline["benchmarks"] = json.load(stream)["benchmarks"]
+    for result in results["results"]:
+        baseline["benchmarks"][get_result_key(result)] = {
+            **extract_metrics(result),
+            "timestamp": results["timestamp"]
+        }
+
+    os.makedirs(baselines_folder, exist_ok=True)
+    with open(path, "w") as stream:
+        json.dump(baseline, stream, indent=2, sort_keys=True)
+    print(f"Baseline saved to {path}")
+    return path
+
+
+def is_regression(name, baseline, current, threshold, noise_factor):
+    """
+    Check whether a metric regressed beyond the threshold and the noise.
+
+    Parameters:
+    -----------
+    name: str
+        The name of the metric, one of the keys of METRICS.
+    baseline: dict
+        Baseline metrics of a benchmark.
+    current: dict
+        New metrics of the benchmark.
+    threshold: float
+        The allowed relative deterioration, e.g. 0.1 for 10%.
+    noise_factor: float
+        The slowdown of medians has to exceed noise_factor times
+        the larger of interquartile ranges.
+
+    Returns:
+    --------
+    Tuple[bool, float]
+        Whether the metric regressed and its relative change
+        (positive values denote deterioration).
+    """
+    old, new = baseline[name], current[name]
+    if old == 0:
+        return False, 0.0
+    change = (old - new) / old if METRICS[name] else (new - old) / old
+    regressed = change > threshold
+    if regressed and name == "median":
+        noise = max(baseline.get("iqr", 0.0), current.get("iqr", 0.0))
+        regressed = (new - old) > noise_factor * noise
+    return regressed, change
+
+
+def compare_with_baseline(results, baselines_folder=BASELINES_FOLDER,
+                          threshold=0.1, memory_threshold=0.2,
+                          noise_factor=1.5,
+                          critical_benchmarks=CRITICAL_BENCHMARKS):
+    """
+    Compare new results of a benchmark suite with the baseline
+    of the same machine.
+
+    Parameters:
+    -----------
+    results: dict
+        Results loaded by load_results().
+    baselines_folder: str, optional
+        The folder with baselines.
+    threshold: float, optional
+        The allowed relative deterioration of timings and throughput.
+    memory_threshold: float, optional
+        The allowed relative growth of the peak memory.
+    noise_factor: float, optional
+        The required ratio of the slowdown to the interquartile range.
+    critical_benchmarks: List[str], optional
+        Names of benchmarks whose regressions fail the gate.
+
+    Returns:
+    --------
+    Tuple[List[str], List[str]]
+        Descriptions of failures (regressions of critical benchmarks)
+        and of flagged regressions of the remaining benchmarks.
+    """
+    path = get_baseline_path(results["suite"], results["machine"]["fingerprint"],
+                             baselines_folder)
+    if not os.path.exists(path):
+        raise ValueError(f"There is no baseline {path} for this machine, "
+                         "create it with update_baseline().")
+    with open(path) as stream:
+        baseline = json.load(stream)["benchmarks"]
+
+    failures, flags = [], []
+    for result in results["results"]:
+        key = get_result_key(result)
+        if key not in baseline:
+            print(f"No baseline for {key}, skipped.")
+            continue
+        current = extract_metrics(result)
+        for name in METRICS:
+            if name not in current or name not in baseline[key]:
+                continue
+            regressed, change = is_regression(
+                name, baseline[key], current,
+                memory_threshold if name == "peak_rss_mb" else threshold,
+                noise_factor
+            )
+            if not regressed:
+                continue
+            description = (f"{key}: {name} {baseline[key][name]:.6g} -> "
+                           f"{current[name]:.6g} ({100 * change:+.1f}%)")
+            if result["benchmark"] in critical_benchmarks:
+                failures.append(description)
+            else:
+                flags.append(description)
+    return failures, flags
+
+
+def get_latest_results_path(results_folder, suite):
+    """
+    Get the path of the most recent results of a benchmark suite.
+
+    Parameters:
+    -----------
+    results_folder: str
+        The folder with results saved by save_results().
+    suite: str
+        The name of the benchmark suite.
+
+    Returns:
+    --------
+    str
+        The path of the JSON file.
+    """
+    paths = sorted(glob.glob(os.path.join(results_folder, f"{suite}_*.json")))
+    if len(paths) == 0:
+        raise ValueError(f"There are no results of {suite} in {results_folder}!")
+    return paths[-1]
+
+
+if __name__ == "__main__":
+    config = {
+        # "compare" new results with the baseline or "update" the baseline
+        "mode": "compare",
+        "suite": "micro_benchmarks",
+        # If None, the most recent results of the suite are used
+        "results_path": None,
+        "results_folder": "./Results/benchmarks/",
+        "threshold": 0.1,
+        "memory_threshold": 0.2,
+        "noise_factor": 1.5
+    }
+
+    results_path = config["results_path"]
+    if results_path is None:
+        results_path = get_latest_results_path(config["results_folder"],
+                                               config["suite"])
+    results = load_results(results_path)
+
+    if config["mode"] == "update":
+        update_baseline(results)
+    elif config["mode"] == "compare":
+        failures, flags = compare_with_baseline(
+            results,
+            threshold=config["threshold"],
+            memory_threshold=config["memory_threshold"],
+            noise_factor=config["noise_factor"]
+        )
+        for description in flags:
+            print(f"FLAGGED: {description}")
+        for description in failures:
+            print(f"FAILED: {description}")
+        if len(failures) > 0:
+            sys.exit(1)
+        print(f"No critical regressions of {results_path}.")
+    else:
+        raise ValueError("Wrong mode of the regression gate!")
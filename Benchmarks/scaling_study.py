@@ -0,0 +1,265 @@
+"""
+This file implements a scaling study of the non-forced classification
+scenario: the network is trained on a stream of T synthetic tasks
+(T may reach 1000) and for each task the harness records the time of
+a training step, the time of the regularizer, the evaluation time
+of all previous tasks, the memory and the size of the checkpoint.
+The curves are plotted against the task index to show where
+the cost starts growing linearly with the number of tasks.
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+import torch
+
+# Get the parent directory path
+parent_dir = os.path.abspath(os.path.join(os.getcwd(), '.'))
+
+# Add the parent directory to sys.path
+sys.path.insert(0, parent_dir)
+
+from Benchmarks.benchmark_utils import (synchronize, get_current_rss_mb,
+                                        save_results)
+from Benchmarks.throughput_benchmark import prepare_parameters
+
+# Phases of StepProfiler which form a single optimization step
+STEP_PHASES = ["data", "hypernetwork_forward", "target_forward", "loss",
+               "regularizer", "backward", "optimizer_step"]
+
+
+def get_memory_mb(device):
+    """
+    Get the memory used by the process: the peak allocated memory
+    of the GPU since the last reset or the current RSS.
+
+    Parameters:
+    -----------
+    device: str
+        "cuda" or "cpu".
+
+    Returns:
+    --------
+    float
+        Memory in MB.
+    """
+    if "cuda" in str(device) and torch.cuda.is_available():
+        return torch.cuda.max_memory_allocated() / 2**20
+    return get_current_rss_mb()
+
+
+def summarize_profiling(filename, number_of_iterations):
+    """
+    Compute per-task times of steps and of the regularizer
+    from the file saved by StepProfiler.
+
+    Parameters:
+    -----------
+    filename: str
+        The path of profiling.csv.
+    number_of_iterations: int
+        The number of iterations of each task.
+
+    Returns:
+    --------
+    pd.DataFrame
+        Mean step time and mean regularizer time of consecutive tasks.
+    """
+    profiling = pd.read_csv(filename, sep=";")
+    step = profiling[profiling["phase"].isin(STEP_PHASES)]
+    step_time = step.groupby("task")["total_time"].sum() / number_of_iterations
+    regularizer = profiling[profiling["phase"] == "regularizer"]
+    regularizer_time = regularizer.set_index("task")["mean_time"]
+    summary = pd.DataFrame({"step_time": step_time,
+                            "regularizer_time": regularizer_time})
+    # There is no regularization during the first task
+    return summary.fillna(0.0)
+
+
+def run_scaling_study(config):
+    """
+    Train the non-forced classification scenario on a stream of synthetic
+    tasks and measure costs of consecutive tasks.
+
+    Parameters:
+    -----------
+    config: dict
+        Contains "dataset" (the imitated dataset), "number_of_tasks",
+        "number_of_iterations", "samples_per_class", "evaluation_interval"
+        (evaluation of previous tasks is measured after every
+        evaluation_interval tasks, since its total cost is quadratic in T),
+        "plots" (whether the plots of intervals around embeddings are drawn),
+        "device", "seed" and "extra_parameters".
+
+    Returns:
+    --------
+    pd.DataFrame
+        Per-task results with columns "task", "step_time",
+        "regularizer_time", "training_time", "evaluation_time",
+        "memory_mb" and "checkpoint_bytes".
+    """
+    import Training.train_non_forced_classification_scenario as scenario
+    from Utils.prepare_non_forced_scenario_params import set_hyperparameters
+    from Utils.dataset_utils import prepare_synthetic_tasks
+
+    saving_folder = tempfile.mkdtemp(prefix="hint_scaling_") + "/"
+    parameters = prepare_parameters(
+        set_hyperparameters(config["dataset"], grid_search=False),
+        config["dataset"], config, saving_folder
+    )
+    parameters["profile_steps"] = True
+    # Only checkpoints between tasks are saved
+    parameters["checkpoint_interval"] = config["number_of_iterations"]
+
+    scenario.set_seed(config["seed"])
+    tasks = prepare_synthetic_tasks(
+        config["dataset"],
+        number_of_tasks=config["number_of_tasks"],
+        samples_per_class=config["samples_per_class"],
+        seed=config["seed"],
+        padding=parameters["padding"]
+    )
+
+    measurements = {}
+    use_cuda = "cuda" in str(config["device"]) and torch.cuda.is_available()
+    original_functions = {}
+
+    def wrap(name, wrapper):
+        original_functions[name] = getattr(scenario, name)
+        setattr(scenario, name, wrapper(original_functions[name]))
+
+    def timed_training(function):
+        def wrapper(*args, **kwargs):
+            task = args[5] if len(args) > 5 else kwargs["current_no_of_task"]
+            if use_cuda:
+                torch.cuda.reset_peak_memory_stats()
+            synchronize(config["device"])
+            start = time.perf_counter()
+            result = function(*args, **kwargs)
+            synchronize(config["device"])
+            measurements[task] = {
+                "training_time": time.perf_counter() - start,
+                "evaluation_time": np.nan,
+                "memory_mb": get_memory_mb(config["device"]),
+                "checkpoint_bytes": np.nan
+            }
+            return result
+        return wrapper
+
+    def timed_evaluation(function):
+        def wrapper(hypernetwork, target_network, dataframe, tasks, parameters):
+            task = parameters["number_of_task"]
+            if (task + 1) % config["evaluation_interval"] != 0 and \
+               task != config["number_of_tasks"] - 1:
+                return dataframe
+            synchronize(config["device"])
+            start = time.perf_counter()
+            dataframe = function(hypernetwork, target_network, dataframe,
+                                 tasks, parameters)
+            synchronize(config["device"])
+            measurements[task]["evaluation_time"] = time.perf_counter() - start
+            return dataframe
+        return wrapper
+
+    def measured_checkpoint(function):
+        def wrapper(folder, state):
+            function(folder, state)
+            if state["iteration"] == 0:
+                measurements[state["task"] - 1]["checkpoint_bytes"] = \
+                    os.path.getsize(scenario.get_checkpoint_path(folder))
+        return wrapper
+
+    def skipped_plot(function):
+        def wrapper(*args, **kwargs):
+            if config["plots"]:
+                return function(*args, **kwargs)
+        return wrapper
+
+    wrap("train_single_task", timed_training)
+    wrap("evaluate_previous_classification_tasks", timed_evaluation)
+    wrap("save_training_checkpoint", measured_checkpoint)
+    wrap("plot_intervals_around_embeddings", skipped_plot)
+    try:
+        scenario.build_multiple_task_experiment(
+            tasks, parameters, use_chunks=parameters["use_chunks"]
+        )
+        profiling = summarize_profiling(f"{saving_folder}/profiling.csv",
+                                        config["number_of_iterations"])
+    finally:
+        for name, function in original_functions.items():
+            setattr(scenario, name, function)
+        shutil.rmtree(saving_folder, ignore_errors=True)
+
+    results = pd.DataFrame.from_dict(measurements, orient="index")
+    results = results.join(profiling)
+    results.index.name = "task"
+    return results.reset_index()
+
+
+def plot_scaling_curves(results, saving_folder):
+    """
+    Plot measured costs against the task index.
+
+    Parameters:
+    -----------
+    results: pd.DataFrame
+        Per-task results returned by run_scaling_study().
+    saving_folder: str
+        The folder where the plot is saved.
+    """
+    curves = [
+        ("step_time", "Step time [s]"),
+        ("regularizer_time", "Regularizer time [s]"),
+        ("evaluation_time", "Evaluation of previous tasks [s]"),
+        ("memory_mb", "Memory [MB]"),
+        ("checkpoint_bytes", "Checkpoint size [B]")
+    ]
+    fig, axes = plt.subplots(1, len(curves), figsize=(5 * len(curves), 4))
+    for ax, (column, label) in zip(axes, curves):
+        measured = results[~results[column].isna()]
+        ax.plot(measured["task"], measured[column], marker=".")
+        ax.set_xlabel("Task index")
+        ax.set_ylabel(label)
+        ax.grid()
+    plt.tight_layout()
+    os.makedirs(saving_folder, exist_ok=True)
+    plt.savefig(os.path.join(saving_folder, "scaling_study.png"), dpi=150)
+    plt.close()
+
+
+if __name__ == "__main__":
+    config = {
+        # Imitated dataset, i.e. the input shape, the target network
+        # and hyperparameters of the single run experiment
+        "dataset": "PermutedMNIST",
+        "number_of_tasks": 100,
+        "number_of_iterations": 50,
+        # Training, validation and test samples per class; they are kept
+        # small since all tasks are stored in memory
+        "samples_per_class": (20, 2, 5),
+        "evaluation_interval": 10,
+        "plots": False,
+        "device": "cuda" if torch.cuda.is_available() else "cpu",
+        "extra_parameters": {"best_model_selection_method": "last_model"},
+        "seed": 1,
+        "saving_folder": "./Results/benchmarks/"
+    }
+
+    results = run_scaling_study(config)
+    os.makedirs(config["saving_folder"], exist_ok=True)
+    results.to_csv(os.path.join(config["saving_folder"], "scaling_study.csv"),
+                   sep=";", index=False)
+    plot_scaling_curves(results, config["saving_folder"])
+    save_results(
+        [{"benchmark": "scaling_study",
+          "params": {key: config[key] for key in
+                     ["dataset", "number_of_tasks", "number_of_iterations"]},
+          "tasks": results.replace({np.nan: None}).to_dict(orient="list")}],
+        config["saving_folder"], "scaling_study"
+    )
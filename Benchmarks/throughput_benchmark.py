@@ -0,0 +1,283 @@
+"""
+This file implements an end-to-end throughput benchmark of the training
+scenarios (non-forced classification, nested classification and non-forced
+regression) on synthetic datasets, so it does not require any downloads.
+For each scenario it reports training iterations per second, the latency
+of the evaluation of previous tasks and the peak resident memory.
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import importlib
+import multiprocessing as mp
+
+import numpy as np
+import torch
+
+# Get the parent directory path
+parent_dir = os.path.abspath(os.path.join(os.getcwd(), '.'))
+
+# Add the parent directory to sys.path
+sys.path.insert(0, parent_dir)
+
+from Benchmarks.benchmark_utils import (synchronize, get_peak_rss_mb,
+                                        save_results)
+
+# Training module, module with hyperparameters and the function
+# evaluating previous tasks for each scenario
+SCENARIOS = {
+    "non_forced_classification": (
+        "Training.train_non_forced_classification_scenario",
+        "Utils.prepare_non_forced_scenario_params",
+        "evaluate_previous_classification_tasks"
+    ),
+    "nested_classification": (
+        "Training.train_nested_classification_scenario",
+        "Utils.prepare_nested_scenario_params",
+        "evaluate_previous_classification_tasks"
+    ),
+    "non_forced_regression": (
+        "Training.train_non_forced_regression_scenario",
+        "Utils.prepare_non_forced_scenario_params",
+        "evaluate_previous_regression_tasks"
+    ),
+}
+
+
+def prepare_parameters(hyperparameters, dataset, config, saving_folder):
+    """
+    Prepare parameters of a single run from the hyperparameters of
+    the given dataset (the first value of each searched list is taken),
+    overwriting the length of the training.
+
+    Parameters:
+    -----------
+    hyperparameters: dict
+        Hyperparameters returned by set_hyperparameters().
+    dataset: str
+        The name of the dataset.
+    config: dict
+        The configuration of the benchmark.
+    saving_folder: str
+        A temporary folder for files written during the training.
+
+    Returns:
+    --------
+    dict
+        Parameters of the run.
+    """
+    parameters = {
+        "input_shape": hyperparameters["shape"],
+        "augmentation": hyperparameters["augmentation"],
+        "number_of_tasks": config["number_of_tasks"],
+        "seed": config["seed"],
+        "dataset": dataset,
+        "hypernetwork_hidden_layers": hyperparameters["hypernetworks_hidden_layers"][0],
+        "activation_function": hyperparameters["activation_function"],
+        "use_chunks": hyperparameters["use_chunks"],
+        "target_network": hyperparameters["target_network"],
+        "target_hidden_layers": hyperparameters["target_hidden_layers"],
+        "resnet_number_of_layer_groups": hyperparameters["resnet_number_of_layer_groups"],
+        "resnet_widening_factor": hyperparameters["resnet_widening_factor"],
+        "learning_rate": hyperparameters["learning_rates"][0],
+        "best_model_selection_method": hyperparameters["best_model_selection_method"],
+        "lr_scheduler": False,
+        "batch_size": hyperparameters["batch_sizes"][0],
+        "no_of_validation_samples": hyperparameters["no_of_validation_samples"],
+        "number_of_epochs": None,
+        "number_of_iterations": config["number_of_iterations"],
+        "embedding_size": hyperparameters["embedding_sizes"][0],
+        "optimizer": hyperparameters["optimizer"],
+        "beta": hyperparameters["betas"][0],
+        "padding": hyperparameters["padding"],
+        "use_bias": hyperparameters["use_bias"],
+        "use_batch_norm": hyperparameters["use_batch_norm"],
+        "device": config["device"],
+        "saving_folder": saving_folder,
+        "grid_search_folder": saving_folder,
+        "summary_results_filename": "summary_results",
+        "perturbated_epsilon": hyperparameters["perturbated_epsilon"][0],
+        "kappa": hyperparameters["kappa"],
+        "dropout_rate": hyperparameters["dropout_rate"][0],
+        "full_interval": hyperparameters["full_interval"],
+        "custom_init": hyperparameters.get("custom_init", [False])[0]
+    }
+    if "no_of_validation_samples_per_class" in hyperparameters:
+        parameters["no_of_validation_samples_per_class"] = hyperparameters[
+            "no_of_validation_samples_per_class"
+        ]
+    # e.g. mixed_precision or profile_steps of the non-forced scenario
+    parameters.update(config.get("extra_parameters", {}))
+    return parameters
+
+
+def prepare_tasks(scenario, dataset, config, padding=None):
+    """
+    Prepare synthetic tasks of a given scenario.
+
+    Parameters:
+    -----------
+    scenario: str
+        The name of the scenario.
+    dataset: str
+        The name of the imitated dataset.
+    config: dict
+        The configuration of the benchmark.
+    padding: int, optional
+        Padding value for the PermutedMNIST dataset.
+
+    Returns:
+    --------
+    A list of tasks.
+    """
+    from Utils.dataset_utils import (prepare_synthetic_tasks,
+                                     prepare_gaussian_regression_tasks,
+                                     prepare_toy_regression_tasks)
+    if scenario == "non_forced_regression":
+        # Regression datasets are synthetic anyway; they have exactly 5 tasks
+        if dataset == "GaussianDataset":
+            tasks = prepare_gaussian_regression_tasks(seed=config["seed"])
+        else:
+            tasks = prepare_toy_regression_tasks(seed=config["seed"])
+        return tasks[:config["number_of_tasks"]]
+    return prepare_synthetic_tasks(
+        dataset,
+        number_of_tasks=config["number_of_tasks"],
+        samples_per_class=config["samples_per_class"],
+        seed=config["seed"],
+        padding=padding
+    )
+
+
+def run_scenario(scenario, dataset, config):
+    """
+    Train a given scenario on synthetic tasks and measure its throughput.
+    It should be run in a separate process to measure its peak memory.
+
+    Parameters:
+    -----------
+    scenario: str
+        The name of the scenario, one of the keys of SCENARIOS.
+    dataset: str
+        The name of the imitated dataset.
+    config: dict
+        The configuration of the benchmark.
+
+    Returns:
+    --------
+    dict
+        Measured iterations per second, evaluation latency and peak RSS.
+    """
+    module_name, parameters_module_name, evaluation_name = SCENARIOS[scenario]
+    if config["number_of_threads"] is not None:
+        torch.set_num_threads(config["number_of_threads"])
+    module = importlib.import_module(module_name)
+    hyperparameters = importlib.import_module(
+        parameters_module_name).set_hyperparameters(dataset, grid_search=False)
+
+    saving_folder = tempfile.mkdtemp(prefix="hint_benchmark_") + "/"
+    parameters = prepare_parameters(hyperparameters, dataset, config, saving_folder)
+    module.set_seed(config["seed"])
+    tasks = prepare_tasks(scenario, dataset, config, parameters["padding"])
+    parameters["number_of_tasks"] = len(tasks)
+
+    # Measure the training of tasks and evaluations by wrapping
+    # functions used by build_multiple_task_experiment
+    timings = {"train_single_task": [], evaluation_name: []}
+
+    def timed(name, function):
+        def wrapper(*args, **kwargs):
+            synchronize(config["device"])
+            start = time.perf_counter()
+            result = function(*args, **kwargs)
+            synchronize(config["device"])
+            timings[name].append(time.perf_counter() - start)
+            return result
+        return wrapper
+
+    for name in timings:
+        setattr(module, name, timed(name, getattr(module, name)))
+
+    start = time.perf_counter()
+    try:
+        module.build_multiple_task_experiment(tasks, parameters,
+                                              use_chunks=parameters["use_chunks"])
+    finally:
+        shutil.rmtree(saving_folder, ignore_errors=True)
+    total_time = time.perf_counter() - start
+
+    training_time = sum(timings["train_single_task"])
+    number_of_iterations = parameters["number_of_iterations"] * len(tasks)
+    return {
+        "benchmark": f"{scenario}_throughput",
+        "params": {"dataset": dataset,
+                   "target_network": parameters["target_network"],
+                   "number_of_tasks": len(tasks),
+                   "number_of_iterations": parameters["number_of_iterations"],
+                   "batch_size": parameters["batch_size"],
+                   "device": config["device"]},
+        "iterations_per_second": number_of_iterations / training_time,
+        # The latency of the evaluation of all previous tasks after each task
+        "evaluation_latency": float(np.median(timings[evaluation_name])),
+        "evaluation_latencies": timings[evaluation_name],
+        "total_time": total_time,
+        "peak_rss_mb": get_peak_rss_mb()
+    }
+
+
+def run_throughput_benchmarks(config):
+    """
+    Run the throughput benchmark of all selected scenarios, each one
+    in a fresh process.
+
+    Parameters:
+    -----------
+    config: dict
+        Contains "scenarios" (a dictionary mapping names of scenarios
+        to names of imitated datasets), "number_of_tasks",
+        "number_of_iterations", "samples_per_class", "device",
+        "number_of_threads", "seed" and, optionally, "extra_parameters".
+
+    Returns:
+    --------
+    List[dict]
+        Results of consecutive scenarios.
+    """
+    results = []
+    context = mp.get_context("spawn")
+    for scenario, dataset in config["scenarios"].items():
+        with context.Pool(processes=1) as pool:
+            result = pool.apply(run_scenario, (scenario, dataset, config))
+        print(f'{scenario} ({dataset}): '
+              f'{result["iterations_per_second"]:.2f} it/s, '
+              f'evaluation latency: {result["evaluation_latency"]:.3f} s, '
+              f'peak RSS: {result["peak_rss_mb"]:.1f} MB')
+        results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+    config = {
+        # Scenarios and imitated datasets
+        "scenarios": {
+            "non_forced_classification": "SplitMNIST",
+            "nested_classification": "SplitMNIST",
+            "non_forced_regression": "GaussianDataset"
+        },
+        "number_of_tasks": 3,
+        "number_of_iterations": 200,
+        # Training, validation and test samples per class
+        "samples_per_class": (200, 20, 50),
+        "device": "cuda" if torch.cuda.is_available() else "cpu",
+        "number_of_threads": None,
+        # Additional parameters passed to all scenarios
+        "extra_parameters": {},
+        "seed": 1,
+        "saving_folder": "./Results/benchmarks/"
+    }
+
+    results = run_throughput_benchmarks(config)
+    save_results(results, config["saving_folder"], "throughput_benchmark")
@@ -0,0 +1,272 @@
+"""
+Batched tensor implementations of AutoAugment policies (CIFAR10Policy and
+ImageNetPolicy from FeCAM, see cifar100_FeCAM.py and subset_image_net.py).
+Operations follow their PIL counterparts but work on whole uint8 batches
+of the shape [B, C, H, W]: each sample draws its own sub-policy, random
+signs and probabilities, and samples sharing an operation are transformed
+together.
+"""
+import math
+
+import torch
+import torch.nn.functional as F
+
+# PIL weights of the conversion to grayscale
+GRAYSCALE_WEIGHTS = (0.299, 0.587, 0.114)
+
+
+def _to_uint8(x):
+    """Round float images and convert them to uint8."""
+    return x.round().clamp(0, 255).to(torch.uint8)
+
+
+def _random_signs(number_of_samples, device):
+    """Draw -1 or 1 for each sample."""
+    return torch.randint(0, 2, (number_of_samples,), device=device).float() * 2 - 1
+
+
+def _affine(x, matrix, mode, fill=128):
+    """
+    Transform images as Image.transform(size, Image.AFFINE, ...) of PIL,
+    i.e. each output pixel (x, y) is sampled from the input image at
+    matrix @ (x, y, 1), in pixel coordinates with pixel centers at 0.5.
+
+    Parameters:
+    -----------
+        x: torch.Tensor
+            uint8 images of the shape [B, C, H, W].
+        matrix: torch.Tensor
+            Affine matrices of the shape [B, 3, 3].
+        mode: str
+            "nearest", "bilinear" or "bicubic".
+        fill: int
+            The value of pixels outside of images.
+
+    Returns:
+    --------
+        (torch.Tensor): Transformed uint8 images.
+    """
+    number_of_samples, channels, height, width = x.shape
+    to_pixels = torch.tensor([[width / 2, 0, width / 2],
+                              [0, height / 2, height / 2],
+                              [0, 0, 1]], device=x.device)
+    to_normalized = torch.tensor([[2 / width, 0, -1],
+                                  [0, 2 / height, -1],
+                                  [0, 0, 1]], device=x.device)
+    theta = (to_normalized @ matrix @ to_pixels)[:, :2]
+    grid = F.affine_grid(theta, [number_of_samples, channels, height, width],
+                         align_corners=False)
+    # Zeros of grid_sample outside of images correspond to the fill value
+    shifted = x.float() - fill
+    x = F.grid_sample(shifted, grid, mode=mode, padding_mode="zeros",
+                      align_corners=False) + fill
+    return _to_uint8(x)
+
+
+def _affine_matrices(number_of_samples, device):
+    """Identity matrices of the shape [B, 3, 3]."""
+    return torch.eye(3, device=device).repeat(number_of_samples, 1, 1)
+
+
+def shear_x(x, magnitude):
+    matrix = _affine_matrices(x.shape[0], x.device)
+    matrix[:, 0, 1] = magnitude * _random_signs(x.shape[0], x.device)
+    return _affine(x, matrix, "bicubic")
+
+
+def shear_y(x, magnitude):
+    matrix = _affine_matrices(x.shape[0], x.device)
+    matrix[:, 1, 0] = magnitude * _random_signs(x.shape[0], x.device)
+    return _affine(x, matrix, "bicubic")
+
+
+def translate_x(x, magnitude):
+    matrix = _affine_matrices(x.shape[0], x.device)
+    matrix[:, 0, 2] = magnitude * x.shape[3] * _random_signs(x.shape[0], x.device)
+    return _affine(x, matrix, "nearest")
+
+
+def translate_y(x, magnitude):
+    matrix = _affine_matrices(x.shape[0], x.device)
+    matrix[:, 1, 2] = magnitude * x.shape[2] * _random_signs(x.shape[0], x.device)
+    return _affine(x, matrix, "nearest")
+
+
+def rotate(x, magnitude):
+    # Rotation around the center of images, as Image.rotate
+    angle = -math.radians(magnitude) * _random_signs(x.shape[0], x.device)
+    cos, sin = torch.cos(angle), torch.sin(angle)
+    center_x, center_y = x.shape[3] / 2, x.shape[2] / 2
+    matrix = _affine_matrices(x.shape[0], x.device)
+    matrix[:, 0, 0], matrix[:, 0, 1] = cos, sin
+    matrix[:, 1, 0], matrix[:, 1, 1] = -sin, cos
+    matrix[:, 0, 2] = center_x - cos * center_x - sin * center_y
+    matrix[:, 1, 2] = center_y + sin * center_x - cos * center_y
+    return _affine(x, matrix, "nearest")
+
+
+def _blend(degenerate, x, factors):
+    """Blend images with degenerate images, as ImageEnhance of PIL."""
+    factors = factors.view(-1, 1, 1, 1)
+    return _to_uint8(degenerate + factors * (x.float() - degenerate))
+
+
+def _grayscale(x):
+    """Grayscale versions of RGB images, of the shape [B, 1, H, W]."""
+    weights = torch.tensor(GRAYSCALE_WEIGHTS, device=x.device).view(1, 3, 1, 1)
+    return (x.float() * weights).sum(dim=1, keepdim=True).round()
+
+
+def _enhancement_factors(x, magnitude):
+    return 1 + magnitude * _random_signs(x.shape[0], x.device)
+
+
+def color(x, magnitude):
+    return _blend(_grayscale(x), x, _enhancement_factors(x, magnitude))
+
+
+def contrast(x, magnitude):
+    mean = torch.floor(_grayscale(x).mean(dim=(1, 2, 3), keepdim=True) + 0.5)
+    return _blend(mean, x, _enhancement_factors(x, magnitude))
+
+
+def brightness(x, magnitude):
+    return _blend(torch.zeros_like(x, dtype=torch.float), x,
+                  _enhancement_factors(x, magnitude))
+
+
+def sharpness(x, magnitude):
+    # The smoothing filter of PIL; border pixels are not changed
+    kernel = torch.ones(3, 3, device=x.device)
+    kernel[1, 1] = 5
+    kernel = (kernel / kernel.sum()).expand(x.shape[1], 1, 3, 3)
+    smoothed = F.conv2d(x.float(), kernel, groups=x.shape[1]).round()
+    degenerate = x.float().clone()
+    degenerate[:, :, 1:-1, 1:-1] = smoothed
+    return _blend(degenerate, x, _enhancement_factors(x, magnitude))
+
+
+def posterize(x, magnitude):
+    mask = (0xFF << (8 - int(magnitude))) & 0xFF
+    return torch.bitwise_and(x, mask)
+
+
+def solarize(x, magnitude):
+    return torch.where(x.float() >= magnitude, 255 - x, x)
+
+
+def autocontrast(x, magnitude):
+    low = x.amin(dim=(2, 3), keepdim=True).float()
+    high = x.amax(dim=(2, 3), keepdim=True).float()
+    scale = 255.0 / (high - low).clamp(min=1)
+    stretched = torch.floor((x.float() - low) * scale).clamp(0, 255).to(torch.uint8)
+    # Channels with a single value are not changed
+    return torch.where(high > low, stretched, x)
+
+
+def equalize(x, magnitude):
+    number_of_samples, channels, height, width = x.shape
+    flat = x.reshape(number_of_samples * channels, height * width).long()
+    histogram = torch.zeros(flat.shape[0], 256, device=x.device)
+    histogram.scatter_add_(1, flat, torch.ones_like(flat, dtype=torch.float))
+    # The count of the last non-empty bin, as in ImageOps.equalize
+    last_bin = 255 - torch.argmax((histogram.flip(1) > 0).int(), dim=1, keepdim=True)
+    step = torch.floor(
+        (histogram.sum(dim=1, keepdim=True) - histogram.gather(1, last_bin)) / 255
+    )
+    counts_before = torch.cumsum(histogram, dim=1) - histogram
+    lut = torch.floor((torch.floor(step / 2) + counts_before) / step.clamp(min=1))
+    lut = torch.where(step > 0, lut.clamp(0, 255),
+                      torch.arange(256, device=x.device).float().expand_as(lut))
+    equalized = lut.gather(1, flat).to(torch.uint8)
+    return equalized.view(number_of_samples, channels, height, width)
+
+
+def invert(x, magnitude):
+    return 255 - x
+
+
+# Batched counterparts of operations of sub-policies, by their class names
+BATCHED_OPERATIONS = {
+    "ShearX": shear_x,
+    "ShearY": shear_y,
+    "TranslateX": translate_x,
+    "TranslateY": translate_y,
+    "Rotate": rotate,
+    "Color": color,
+    "Posterize": posterize,
+    "Solarize": solarize,
+    "Contrast": contrast,
+    "Sharpness": sharpness,
+    "Brightness": brightness,
+    "AutoContrast": autocontrast,
+    "Equalize": equalize,
+    "Invert": invert,
+}
+
+
+class BatchedAutoAugment:
+    """
+    Apply an AutoAugment policy to a batch of images: each image draws one
+    of sub-policies, whose two operations are applied with their probabilities.
+
+    Parameters:
+    -----------
+        policy: CIFAR10Policy or ImageNetPolicy
+            The policy whose sub-policies (probabilities, operations and
+            magnitudes) are applied.
+    """
+    def __init__(self, policy):
+        self.sub_policies = [
+            [(sub_policy.p1, BATCHED_OPERATIONS[type(sub_policy.operation1).__name__],
+              sub_policy.magnitude1),
+             (sub_policy.p2, BATCHED_OPERATIONS[type(sub_policy.operation2).__name__],
+              sub_policy.magnitude2)]
+            for sub_policy in policy.policies
+        ]
+
+    def __call__(self, x):
+        """
+        Parameters:
+        -----------
+            x: torch.Tensor
+                uint8 images of the shape [B, C, H, W].
+
+        Returns:
+        --------
+            (torch.Tensor): Augmented uint8 images.
+        """
+        # Choices are drawn on the CPU, so selecting samples does not
+        # synchronize the device
+        choices = torch.randint(len(self.sub_policies), (x.shape[0],))
+        draws = torch.rand(x.shape[0], 2)
+        x = x.clone()
+        for i, operations in enumerate(self.sub_policies):
+            for stage, (probability, operation, magnitude) in enumerate(operations):
+                indices = torch.nonzero(
+                    (choices == i) & (draws[:, stage] < probability)
+                ).squeeze(1)
+                if indices.shape[0] > 0:
+                    indices = indices.to(x.device)
+                    x[indices] = operation(x[indices], magnitude)
+        return x
+
+
+class RandomBrightness:
+    """
+    Change the brightness of images by random factors, as
+    transforms.ColorJitter(brightness=...) on a batch of images.
+
+    Parameters:
+    -----------
+        brightness: float
+            Factors are drawn uniformly from [1 - brightness, 1 + brightness].
+    """
+    def __init__(self, brightness):
+        self.brightness = brightness
+
+    def __call__(self, x):
+        factors = torch.empty(x.shape[0], device=x.device).uniform_(
+            max(0.0, 1 - self.brightness), 1 + self.brightness
+        )
+        return _blend(torch.zeros_like(x, dtype=torch.float), x, factors)
@@ -0,0 +1,193 @@
+"""
+Batched image transforms operating on whole uint8 batches of images.
+Random crops, horizontal flips and resizing of all images of a batch
+are expressed as per-sample affine transformations and computed by
+a single call of grid_sample, so they run on the device of the batch
+instead of transforming PIL images one by one. Photometric augmentations
+(see batched_autoaugment.py) may follow on the transformed uint8 images.
+"""
+import math
+
+import torch
+import torch.nn.functional as F
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+
+class BatchedImageTransform:
+    """
+    A transformation of a batch of images: an optional random crop
+    (with padding, as transforms.RandomCrop, or with a random scale and
+    aspect ratio, as transforms.RandomResizedCrop) or a central crop,
+    an optional random horizontal flip, resizing to the output size,
+    optional augmentations and standardization.
+
+    Parameters:
+    -----------
+        output_size: int
+            The height and width of transformed images.
+        mean: Tuple[float]
+            Means of consecutive channels used for standardization.
+        std: Tuple[float]
+            Standard deviations of consecutive channels.
+        crop: str, optional
+            "none", "center", "random" (a random crop of the size of
+            the image from the image padded with crop_padding zero pixels)
+            or "random_resized".
+        crop_padding: int, optional
+            Padding used by the "random" crop.
+        center_crop_fraction: float, optional
+            The fraction of the image side kept by the "center" crop.
+        scale: Tuple[float], optional
+            The range of fractions of the image area cropped
+            by the "random_resized" crop.
+        ratio: Tuple[float], optional
+            The range of aspect ratios of the "random_resized" crop.
+        horizontal_flip: bool, optional
+            Whether images are flipped horizontally with probability 0.5.
+        augmentation: callable or List[callable], optional
+            Augmentations of uint8 images of the shape [B, C, H, W] applied
+            after geometric transformations, e.g. BatchedAutoAugment.
+    """
+    def __init__(self, output_size, mean=IMAGENET_MEAN, std=IMAGENET_STD,
+                 crop="none", crop_padding=0, center_crop_fraction=1.0,
+                 scale=(0.08, 1.0), ratio=(3.0 / 4.0, 4.0 / 3.0),
+                 horizontal_flip=False, augmentation=None):
+        if crop not in ["none", "center", "random", "random_resized"]:
+            raise ValueError("Wrong type of the crop!")
+        self.output_size = output_size
+        self.mean = mean
+        self.std = std
+        self.crop = crop
+        self.crop_padding = crop_padding
+        self.center_crop_fraction = center_crop_fraction
+        self.scale = scale
+        self.ratio = ratio
+        self.horizontal_flip = horizontal_flip
+        if augmentation is None:
+            augmentation = []
+        elif callable(augmentation):
+            augmentation = [augmentation]
+        self.augmentation = list(augmentation)
+
+    def __call__(self, x):
+        """
+        Transform a batch of images.
+
+        Parameters:
+        -----------
+            x: torch.Tensor
+                uint8 images of the shape [B, C, H, W] with values
+                from 0 to 255.
+
+        Returns:
+        --------
+            (torch.Tensor): Standardized float images of the shape
+            [B, C, output_size, output_size].
+        """
+        assert x.dim() == 4
+        x = x.float() / 255.0
+        batch_size, _, height, width = x.shape
+        # Half sizes and centers of crops, as fractions of the image,
+        # i.e. in normalized coordinates in [-1, 1]
+        half_width, half_height, center_x, center_y = self._sample_crops(
+            batch_size, height, width, x.device
+        )
+        if self.horizontal_flip:
+            flip = torch.rand(batch_size, device=x.device) < 0.5
+            half_width = torch.where(flip, -half_width, half_width)
+        no_geometric_change = (
+            self.crop == "none" and not self.horizontal_flip and
+            height == self.output_size and width == self.output_size
+        )
+        if not no_geometric_change:
+            zeros = torch.zeros_like(half_width)
+            theta = torch.stack([
+                torch.stack([half_width, zeros, center_x], dim=1),
+                torch.stack([zeros, half_height, center_y], dim=1)
+            ], dim=1)
+            grid = F.affine_grid(
+                theta, [batch_size, x.shape[1], self.output_size, self.output_size],
+                align_corners=False
+            )
+            # Pixels outside of images are zeros, as in padded images
+            x = F.grid_sample(x, grid, mode="bilinear", padding_mode="zeros",
+                              align_corners=False)
+        if self.augmentation:
+            x = (x * 255.0).round().clamp(0, 255).to(torch.uint8)
+            for augmentation in self.augmentation:
+                x = augmentation(x)
+            x = x.float() / 255.0
+        mean = torch.tensor(self.mean, device=x.device).view(1, -1, 1, 1)
+        std = torch.tensor(self.std, device=x.device).view(1, -1, 1, 1)
+        return (x - mean) / std
+
+    def _sample_crops(self, batch_size, height, width, device):
+        """
+        Draw crops of consecutive images of a batch.
+
+        Parameters:
+        -----------
+            batch_size: int
+                The number of images.
+            height: int
+                The height of images.
+            width: int
+                The width of images.
+            device: torch.device
+                The device of the batch.
+
+        Returns:
+        --------
+            A tuple of tensors of the shape [B]: half widths, half heights,
+            horizontal centers and vertical centers of crops
+            in normalized coordinates.
+        """
+        ones = torch.ones(batch_size, device=device)
+        zeros = torch.zeros(batch_size, device=device)
+        if self.crop == "none":
+            return ones, ones, zeros, zeros
+        if self.crop == "center":
+            fraction = self.center_crop_fraction * ones
+            return fraction, fraction, zeros, zeros
+        if self.crop == "random":
+            # Integer shifts in pixels, as crops of the padded image
+            shifts = torch.randint(
+                -self.crop_padding, self.crop_padding + 1,
+                (2, batch_size), device=device
+            ).float()
+            return ones, ones, 2 * shifts[0] / width, 2 * shifts[1] / height
+
+        # Random resized crop: 10 trials for each image, as in
+        # transforms.RandomResizedCrop, with the whole image as a fallback
+        area = height * width
+        trials = 10
+        target_area = area * torch.empty(batch_size, trials, device=device).uniform_(
+            *self.scale
+        )
+        log_ratio = torch.empty(batch_size, trials, device=device).uniform_(
+            math.log(self.ratio[0]), math.log(self.ratio[1])
+        )
+        aspect_ratio = torch.exp(log_ratio)
+        crop_width = torch.round(torch.sqrt(target_area * aspect_ratio))
+        crop_height = torch.round(torch.sqrt(target_area / aspect_ratio))
+        valid = (crop_width > 0) & (crop_width <= width) & \
+                (crop_height > 0) & (crop_height <= height)
+        first_valid = torch.argmax(valid.int(), dim=1, keepdim=True)
+        any_valid = valid.any(dim=1)
+        crop_width = torch.where(
+            any_valid, crop_width.gather(1, first_valid).squeeze(1),
+            torch.full_like(ones, width)
+        )
+        crop_height = torch.where(
+            any_valid, crop_height.gather(1, first_valid).squeeze(1),
+            torch.full_like(ones, height)
+        )
+        top = torch.floor(torch.rand(batch_size, device=device) *
+                          (height - crop_height + 1))
+        left = torch.floor(torch.rand(batch_size, device=device) *
+                           (width - crop_width + 1))
+        return (crop_width / width, crop_height / height,
+                (2 * left + crop_width) / width - 1,
+                (2 * top + crop_height) / height - 1)
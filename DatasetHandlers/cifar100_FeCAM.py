@@ -20,6 +20,12 @@ from PIL import Image, ImageEnhance, ImageOps
 from hypnettorch.data.dataset import Dataset
 from hypnettorch.data.cifar10_data import CIFAR10Data
 from hypnettorch.data.special.split_cifar import _transform_split_outputs
+from DatasetHandlers.shared_base_dataset import initialize_from_shared_base
+from DatasetHandlers.batched_transforms import BatchedImageTransform
+from DatasetHandlers.batched_autoaugment import BatchedAutoAugment, RandomBrightness
+
+CIFAR100_MEAN = (0.5071, 0.4867, 0.4408)
+CIFAR100_STD = (0.2675, 0.2565, 0.2761)
 
 
 class CIFAR100Data(Dataset):
@@ -53,6 +59,15 @@ class CIFAR100Data(Dataset):
             ``8 x 8`` as recommended
             `here <https://arxiv.org/pdf/1708.04552.pdf>`__.
 
+            Note:
+                Only applies if ``use_data_augmentation`` is set.
+        use_batched_augmentation: bool
+            Whether augmentations are applied to whole batches of tensors
+            on the target device (see :class:`BatchedImageTransform` and
+            :class:`BatchedAutoAugment`) instead of PIL images one by one.
+            The batched pipeline does not reproduce the original one exactly,
+            hence it is disabled by default.
+
             Note:
                 Only applies if ``use_data_augmentation`` is set.
     """
@@ -72,6 +87,7 @@ class CIFAR100Data(Dataset):
         use_data_augmentation=False,
         validation_size=5000,
         use_cutout=False,
+        use_batched_augmentation=False,
     ):
         super().__init__()
 
@@ -132,6 +148,7 @@ class CIFAR100Data(Dataset):
 
         # Initialize PyTorch data augmentation.
         self._augment_inputs = False
+        self._use_batched_augmentation = use_batched_augmentation
         if use_data_augmentation:
             self._augment_inputs = True
             self._torch_input_transforms()
@@ -284,6 +301,8 @@ class CIFAR100Data(Dataset):
                     '"%s" not a valid value for argument "mode".' % mode
                 )
 
+            if self._use_batched_augmentation:
+                return self._batched_augment_images(x, device, mode)
             return CIFAR10Data.torch_augment_images(x, device, transform)
 
         else:
@@ -372,11 +391,36 @@ class CIFAR100Data(Dataset):
 
         return plot_configs
 
+    def _batched_augment_images(self, x, device, mode):
+        """Transform a whole batch of images on the target device.
+
+        Parameters:
+        -----------
+            x: np.ndarray
+                Flattened images with values in [0, 1], as returned
+                by :meth:`next_train_batch`.
+            device: torch.device or str
+                The device on which images are transformed.
+            mode: str
+                "train" or "inference".
+
+        Returns:
+        --------
+            (torch.Tensor): Transformed images, flattened as the input,
+            i.e. in the format of :meth:`CIFAR10Data.torch_augment_images`.
+        """
+        if mode == "train":
+            transform = self._batched_train_transform
+        else:
+            transform = self._batched_test_transform
+        x = torch.from_numpy((np.asarray(x) * 255.0).astype("uint8")).to(device)
+        x = x.view(-1, *self.in_shape).permute(0, 3, 1, 2)
+        x = transform(x).permute(0, 2, 3, 1)
+        return x.contiguous().view(-1, int(np.prod(self.in_shape)))
+
     def _torch_input_transforms(self):
 
-        normalize = transforms.Normalize(
-            mean=(0.5071, 0.4867, 0.4408), std=(0.2675, 0.2565, 0.2761)
-        )
+        normalize = transforms.Normalize(mean=CIFAR100_MEAN, std=CIFAR100_STD)
 
         self._train_transform = transforms.Compose(
             [
@@ -398,6 +442,46 @@ class CIFAR100Data(Dataset):
             ]
         )
 
+        # The same pipelines applied to whole batches of tensors
+        (
+            self._batched_train_transform,
+            self._batched_test_transform,
+        ) = CIFAR100Data.batched_input_transforms()
+
+    @staticmethod
+    def batched_input_transforms(use_data_augmentation=True):
+        """
+        Prepare the pipelines of :meth:`_torch_input_transforms` applied
+        to whole batches of uint8 images.
+
+        Parameters:
+        -----------
+            use_data_augmentation: bool
+                If False, training images are only standardized.
+
+        Returns:
+        --------
+            A tuple containing **train_transform** and **test_transform**.
+        """
+        test_transform = BatchedImageTransform(
+            32, mean=CIFAR100_MEAN, std=CIFAR100_STD
+        )
+        if not use_data_augmentation:
+            return test_transform, test_transform
+        train_transform = BatchedImageTransform(
+            32,
+            mean=CIFAR100_MEAN,
+            std=CIFAR100_STD,
+            crop="random",
+            crop_padding=4,
+            horizontal_flip=True,
+            augmentation=[
+                RandomBrightness(63 / 255),
+                BatchedAutoAugment(CIFAR10Policy()),
+            ],
+        )
+        return train_transform, test_transform
+
 
 class SplitCIFAR100Data_FeCAM(CIFAR100Data):
     """An instance of the class shall represent a single SplitCIFAR-100 task.
@@ -421,6 +505,8 @@ class SplitCIFAR100Data_FeCAM(CIFAR100Data):
             CIFAR-10.
         use_cutout: bool
             See docstring of class :class:`data.cifar10_data.CIFAR10Data`.
+        use_batched_augmentation: bool
+            See docstring of class :class:`CIFAR100Data`.
         labels: Iterable
             The labels that should be part of this task.
         full_out_dim: bool
@@ -440,13 +526,18 @@ class SplitCIFAR100Data_FeCAM(CIFAR100Data):
         use_cutout=False,
         labels=range(0, 10),
         full_out_dim=False,
+        use_batched_augmentation=False,
     ):
-        super().__init__(
+        # CIFAR-100 is read only once and its arrays are shared by all tasks
+        initialize_from_shared_base(
+            self,
+            CIFAR100Data,
             data_path,
             use_one_hot=use_one_hot,
             validation_size=0,
             use_data_augmentation=use_data_augmentation,
             use_cutout=use_cutout,
+            use_batched_augmentation=use_batched_augmentation,
         )
 
         _split_cifar_100_fecam_object(
@@ -516,62 +607,37 @@ def _split_cifar_100_fecam_object(
         and np.all(np.array(labels) < data.num_classes)
         and len(labels) == len(np.unique(labels))
     )
-    K = len(labels)
 
     data._labels = labels
 
-    train_ins = data.get_train_inputs()
-    test_ins = data.get_test_inputs()
-
-    train_outs = data.get_train_outputs()
-    test_outs = data.get_test_outputs()
-
-    # Get labels.
+    # Get labels of all samples.
+    outputs = data._data["out_data"]
     if data.is_one_hot:
-        train_labels = data._to_one_hot(train_outs, reverse=True)
-        test_labels = data._to_one_hot(test_outs, reverse=True)
+        all_labels = data._to_one_hot(outputs, reverse=True)
     else:
-        train_labels = train_outs
-        test_labels = test_outs
+        all_labels = outputs
+    all_labels = all_labels.squeeze()
 
-    train_labels = train_labels.squeeze()
-    test_labels = test_labels.squeeze()
-
-    train_mask = train_labels == labels[0]
-    test_mask = test_labels == labels[0]
-    for k in range(1, K):
-        train_mask = np.logical_or(train_mask, train_labels == labels[k])
-        test_mask = np.logical_or(test_mask, test_labels == labels[k])
-
-    train_ins = train_ins[train_mask, :]
-    test_ins = test_ins[test_mask, :]
-
-    train_outs = train_outs[train_mask, :]
-    test_outs = test_outs[test_mask, :]
+    # Indices of samples of the task in the shared arrays
+    train_inds = data._data["train_inds"]
+    train_inds = train_inds[np.isin(all_labels[train_inds], labels)]
+    test_inds = data._data["test_inds"]
+    test_inds = test_inds[np.isin(all_labels[test_inds], labels)]
 
     if validation_size > 0:
-        if validation_size >= train_outs.shape[0]:
+        if validation_size >= train_inds.shape[0]:
             raise ValueError(
                 "Validation set must contain less than %d "
-                % (train_outs.shape[0])
+                % (train_inds.shape[0])
                 + "samples!"
             )
-        val_inds = np.arange(validation_size)
-        train_inds = np.arange(validation_size, train_outs.shape[0])
-
-    else:
-        train_inds = np.arange(train_outs.shape[0])
-
-    test_inds = np.arange(
-        train_outs.shape[0], train_outs.shape[0] + test_outs.shape[0]
-    )
-
-    outputs = np.concatenate([train_outs, test_outs], axis=0)
+        val_inds = train_inds[:validation_size]
+        train_inds = train_inds[validation_size:]
 
     if not full_out_dim:
         # Note, the method assumes `full_out_dim` when later called by a
         # user. We just misuse the function to call it inside the
-        # constructor.
+        # constructor. Outputs of samples of other tasks are not used.
         data._full_out_dim = True
         outputs = data.transform_outputs(outputs)
         data._full_out_dim = full_out_dim
@@ -587,8 +653,6 @@ def _split_cifar_100_fecam_object(
         # right now.
         data._data["cifar100"]["coarse_label_names"] = None
 
-    images = np.concatenate([train_ins, test_ins], axis=0)
-
     ### Overwrite internal data structure. Only keep desired labels.
 
     # Note, we continue to pretend to be a 100 class problem, such that
@@ -601,7 +665,6 @@ def _split_cifar_100_fecam_object(
         # the user has easy access to the correct labels and has the
         # original 1-hot encodings.
         assert data._data["num_classes"] == 100
-    data._data["in_data"] = images
     data._data["out_data"] = outputs
     data._data["train_inds"] = train_inds
     data._data["test_inds"] = test_inds
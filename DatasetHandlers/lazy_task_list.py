@@ -0,0 +1,106 @@
+"""
+A list of continual learning tasks whose handlers are created on demand.
+Handler t is constructed during the first access; at the same time, the
+handler of task t + 1 is prepared in a background thread, so it is ready
+when task t is learned. Training data of finished tasks may be released,
+while test data remains available for evaluation. Therefore, at most about
+two tasks are kept in memory in full instead of the whole sequence.
+"""
+import threading
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+def keep_only_test_samples(handler):
+    """
+    Remove training and validation samples from a handler storing its data
+    in ``_data`` as hypnettorch datasets do, i.e. keep only rows of
+    ``in_data`` and ``out_data`` selected by ``test_inds``.
+
+    Parameters:
+    -----------
+        handler: hypnettorch.data.dataset.Dataset
+            The handler of a task which owns its arrays.
+    """
+    test_inds = handler._data["test_inds"]
+    handler._data["in_data"] = handler._data["in_data"][test_inds]
+    handler._data["out_data"] = handler._data["out_data"][test_inds]
+    handler._data["test_inds"] = np.arange(test_inds.shape[0])
+    handler._data["train_inds"] = np.arange(0)
+    handler._data["val_inds"] = None
+    handler._batch_gen_train = None
+    handler._batch_gen_val = None
+    handler._batch_gen_test = None
+
+
+class LazyTaskList(Sequence):
+    """
+    A list of task handlers constructed on first access.
+
+    Parameters:
+    -----------
+        task_factories: List[callable]
+            Functions without arguments creating handlers of consecutive tasks.
+        prefetch: bool, optional
+            Whether the handler of task t + 1 is created in the background
+            when task t is accessed.
+    """
+    def __init__(self, task_factories, prefetch=True):
+        self._task_factories = list(task_factories)
+        self._handlers = [None] * len(self._task_factories)
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+
+    def __len__(self):
+        return len(self._task_factories)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Task index out of range!")
+        handler = self._get_handler(index)
+        if self._executor is not None and index + 1 < len(self):
+            self._prefetch(index + 1)
+        return handler
+
+    def _get_handler(self, index):
+        """Return the handler of a task, creating it if necessary."""
+        with self._lock:
+            future = self._futures.pop(index, None)
+        if future is not None:
+            handler = future.result()
+        else:
+            handler = self._handlers[index]
+            if handler is None:
+                handler = self._task_factories[index]()
+        self._handlers[index] = handler
+        return handler
+
+    def _prefetch(self, index):
+        """Start creating the handler of a task in the background."""
+        with self._lock:
+            if self._handlers[index] is None and index not in self._futures:
+                self._futures[index] = self._executor.submit(
+                    self._task_factories[index]
+                )
+
+    def release_training_data(self, index):
+        """
+        Release training data of a finished task. Handlers defining
+        the method ``release_training_data`` keep only data necessary
+        for evaluation; other handlers are left intact.
+
+        Parameters:
+        -----------
+            index: int
+                The number of the task.
+        """
+        handler = self._handlers[index]
+        if handler is not None and hasattr(handler, "release_training_data"):
+            handler.release_training_data()
@@ -0,0 +1,357 @@
+"""
+A common on-disk format of image datasets and a generic handler reading it.
+
+A packed dataset is a folder with:
+    * images.npy: flattened uint8 images (in the [H, W, C] order) of
+      the training set followed by the test set,
+    * index.npz: arrays "labels" (classes of consecutive images) and
+      "splits" (_TRAIN or _TEST),
+    * metadata.json: the name of the dataset, the shape of images,
+      the number of classes and their names.
+Images are read through memory maps, so handlers of all tasks and
+all processes (e.g. grid search workers) share the page cache instead
+of holding private copies. Converters from the sources supported by
+the other handlers are given below.
+"""
+import os
+import json
+
+import numpy as np
+import torch
+
+from hypnettorch.data.dataset import Dataset
+from hypnettorch.data.mnist_data import MNISTData
+from DatasetHandlers.cifar100_FeCAM import CIFAR100Data
+from DatasetHandlers.tiny_image_net import TinyImageNet
+from DatasetHandlers.split_cub200 import CUB2002011
+from DatasetHandlers.subset_image_net import SubsetImageNet
+
+_IMAGES_FILE = "images.npy"
+_INDEX_FILE = "index.npz"
+_METADATA_FILE = "metadata.json"
+_TRAIN, _TEST = 0, 1
+# The number of images copied at once during packing
+_CHUNK_SIZE = 1024
+
+
+class PackedDataset(Dataset):
+    """
+    A task consisting of selected classes of a packed dataset.
+
+    Parameters:
+    -----------
+        packed_path: str
+            The folder of the packed dataset.
+        labels: Iterable, optional
+            Classes of the task; by default, all classes. They are
+            mapped to 0, 1, ... in the given order.
+        use_one_hot: bool
+            Whether the class labels should be represented in a one-hot encoding.
+        validation_size: int
+            The number of validation samples, taken from the beginning
+            of the training set of each class of the task in turn.
+        train_transform: BatchedImageTransform, optional
+            The transformation of training batches of uint8 images.
+            By default, images are only scaled to [0, 1].
+        test_transform: BatchedImageTransform, optional
+            The transformation of inference batches.
+    """
+    # Memory-mapped images, indices and metadata shared by all tasks
+    _packed = {}
+
+    def __init__(self, packed_path, labels=None, use_one_hot=False,
+                 validation_size=0, train_transform=None, test_transform=None):
+        super().__init__()
+        images, index, metadata = PackedDataset.load(packed_path)
+        if labels is None:
+            labels = range(metadata["num_classes"])
+        labels = np.array(list(labels), dtype=np.int64)
+        assert len(np.unique(labels)) == len(labels)
+        assert (train_transform is None) == (test_transform is None)
+
+        self._metadata = metadata
+        self._labels = labels
+        self._stored_shape = metadata["in_shape"]
+        self.train_transform = train_transform
+        self.test_transform = test_transform
+
+        in_task = np.isin(index["labels"], labels)
+        train_rows = np.flatnonzero(in_task & (index["splits"] == _TRAIN))
+        test_rows = np.flatnonzero(in_task & (index["splits"] == _TEST))
+        if validation_size >= train_rows.shape[0]:
+            raise ValueError("Validation set must contain less than %d samples!"
+                             % train_rows.shape[0])
+        # Validation samples are taken from consecutive classes in turn,
+        # so the validation set is balanced whatever the order of images
+        train_labels = index["labels"][train_rows]
+        order = np.argsort(train_labels, kind="stable")
+        sorted_labels = train_labels[order]
+        rank_in_class = np.empty_like(order)
+        rank_in_class[order] = (np.arange(order.shape[0]) -
+                                np.searchsorted(sorted_labels, sorted_labels))
+        by_rank = np.lexsort((train_rows, rank_in_class))
+        val_rows = np.sort(train_rows[by_rank[:validation_size]])
+        train_rows = np.setdiff1d(train_rows, val_rows)
+
+        self._data["classification"] = True
+        self._data["sequence"] = False
+        self._data["num_classes"] = len(labels)
+        self._data["is_one_hot"] = use_one_hot
+        if train_transform is None:
+            self._data["in_shape"] = list(self._stored_shape)
+        else:
+            size = train_transform.output_size
+            self._data["in_shape"] = [size, size, self._stored_shape[2]]
+        self._data["out_shape"] = [len(labels) if use_one_hot else 1]
+        self._data["label_names"] = [metadata["label_names"][l] for l in labels]
+
+        # Images of all classes are kept in the memory map, tasks differ
+        # only in indices of their samples
+        self._data["in_data"] = images
+        self._data["train_inds"] = train_rows
+        self._data["test_inds"] = test_rows
+        if validation_size > 0:
+            self._data["val_inds"] = val_rows
+
+        translation = np.zeros(metadata["num_classes"], dtype=np.int64)
+        translation[labels] = np.arange(len(labels))
+        task_labels = translation[index["labels"]].reshape(-1, 1)
+        if use_one_hot:
+            task_labels = self._to_one_hot(task_labels)
+        self._data["out_data"] = task_labels
+
+    @staticmethod
+    def load(packed_path):
+        """
+        Load a packed dataset once per process.
+
+        Parameters:
+        -----------
+            packed_path: str
+                The folder of the packed dataset.
+
+        Returns:
+        --------
+            A tuple with memory-mapped images, a dictionary with arrays
+            "labels" and "splits" and a dictionary with metadata.
+        """
+        packed_path = os.path.normpath(packed_path)
+        if packed_path not in PackedDataset._packed:
+            metadata_path = os.path.join(packed_path, _METADATA_FILE)
+            if not os.path.exists(metadata_path):
+                raise ValueError('"%s" is not a packed dataset!' % packed_path)
+            with open(metadata_path, "r") as stream:
+                metadata = json.load(stream)
+            with np.load(os.path.join(packed_path, _INDEX_FILE)) as index:
+                index = {name: index[name] for name in ["labels", "splits"]}
+            images = np.load(os.path.join(packed_path, _IMAGES_FILE),
+                             mmap_mode="r")
+            assert images.shape == (index["labels"].shape[0],
+                                    int(np.prod(metadata["in_shape"])))
+            PackedDataset._packed[packed_path] = (images, index, metadata)
+        return PackedDataset._packed[packed_path]
+
+    def get_identifier(self):
+        """Returns the name of the dataset."""
+        return self._metadata["name"]
+
+    def _plot_sample(self):
+        pass
+
+    def input_to_torch_tensor(self, x, device, mode="inference",
+                              force_no_preprocessing=False, sample_ids=None):
+        """
+        Prepare mapping of uint8 images to PyTorch tensors: batches are
+        moved to the device as uint8 and transformed there.
+
+        Parameters:
+        ----------
+            (....): See docstring of method
+                :meth:`data.dataset.Dataset.input_to_torch_tensor`.
+
+        Returns:
+        ---------
+            (torch.Tensor): The given input ``x`` as PyTorch tensor.
+        """
+        if force_no_preprocessing:
+            return Dataset.input_to_torch_tensor(
+                self, x, device, mode=mode,
+                force_no_preprocessing=force_no_preprocessing,
+                sample_ids=sample_ids
+            )
+        if mode == "inference":
+            transform = self.test_transform
+        elif mode == "train":
+            transform = self.train_transform
+        else:
+            raise ValueError(f"{mode} is not a valid value for the argument 'mode'.")
+        x = torch.from_numpy(np.ascontiguousarray(x)).to(device)
+        if transform is None:
+            return x.float() / 255.0
+        x = transform(x.view(-1, *self._stored_shape).permute(0, 3, 1, 2))
+        return x.permute(0, 2, 3, 1).contiguous().view(x.shape[0], -1)
+
+
+def write_packed_dataset(packed_path, name, in_shape, label_names, parts):
+    """
+    Save images and labels in the packed format. Files are written under
+    temporary names and renamed when complete; metadata is written last,
+    so an existing metadata file marks a complete dataset.
+
+    Parameters:
+    -----------
+        packed_path: str
+            The folder of the packed dataset.
+        name: str
+            The name of the dataset.
+        in_shape: List[int]
+            The shape [H, W, C] of images.
+        label_names: List[str]
+            Names of consecutive classes.
+        parts: List[Tuple]
+            Tuples (split, images, labels, rows), where split is "train"
+            or "test", images is an array (e.g. a memory map) of uint8 images
+            (or float images with values in [0, 1]),
+            labels are classes of selected images and rows are indices
+            of selected images in the array (or None for all images).
+    """
+    os.makedirs(packed_path, exist_ok=True)
+    number_of_images = sum(len(labels) for _, _, labels, _ in parts)
+    suffix = ".%d.tmp" % os.getpid()
+    images_path = os.path.join(packed_path, _IMAGES_FILE)
+    images = np.lib.format.open_memmap(
+        images_path + suffix, mode="w+", dtype=np.uint8,
+        shape=(number_of_images, int(np.prod(in_shape)))
+    )
+    all_labels, splits = [], []
+    position = 0
+    for split, source, labels, rows in parts:
+        assert split in ["train", "test"]
+        for start in range(0, len(labels), _CHUNK_SIZE):
+            end = min(start + _CHUNK_SIZE, len(labels))
+            if rows is None:
+                chunk = source[start:end]
+            else:
+                chunk = source[rows[start:end]]
+            if chunk.dtype != np.uint8:
+                # Images with values in [0, 1], as in hypnettorch handlers
+                chunk = np.round(np.asarray(chunk) * 255)
+            images[position + start:position + end] = np.reshape(
+                chunk, (end - start, -1)
+            )
+        position += len(labels)
+        all_labels.append(np.asarray(labels, dtype=np.int64).reshape(-1))
+        splits.append(np.full(len(labels), _TRAIN if split == "train" else _TEST,
+                              dtype=np.uint8))
+    images.flush()
+    del images
+    index_path = os.path.join(packed_path, _INDEX_FILE)
+    with open(index_path + suffix, "wb") as stream:
+        np.savez(stream, labels=np.concatenate(all_labels),
+                 splits=np.concatenate(splits))
+    metadata_path = os.path.join(packed_path, _METADATA_FILE)
+    with open(metadata_path + suffix, "w") as stream:
+        json.dump({"name": name, "in_shape": list(in_shape),
+                   "num_classes": len(label_names),
+                   "label_names": list(label_names)}, stream)
+    os.replace(images_path + suffix, images_path)
+    os.replace(index_path + suffix, index_path)
+    os.replace(metadata_path + suffix, metadata_path)
+
+
+def _pack_hypnettorch_handler(handler, packed_path, name, label_names):
+    """
+    Pack a hypnettorch handler of a whole dataset with images in [0, 1]
+    and categorical labels.
+    """
+    images = handler._data["in_data"]
+    labels = handler._data["out_data"].reshape(-1)
+    parts = [(split, images, labels[inds], inds) for split, inds in
+             [("train", handler._data["train_inds"]),
+              ("test", handler._data["test_inds"])]]
+    write_packed_dataset(packed_path, name, handler.in_shape, label_names, parts)
+
+
+def pack_mnist(data_path, packed_path):
+    """Convert MNIST read by hypnettorch to the packed format."""
+    handler = MNISTData(data_path, use_one_hot=False, validation_size=0)
+    _pack_hypnettorch_handler(handler, packed_path, "MNIST",
+                              [str(digit) for digit in range(10)])
+
+
+def pack_cifar100(data_path, packed_path):
+    """Convert pickled CIFAR-100 batches to the packed format."""
+    handler = CIFAR100Data(data_path, use_one_hot=False, validation_size=0)
+    _pack_hypnettorch_handler(handler, packed_path, "CIFAR-100",
+                              handler._data["cifar100"]["fine_label_names"])
+
+
+def pack_tinyimagenet(data_path, packed_path):
+    """Convert TinyImageNet (through its decoded cache) to the packed format."""
+    # A handler of a small task gives access to the cache of all classes
+    handler = TinyImageNet(data_path=data_path, validation_size=0,
+                           labels=np.arange(5))
+    names = handler._data["tinyimagenet"]["label_names"]
+    parts = []
+    for mode in ["train", "test"]:
+        images, labels = handler._load_cache(mode)
+        parts.append((mode, images, labels, None))
+    write_packed_dataset(packed_path, "TinyImageNet", handler._data["in_shape"],
+                         [names[i] for i in range(200)], parts)
+
+
+def pack_cub200(data_path, packed_path):
+    """
+    Convert CUB-200-2011 (through its store of decoded central squares)
+    to the packed format.
+    """
+    handler = CUB2002011(data_path, use_one_hot=False,
+                         validation_size_per_class=0, labels=range(200),
+                         use_image_store=True)
+    store_images, positions = handler._image_store
+    parts = []
+    for split, ds in [("train", handler._torch_ds_train),
+                      ("test", handler._torch_ds_test)]:
+        rows = np.array([positions[path] for path, _ in ds.samples])
+        parts.append((split, store_images, np.array(ds.targets), rows))
+    size = CUB2002011._DECODED_SIZE
+    write_packed_dataset(packed_path, "CUB-200-2011", [size, size, 3],
+                         [handler._label_to_name[i] for i in range(200)], parts)
+
+
+def pack_subset_imagenet(data_path, packed_path, size=80):
+    """
+    Convert Subset-ImageNet (through shards of pre-resized images)
+    to the packed format.
+    """
+    path = f"{data_path}/seed_1993_subset_100_imagenet/data"
+    parts = []
+    for split, root in [("train", f"{path}/train"), ("test", f"{path}/val")]:
+        index = SubsetImageNet._load_index(root)
+        images = SubsetImageNet._load_shard(root, index["paths"], size)
+        parts.append((split, images, index["targets"], None))
+    # Class names are names of folders, as in ImageFolder
+    names = {}
+    for relative_path, target in zip(index["paths"], index["targets"]):
+        names.setdefault(int(target), str(relative_path).split("/")[0])
+    write_packed_dataset(packed_path, "SubsetImageNet", [size, size, 3],
+                         [names[i] for i in range(len(names))], parts)
+
+
+if __name__ == "__main__":
+    # "MNIST", "CIFAR100", "TinyImageNet", "CUB200" or "SubsetImageNet"
+    dataset = "CIFAR100"
+    path_to_datasets = "./Data/"
+    packed_path = f"{path_to_datasets}/packed/{dataset}"
+
+    converters = {
+        "MNIST": pack_mnist,
+        "CIFAR100": pack_cifar100,
+        "TinyImageNet": pack_tinyimagenet,
+        "CUB200": pack_cub200,
+        "SubsetImageNet": pack_subset_imagenet,
+    }
+    if dataset not in converters:
+        raise ValueError("Wrong name of the dataset!")
+    converters[dataset](path_to_datasets, packed_path)
+    print(f"{dataset} was packed to {packed_path}")
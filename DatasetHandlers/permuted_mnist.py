@@ -0,0 +1,228 @@
+"""
+PermutedMNIST tasks sharing a single device-resident copy of MNIST.
+
+Contrary to hypnettorch's PermutedMNISTList, each task has its own handler,
+so tasks may be used at the same time. Images are stored on the device once,
+as padded uint8 tensors, and batches of a task are assembled on the device:
+samples are selected by their indices and pixels are permuted by an index
+gather. The additional memory of a task is only its permutation.
+"""
+import numpy as np
+import torch
+
+from hypnettorch.data.dataset import Dataset
+from hypnettorch.data.mnist_data import MNISTData
+from DatasetHandlers.shared_base_dataset import initialize_from_shared_base
+
+
+class PermutedMNIST(MNISTData):
+    """
+    A single PermutedMNIST task.
+
+    Parameters:
+    -----------
+        data_path: str
+            Where should the dataset be read from? If not existing,
+            the dataset will be downloaded into this folder.
+        permutation: np.ndarray
+            The permutation of pixels of padded images, i.e. a permutation
+            of (28 + 2 * padding)**2 elements.
+        use_one_hot: bool
+            Whether the class labels should be represented in a one-hot encoding.
+        validation_size: int
+            The number of validation samples, taken from the beginning
+            of the training set.
+        padding: int
+            The amount of zero padding applied to images.
+        device: str, optional
+            The device on which images are stored. By default, "cuda"
+            if it is available.
+    """
+    # Padded uint8 images shared by all tasks, for consecutive devices
+    _device_images = {}
+
+    def __init__(self, data_path, permutation, use_one_hot=True,
+                 validation_size=0, padding=0, device=None):
+        initialize_from_shared_base(self, MNISTData, data_path,
+                                    use_one_hot=use_one_hot,
+                                    validation_size=validation_size,
+                                    use_torch_augmentation=False)
+        self._padding = padding
+        self._input_dim = (28 + 2 * padding)**2
+        assert len(permutation) == self._input_dim
+        if device is None:
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.device = device
+        self._permutation = torch.as_tensor(
+            np.asarray(permutation), dtype=torch.long, device=device
+        )
+
+    @property
+    def permutation(self):
+        """The permutation of pixels of padded images."""
+        return self._permutation
+
+    @property
+    def torch_in_shape(self):
+        """The shape of padded images."""
+        return [self.in_shape[0] + 2 * self._padding,
+                self.in_shape[1] + 2 * self._padding, self.in_shape[2]]
+
+    def get_identifier(self):
+        """Returns the name of the dataset."""
+        return "PermutedMNIST"
+
+    def _to_padded_uint8_tensor(self, x, device):
+        """
+        Convert flattened images to padded uint8 images on a given device.
+
+        Parameters:
+        -----------
+            x: np.ndarray
+                2D array of flattened images with values in [0, 1].
+            device: str
+                The target device.
+
+        Returns:
+        --------
+            (torch.Tensor): uint8 images of the shape [B, (28 + 2 * padding)**2].
+        """
+        x = torch.from_numpy((x * 255.0).astype("uint8")).to(device)
+        x = torch.nn.functional.pad(x.view(-1, 28, 28), [self._padding] * 4)
+        return x.reshape(x.shape[0], -1)
+
+    def _get_device_images(self):
+        """
+        Get all padded images stored on the device of the handler. They are
+        transferred once and shared by all tasks.
+
+        Returns:
+        --------
+            (torch.Tensor): uint8 images of the shape
+            [number of samples, (28 + 2 * padding)**2].
+        """
+        key = (id(self._data["in_data"]), self._padding, str(self.device))
+        if key not in PermutedMNIST._device_images:
+            PermutedMNIST._device_images[key] = self._to_padded_uint8_tensor(
+                self._data["in_data"], self.device
+            )
+        return PermutedMNIST._device_images[key]
+
+    def _gather_inputs(self, indices):
+        """
+        Select samples by their indices and permute their pixels on the device.
+
+        Parameters:
+        -----------
+            indices: np.ndarray
+                Indices of samples in the dataset.
+
+        Returns:
+        --------
+            (torch.Tensor): Permuted images with values in [0, 1].
+        """
+        indices = torch.as_tensor(indices, dtype=torch.long, device=self.device)
+        images = self._get_device_images()[indices][:, self._permutation]
+        return images.float() / 255.0
+
+    def _next_batch(self, batch_generator, batch_size, use_one_hot, return_ids):
+        """
+        Assemble the next batch from a given batch generator, see
+        :meth:`data.dataset.Dataset.next_train_batch`. Inputs are returned
+        as tensors on the device of the handler.
+        """
+        batch_inds = np.fromiter(batch_generator, np.int64, count=batch_size)
+        ret = [self._gather_inputs(batch_inds),
+               self._get_outputs(self._data["out_data"][batch_inds, :],
+                                 use_one_hot)]
+        if return_ids:
+            return ret + [batch_inds]
+        return ret
+
+    def next_train_batch(self, batch_size, use_one_hot=None, return_ids=False):
+        if self._batch_gen_train is None:
+            self.reset_batch_generator(train=True, test=False, val=False)
+        return self._next_batch(self._batch_gen_train, batch_size,
+                                use_one_hot, return_ids)
+
+    def next_test_batch(self, batch_size, use_one_hot=None, return_ids=False):
+        if self._batch_gen_test is None:
+            self.reset_batch_generator(train=False, test=True, val=False)
+        return self._next_batch(self._batch_gen_test, batch_size,
+                                use_one_hot, return_ids)
+
+    def next_val_batch(self, batch_size, use_one_hot=None, return_ids=False):
+        if self._data["val_inds"] is None:
+            return None
+        if self._batch_gen_val is None:
+            self.reset_batch_generator(train=False, test=False, val=True)
+        return self._next_batch(self._batch_gen_val, batch_size,
+                                use_one_hot, return_ids)
+
+    def get_train_inputs(self):
+        """Returns permuted training inputs as a tensor on the device."""
+        return self._gather_inputs(self._data["train_inds"])
+
+    def get_test_inputs(self):
+        """Returns permuted test inputs as a tensor on the device."""
+        return self._gather_inputs(self._data["test_inds"])
+
+    def get_val_inputs(self):
+        """Returns permuted validation inputs as a tensor on the device."""
+        if self._data["val_inds"] is None:
+            return None
+        return self._gather_inputs(self._data["val_inds"])
+
+    def input_to_torch_tensor(self, x, device, mode="inference",
+                              force_no_preprocessing=False, sample_ids=None):
+        """
+        Prepare mapping of inputs to PyTorch tensors. Inputs returned by
+        this handler are already permuted tensors; NumPy arrays of original
+        images are padded and permuted on the device.
+
+        Parameters:
+        ----------
+            (....): See docstring of method
+                :meth:`data.dataset.Dataset.input_to_torch_tensor`.
+
+        Returns:
+        ---------
+            (torch.Tensor): The given input ``x`` as PyTorch tensor.
+        """
+        if isinstance(x, torch.Tensor):
+            return x.to(device)
+        if force_no_preprocessing:
+            return Dataset.input_to_torch_tensor(
+                self, x, device, mode=mode,
+                force_no_preprocessing=force_no_preprocessing,
+                sample_ids=sample_ids
+            )
+        assert len(x.shape) == 2
+        x = self._to_padded_uint8_tensor(x, device)
+        return x[:, self._permutation.to(device)].float() / 255.0
+
+
+def get_permuted_mnist_handlers(permutations, data_path, use_one_hot=True,
+                                validation_size=0, padding=0, device=None):
+    """
+    Create handlers of PermutedMNIST tasks sharing a single copy of MNIST.
+
+    Parameters:
+    -----------
+        permutations: List[np.ndarray]
+            Permutations of consecutive tasks.
+        (....): See docstring of class :class:`PermutedMNIST`.
+
+    Returns:
+    --------
+        List[PermutedMNIST]
+            A list of tasks.
+    """
+    print('Loading MNIST into memory, that is shared among %d permutation '
+          % (len(permutations)) + 'tasks.')
+    return [
+        PermutedMNIST(data_path, permutation, use_one_hot=use_one_hot,
+                      validation_size=validation_size, padding=padding,
+                      device=device)
+        for permutation in permutations
+    ]
@@ -0,0 +1,45 @@
+"""
+A cache of base datasets shared by handlers of consecutive tasks.
+Split handlers (e.g. SplitMNIST) are subclasses of handlers of the whole
+dataset; instead of reading and parsing the dataset once per task, its
+handler is created once and its state is copied to handlers of tasks.
+Arrays of inputs and outputs are shared, not copied.
+"""
+import copy
+
+_BASE_DATASETS = {}
+
+
+def initialize_from_shared_base(handler, base_class, *args, **kwargs):
+    """
+    Initialize a handler as its base class would, reading the dataset
+    only during the first call with given arguments.
+
+    Parameters:
+    -----------
+        handler: hypnettorch.data.dataset.Dataset
+            The handler of a task, an instance of a subclass of base_class.
+        base_class: type
+            The handler of the whole dataset, e.g. PositiveMNISTData.
+        args, kwargs:
+            Arguments of the constructor of base_class; they have to be
+            hashable.
+    """
+    key = (base_class, args, tuple(sorted(kwargs.items())))
+    if key not in _BASE_DATASETS:
+        base = base_class.__new__(base_class)
+        base_class.__init__(base, *args, **kwargs)
+        _BASE_DATASETS[key] = base
+    state = dict(_BASE_DATASETS[key].__dict__)
+    # Handlers of tasks overwrite entries of _data, e.g. label names,
+    # so only arrays are shared
+    state["_data"] = {
+        name: copy.deepcopy(value) if isinstance(value, (dict, list)) else value
+        for name, value in state["_data"].items()
+    }
+    handler.__dict__.update(state)
+
+
+def clear_shared_base_datasets():
+    """Release all cached base datasets."""
+    _BASE_DATASETS.clear()
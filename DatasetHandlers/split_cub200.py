@@ -10,6 +10,7 @@ import torch
 
 import os
 import time
+import multiprocessing as mp
 import urllib.request
 import tarfile
 import pandas
@@ -24,6 +25,8 @@ import numpy.matlib as npm
 from hypnettorch.data.large_img_dataset import LargeImgDataset
 from hypnettorch.data.ilsvrc2012_data import ILSVRC2012Data
 from hypnettorch.data.dataset import Dataset
+from DatasetHandlers.batched_transforms import BatchedImageTransform
+from DatasetHandlers.lazy_task_list import keep_only_test_samples
 
 def _transform_split_outputs(data, outputs):
     """Actual implementation of method ``transform_outputs`` for split dataset
@@ -149,6 +152,15 @@ class CUB2002011(LargeImgDataset):
     _IMG_CLASS_LBLS_FILE = 'image_class_labels.txt' # Realitve to _REL_BASE
     _IMG_FILE = 'images.txt' # Realitve to _REL_BASE
     _TRAIN_TEST_SPLIT_FILE = 'train_test_split.txt' # Realitve to _REL_BASE
+    # Images are decoded as central squares of this size, i.e. resized
+    # so that their shorter side has this length and cropped
+    _DECODED_SIZE = 256
+    # All decoded images are stored in this file in the order of image IDs
+    _IMAGE_STORE_FILE = 'images_uint8_%d.npy' % _DECODED_SIZE
+    # Memory-mapped image stores shared by all tasks of the process
+    _image_stores = {}
+    # Parsed metadata of the dataset shared by all tasks of the process
+    _metadata = {}
 
 
     def __init__(self,
@@ -156,7 +168,8 @@ class CUB2002011(LargeImgDataset):
         use_one_hot=True,
         validation_size_per_class=50,
         seed=1,
-        labels=[i for i in range(40)]):
+        labels=[i for i in range(40)],
+        use_image_store=False):
 
 
         super().__init__('')
@@ -166,7 +179,8 @@ class CUB2002011(LargeImgDataset):
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         self.train_dataloder = None
 
-        np.random.seed(seed)
+        # The split is deterministic, so the global random generator is not
+        # reseeded and tasks may be created in the middle of training
 
         print('Reading CUB-200-2011 dataset ...')
 
@@ -213,53 +227,70 @@ class CUB2002011(LargeImgDataset):
         train_transform, test_transform = \
             ILSVRC2012Data.torch_input_transforms()
 
-        # Consider all images as training images. We split the dataset later.
-        ds_train = datasets.ImageFolder(image_dir, train_transform)
-
-        # Ability to translate image IDs into image paths and back.
-        image_ids_csv = pandas.read_csv(image_fn, sep=' ',
-                                        names=['img_id', 'img_path'])
-        id2img = dict(zip(list(image_ids_csv['img_id']),
-                          list(image_ids_csv['img_path'])))
-        # Since the ImageFolder class uses absolute paths, we have to change
-        # the just read relative paths.
-        for iid in id2img.keys():
-            id2img[iid] = os.path.join(image_dir, id2img[iid])
-        img2id = {v: k for k, v in id2img.items()}
-
-        # Image ID to label.
-        img_lbl_csv = pandas.read_csv(img_class_fn, sep=' ',
-                                      names=['img_id', 'label'])
+        # Metadata (and the scan of the image folder) is read once
+        # and shared by all tasks
+        if image_dir not in CUB2002011._metadata:
+            # Consider all images as training images. We split the dataset later.
+            ds_train = datasets.ImageFolder(image_dir, train_transform)
+
+            # Ability to translate image IDs into image paths and back.
+            image_ids_csv = pandas.read_csv(image_fn, sep=' ',
+                                            names=['img_id', 'img_path'])
+            id2img = dict(zip(list(image_ids_csv['img_id']),
+                              list(image_ids_csv['img_path'])))
+            # Since the ImageFolder class uses absolute paths, we have to change
+            # the just read relative paths.
+            for iid in id2img.keys():
+                id2img[iid] = os.path.join(image_dir, id2img[iid])
+            img2id = {v: k for k, v in id2img.items()}
+
+            # Image ID to label.
+            img_lbl_csv = pandas.read_csv(img_class_fn, sep=' ',
+                                          names=['img_id', 'label'])
         
-        id2lbl = dict(zip(list(img_lbl_csv['img_id']),
-                          list(img_lbl_csv['label'])))
-        # Note, categories go from 1-200. We change them to go from 0 - 199.
-        for iid in id2lbl.keys():
-            id2lbl[iid] = id2lbl[iid] - 1
-
-        # Image ID to label name.
-        img_lbl_name_csv = pandas.read_csv(classes_fn, sep=' ',
-                                           names=['label', 'label_name'])
-        lbl2lbl_name_tmp = dict(zip(list(img_lbl_name_csv['label']),
-                                    list(img_lbl_name_csv['label_name'])))
-        # Here, we also have to modify the labels to be within 0-199.
-        lbl2lbl_name = {k-1: v for k, v in lbl2lbl_name_tmp.items()}
-
-        # Train-test-split.
-        train_test_csv = pandas.read_csv(train_test_split_fn, sep=' ',
-                                         names=['img_id', 'is_train'])
-        id2train = dict(zip(list(train_test_csv['img_id']),
-                            list(train_test_csv['is_train'])))
+            id2lbl = dict(zip(list(img_lbl_csv['img_id']),
+                              list(img_lbl_csv['label'])))
+            # Note, categories go from 1-200. We change them to go from 0 - 199.
+            for iid in id2lbl.keys():
+                id2lbl[iid] = id2lbl[iid] - 1
+
+            # Image ID to label name.
+            img_lbl_name_csv = pandas.read_csv(classes_fn, sep=' ',
+                                               names=['label', 'label_name'])
+            lbl2lbl_name_tmp = dict(zip(list(img_lbl_name_csv['label']),
+                                        list(img_lbl_name_csv['label_name'])))
+            # Here, we also have to modify the labels to be within 0-199.
+            lbl2lbl_name = {k-1: v for k, v in lbl2lbl_name_tmp.items()}
+
+            # Train-test-split.
+            train_test_csv = pandas.read_csv(train_test_split_fn, sep=' ',
+                                             names=['img_id', 'is_train'])
+            id2train = dict(zip(list(train_test_csv['img_id']),
+                                list(train_test_csv['is_train'])))
+
+            ####################
+            ### Sanity check ###
+            ####################
+            for i, (img_path, lbl) in enumerate(ds_train.samples):
+                iid = img2id[img_path]
+                assert(id2img[iid] == img_path)
+                assert(lbl == id2lbl[iid])
+
+            CUB2002011._metadata[image_dir] = (
+                ds_train, id2img, img2id, id2lbl, lbl2lbl_name, id2train)
+        (ds_train, id2img, img2id, id2lbl, lbl2lbl_name,
+         id2train) = CUB2002011._metadata[image_dir]
+        ds_train = deepcopy(ds_train)
 
         self._label_to_name = lbl2lbl_name
 
-        ####################
-        ### Sanity check ###
-        ####################
-        for i, (img_path, lbl) in enumerate(ds_train.samples):
-            iid = img2id[img_path]
-            assert(id2img[iid] == img_path)
-            assert(lbl == id2lbl[iid])
+        # Images are decoded once and then read from the store by index
+        self._image_store = None
+        if use_image_store:
+            self._image_store = CUB2002011.load_image_store(
+                os.path.join(data_path, CUB2002011._IMAGE_STORE_FILE),
+                [id2img[iid] for iid in sorted(id2img.keys())]
+            )
 
         ################################
         ### Train / val / test split ###
@@ -374,8 +405,17 @@ class CUB2002011(LargeImgDataset):
         end = time.time()
         print('Elapsed time to read dataset: %f sec' % (end-start))        
 
-        self.train_transform = train_transform
-        self.test_transform  = test_transform
+        if use_image_store:
+            # Similar transforms but applied to batches of central squares
+            # of stored images, so random crops are drawn from these squares
+            # and resizing is not antialiased
+            (
+                self.train_transform,
+                self.test_transform,
+            ) = CUB2002011.batched_input_transforms()
+        else:
+            self.train_transform = train_transform
+            self.test_transform = test_transform
 
     def _to_one_hot(self, labels, reverse=False):
         """ Transform a list of labels into a 1-hot encoding.
@@ -512,7 +552,9 @@ class CUB2002011(LargeImgDataset):
                 raise ValueError(
                     f"{mode} is not a valid value for the" "argument 'mode'."
                 )
-            return CUB2002011.torch_preprocess_images(x, device, transform)
+            return CUB2002011.torch_preprocess_images(
+                x, device, transform, image_store=self._image_store
+            )
 
         else:
             return Dataset.input_to_torch_tensor(
@@ -525,7 +567,8 @@ class CUB2002011(LargeImgDataset):
             )
 
     @staticmethod
-    def torch_preprocess_images(x, device, transform, img_shape=[224,224,3]):
+    def torch_preprocess_images(x, device, transform, img_shape=[224,224,3],
+                                image_store=None):
         """
         Prepare preprocessing of CUB-200 images with a selected
         PyTorch transformation.
@@ -536,11 +579,16 @@ class CUB2002011(LargeImgDataset):
                 List of lists with paths to CUB200 images.
             device: torch.device or int: 
                 PyTorch device on which a final tensor will be moved.
-            transform: torchvision.transforms
-                A method of data modification.
+            transform: torchvision.transforms or BatchedImageTransform
+                A method of data modification of single PIL images or,
+                with the image store, of a batch of images.
             img_shape: Tuple[int]
                 Tuple with integers indicating shape of the loaded
                 CUB-200 images.
+            image_store: Tuple[np.ndarray, dict], optional
+                Decoded images and positions of their paths, returned
+                by load_image_store(). If None, full images are decoded
+                and transformed one by one.
 
         Returns:
         --------
@@ -549,25 +597,149 @@ class CUB2002011(LargeImgDataset):
         assert len(x.shape) == 2
         # First dimension is related to batch size and second is related
         # to the flattened image.
-        x = CUB2002011.load_images_to_tensor(x, transform)
-        x = x.to(device)
+        x = CUB2002011.load_images_to_tensor(x, transform, device, image_store)
         x = x.permute(0, 2, 3, 1)
         x = x.contiguous().view(-1, np.prod(img_shape))
         return x
     
+    @staticmethod
+    def read_image(path, size=_DECODED_SIZE):
+        """
+        Decode a CUB-200 image as a central square of a given size.
+
+        Parameters:
+        ----------
+            path: str
+                The path of the image.
+            size: int
+                The side of the decoded image.
+
+        Returns:
+        --------
+            (np.ndarray): uint8 image of the shape [size, size, 3].
+        """
+        img = Image.open(path).convert('RGB')  # Ensure RGB format
+        width, height = img.size
+        scale = size / min(width, height)
+        img = img.resize((max(size, round(width * scale)),
+                          max(size, round(height * scale))), Image.BILINEAR)
+        left = (img.size[0] - size) // 2
+        top = (img.size[1] - size) // 2
+        img = img.crop((left, top, left + size, top + size))
+        return np.asarray(img, dtype=np.uint8)
+
+    @staticmethod
+    def batched_input_transforms():
+        """
+        Prepare transformations of whole batches of central squares
+        decoded by :meth:`read_image`.
+
+        Returns:
+        --------
+            A tuple containing **train_transform** and **test_transform**.
+        """
+        train_transform = BatchedImageTransform(
+            224, crop="random_resized", horizontal_flip=True
+        )
+        test_transform = BatchedImageTransform(
+            224, crop="center",
+            center_crop_fraction=224 / CUB2002011._DECODED_SIZE
+        )
+        return train_transform, test_transform
+
+    @staticmethod
+    def load_image_store(store_path, image_paths, number_of_workers=None):
+        """
+        Load the memory-mapped store of decoded CUB-200 images. During the first
+        call the store is built: images are decoded in parallel by a pool of
+        workers, or serially in daemonic processes (e.g. workers of a grid
+        search), which cannot have children.
+
+        Parameters:
+        ----------
+            store_path: str
+                The path of the file with decoded images.
+            image_paths: List[str]
+                Paths of all images of the dataset, in the order of image IDs.
+            number_of_workers: int, optional
+                The number of decoding processes. By default, the number of CPUs.
+
+        Returns:
+        --------
+            A tuple with uint8 images of the shape [number of images,
+            _DECODED_SIZE, _DECODED_SIZE, 3] and a dictionary mapping
+            image paths to positions in the store.
+        """
+        if store_path not in CUB2002011._image_stores:
+            if not os.path.exists(store_path):
+                print('Decoding CUB-200-2011 images to "%s" ...' % store_path)
+                size = CUB2002011._DECODED_SIZE
+                # The file is written under a temporary name and renamed
+                # when complete
+                temporary_path = '%s.%d.tmp' % (store_path, os.getpid())
+                images = np.lib.format.open_memmap(
+                    temporary_path, mode='w+', dtype=np.uint8,
+                    shape=(len(image_paths), size, size, 3))
+                if mp.current_process().daemon:
+                    for i, image in enumerate(map(CUB2002011.read_image,
+                                                  image_paths)):
+                        images[i] = image
+                else:
+                    with mp.Pool(number_of_workers) as pool:
+                        for i, image in enumerate(pool.imap(
+                                CUB2002011.read_image, image_paths,
+                                chunksize=64)):
+                            images[i] = image
+                images.flush()
+                del images
+                os.replace(temporary_path, store_path)
+            images = np.load(store_path, mmap_mode='r')
+            assert images.shape[0] == len(image_paths)
+            CUB2002011._image_stores[store_path] = (
+                images, {path: i for i, path in enumerate(image_paths)})
+        return CUB2002011._image_stores[store_path]
+
+    @staticmethod
+    def prepare_image_store(data_path, number_of_workers=None):
+        """
+        Build the store of decoded images of the downloaded dataset in
+        advance, e.g. before a grid search, so that images are decoded
+        once and in parallel instead of in each of its workers.
+
+        Parameters:
+        ----------
+            data_path: str
+                The folder with the dataset, as in the constructor.
+            number_of_workers: int, optional
+                The number of decoding processes. By default, the number of CPUs.
+        """
+        data_path = os.path.join(data_path, CUB2002011._SUBFOLDER)
+        image_dir = os.path.join(data_path, CUB2002011._REL_BASE,
+                                 CUB2002011._IMG_DIR)
+        image_ids_csv = pandas.read_csv(
+            os.path.join(data_path, CUB2002011._REL_BASE, CUB2002011._IMG_FILE),
+            sep=' ', names=['img_id', 'img_path'])
+        id2img = dict(zip(list(image_ids_csv['img_id']),
+                          list(image_ids_csv['img_path'])))
+        CUB2002011.load_image_store(
+            os.path.join(data_path, CUB2002011._IMAGE_STORE_FILE),
+            [os.path.join(image_dir, id2img[iid]) for iid in sorted(id2img.keys())],
+            number_of_workers=number_of_workers
+        )
+
     # Function to load a batch of image paths and convert to tensors
     @staticmethod
-    def load_images_to_tensor(image_paths, transform):
-        tensors = []
-        for path in image_paths:
-            # Load the image
-            img = Image.open(path[0]).convert('RGB')  # Ensure RGB format
-            img_tensor = transform(img)
-            tensors.append(img_tensor)
-
-        # Stack tensors into a single batch
-        batch_tensor = torch.stack(tensors)
-        return batch_tensor
+    def load_images_to_tensor(image_paths, transform, device="cpu",
+                              image_store=None):
+        if image_store is None:
+            tensors = [transform(Image.open(path[0]).convert('RGB'))
+                       for path in image_paths]
+            return torch.stack(tensors).to(device)
+        store_images, positions = image_store
+        images = store_images[[positions[path[0]] for path in image_paths]]
+        # uint8 images are moved to the device and transformed at once
+        images = torch.from_numpy(images).to(device).permute(0, 3, 1, 2)
+        return transform(images)
     
     def get_val_inputs(self, dtype="torch"):
         """
@@ -670,6 +842,14 @@ class CUB2002011(LargeImgDataset):
                 mode="train"
             )
         return outputs
+
+    def release_training_data(self):
+        """
+        Release training samples of a finished task; test samples
+        (also used as validation samples) are kept for evaluation.
+        """
+        keep_only_test_samples(self)
+        self._torch_ds_train = None
     
     def output_to_torch_tensor(self, y, device, mode='inference', 
                                force_no_preprocessing=False, sample_ids=None):
@@ -708,14 +888,21 @@ class SplitCUB200Data(CUB2002011):
             ``len(labels) + trgt_padding`` classes. However, all padded classes
             have no input instances. Note, that 1-hot encodings are padded to
             fit the new number of classes.
+        use_image_store: bool, optional
+            If True, images are decoded once to a memory-mapped store of
+            central squares and batches are transformed on the device.
+            Random crops are then drawn from central squares only, so
+            the augmentation differs from the original one (default: False).
     """
     def __init__(self, dataset_folder, use_one_hot=False, validation_size_per_class=100,
-                 labels=range(0,40), full_out_dim=False, trgt_padding=None):
+                 labels=range(0,40), full_out_dim=False, trgt_padding=None,
+                 use_image_store=False):
         # Note, we build the validation set below!
         super().__init__(dataset_folder, 
                          use_one_hot=use_one_hot, 
                          validation_size_per_class=validation_size_per_class,
-                         labels=labels)
+                         labels=labels,
+                         use_image_store=use_image_store)
 
         self._full_out_dim = full_out_dim
         if isinstance(labels, range):
@@ -14,6 +14,7 @@ handlers for the SplitMNIST task.
 import numpy as np
 
 from hypnettorch.data.mnist_data import MNISTData
+from DatasetHandlers.shared_base_dataset import initialize_from_shared_base
 
 def _transform_split_outputs(data, outputs):
     """Actual implementation of method ``transform_outputs`` for split dataset
@@ -186,9 +187,11 @@ class SplitMNIST(PositiveMNISTData):
     def __init__(self, data_path, use_one_hot=False, validation_size=1000,
                  use_torch_augmentation=False, labels=[0, 1],
                  full_out_dim=False, trgt_padding=None):
-        # Note, we build the validation set below!
-        super().__init__(data_path, use_one_hot=use_one_hot,
-             use_torch_augmentation=False, validation_size=0)
+        # Note, we build the validation set below! MNIST is read only once
+        # and its arrays are shared by all tasks.
+        initialize_from_shared_base(self, PositiveMNISTData, data_path,
+             use_one_hot=use_one_hot, use_torch_augmentation=False,
+             validation_size=0)
 
         self._full_out_dim = full_out_dim
 
@@ -197,56 +200,33 @@ class SplitMNIST(PositiveMNISTData):
         assert np.all(np.array(labels) >= 0) and \
                np.all(np.array(labels) < self.num_classes) and \
                len(labels) == len(np.unique(labels))
-        K = len(labels)
 
         self._labels = labels
 
-        train_ins = self.get_train_inputs()
-        test_ins = self.get_test_inputs()
-
-        train_outs = self.get_train_outputs()
-        test_outs = self.get_test_outputs()
-
-        # Get labels.
+        # Get labels of all samples.
+        outputs = self._data['out_data']
         if self.is_one_hot:
-            train_labels = self._to_one_hot(train_outs, reverse=True)
-            test_labels = self._to_one_hot(test_outs, reverse=True)
+            all_labels = self._to_one_hot(outputs, reverse=True)
         else:
-            train_labels = train_outs
-            test_labels = test_outs
-
-        train_labels = train_labels.squeeze()
-        test_labels = test_labels.squeeze()
-
-        train_mask = train_labels == labels[0]
-        test_mask = test_labels == labels[0]
-        for k in range(1, K):
-            train_mask = np.logical_or(train_mask, train_labels == labels[k])
-            test_mask = np.logical_or(test_mask, test_labels == labels[k])
-
-        train_ins = train_ins[train_mask, :]
-        test_ins = test_ins[test_mask, :]
+            all_labels = outputs
+        all_labels = all_labels.squeeze()
 
-        train_outs = train_outs[train_mask, :]
-        test_outs = test_outs[test_mask, :]
+        # Indices of samples of the task in the shared arrays
+        train_inds = self._data['train_inds']
+        train_inds = train_inds[np.isin(all_labels[train_inds], labels)]
+        test_inds = self._data['test_inds']
+        test_inds = test_inds[np.isin(all_labels[test_inds], labels)]
 
         if validation_size > 0:
-            if validation_size >= train_outs.shape[0]:
+            if validation_size >= train_inds.shape[0]:
                 raise ValueError('Validation set size must be smaller than ' +
-                                 '%d.' % train_outs.shape[0])
-            val_inds = np.arange(validation_size)
-            train_inds = np.arange(validation_size, train_outs.shape[0])
-
-        else:
-            train_inds = np.arange(train_outs.shape[0])
-
-        test_inds = np.arange(train_outs.shape[0],
-                              train_outs.shape[0] + test_outs.shape[0])
-
-        outputs = np.concatenate([train_outs, test_outs], axis=0)
+                                 '%d.' % train_inds.shape[0])
+            val_inds = train_inds[:validation_size]
+            train_inds = train_inds[validation_size:]
 
         if not full_out_dim:
             # Transform outputs, e.g., if 1-hot [0,0,0,1,0,0,0,0,0,0] -> [0,1]
+            # (outputs of samples of other tasks are not used).
 
             # Note, the method assumes `full_out_dim` when later called by a
             # user. We just misuse the function to call it inside the
@@ -259,8 +239,6 @@ class SplitMNIST(PositiveMNISTData):
             if self.is_one_hot:
                 self._data['out_shape'] = [len(labels)]
 
-        images = np.concatenate([train_ins, test_ins], axis=0)
-
         ### Overwrite internal data structure. Only keep desired labels.
 
         # Note, we continue to pretend to be a 10 class problem, such that
@@ -270,7 +248,6 @@ class SplitMNIST(PositiveMNISTData):
             self._data['num_classes'] = len(labels)
         else:
             self._data['num_classes'] = 10
-        self._data['in_data'] = images
         self._data['out_data'] = outputs
         self._data['train_inds'] = train_inds
         self._data['test_inds'] = test_inds
@@ -6,6 +6,9 @@ Link to the dataset: https://www.kaggle.com/datasets/arjunashok33/imagenet-subse
 Augmentation policy was taken from: https://github.com/dipamgoswami/FeCAM/blob/main/utils/autoaugment.py
 """
 
+import os
+import multiprocessing as mp
+from functools import partial
 import torch
 import numpy as np
 import random  # may be useful for validation data split
@@ -15,10 +18,93 @@ from PIL import Image, ImageEnhance, ImageOps
 from torchvision import transforms
 from torch.utils.data import Dataset, Subset, DataLoader
 from torchvision.datasets import ImageFolder
+from torchvision.datasets.folder import default_loader
+
+from DatasetHandlers.batched_transforms import BatchedImageTransform
+from DatasetHandlers.batched_autoaugment import BatchedAutoAugment
+
+
+def read_preresized_image(path: str, size: int) -> np.ndarray:
+    """
+    Decodes an image as the central square of the image resized so that
+    its shorter side has a given length.
+
+    Parameters:
+    -----------
+    path : str
+        The path of the image.
+
+    size : int
+        The side of the decoded image.
+
+    Returns:
+    --------
+    image : np.ndarray
+        uint8 image of the shape [size, size, 3].
+    """
+    image = transforms.CenterCrop(size)(transforms.Resize(size)(default_loader(path)))
+    return np.asarray(image, dtype=np.uint8)
+
+
+class IndexedImageFolder(Dataset):
+    """
+    A dataset of images listed in an index, equivalent to ImageFolder
+    but without scanning the directory.
+
+    Parameters:
+    -----------
+    root : str
+        The directory with images.
+
+    paths : np.ndarray
+        Paths of images relative to root.
+
+    targets : np.ndarray
+        Labels of consecutive images.
+
+    transform : callable, optional
+        A transformation of PIL images.
+
+    target_transform : callable, optional
+        A transformation of labels.
+
+    images : np.ndarray, optional
+        Decoded uint8 images, e.g. a memory-mapped shard of pre-resized
+        images. If None, images are read from files.
+    """
+    def __init__(self, root, paths, targets, transform=None, target_transform=None,
+                 images=None):
+        super().__init__()
+        self.root = root
+        self.paths = paths
+        self.targets = targets
+        self.transform = transform
+        self.target_transform = target_transform
+        self.images = images
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, index):
+        if self.images is None:
+            image = default_loader(os.path.join(self.root, self.paths[index]))
+        else:
+            image = Image.fromarray(np.asarray(self.images[index]))
+        target = int(self.targets[index])
+        if self.transform is not None:
+            image = self.transform(image)
+        if self.target_transform is not None:
+            target = self.target_transform(target)
+        return image, target
 
 
 class SubsetImageNet(Dataset):
 
+    # Indices of the training and test sets shared by all tasks of the process
+    _indices = {}
+    # Memory-mapped shards of pre-resized images shared by all tasks
+    _shards = {}
+
 
     def __init__(self, path: str, 
                 use_one_hot: bool = False,
@@ -26,7 +112,9 @@ class SubsetImageNet(Dataset):
                 validation_size: int = 100,
                 task_id: int = 0,
                 setting: int = 4,
-                batch_size: int = 16):
+                batch_size: int = 16,
+                preresized_size: int = None,
+                use_batched_augmentation: bool = False):
         
         """
         Initializes the class with the provided parameters.
@@ -53,6 +141,16 @@ class SubsetImageNet(Dataset):
 
         batch_size : int, optional
             The number of samples per batch to be fed into the model during training. Default is 16.
+
+        preresized_size : int, optional
+            If given, images are decoded once into shards of central squares of this size
+            (e.g. 80) and transformations operate at this resolution instead of
+            the full one. Default is None, i.e. images are read from files.
+
+        use_batched_augmentation : bool, optional
+            If True and preresized_size is given, batches consist of uint8 images, which are
+            cropped, augmented and normalized as whole batches on the target device
+            in input_to_torch_tensor. Default is False.
         """
         
         assert validation_size <= 250
@@ -71,12 +169,22 @@ class SubsetImageNet(Dataset):
         self._validation_size = validation_size
         self._setting = setting
         self._batch_size = batch_size
+        self._preresized_size = preresized_size
+        self._use_batched_augmentation = use_batched_augmentation and preresized_size is not None
         self._data["in_shape"] = [64, 64, 3]
 
+        if self._preresized_size is None:
+            resize_and_crop = [transforms.Resize(256), transforms.CenterCrop(224)]
+            random_resized_crop = transforms.RandomResizedCrop(224)
+        else:
+            # Pre-resized images are already central squares, as after Resize(256)
+            # with the central crop of the shorter side
+            resize_and_crop = [transforms.CenterCrop(round(self._preresized_size * 224 / 256))]
+            random_resized_crop = transforms.RandomResizedCrop(64)
+
         self._test_transform = transforms.Compose(
             [
-                transforms.Resize(256),
-                transforms.CenterCrop(224),
+                *resize_and_crop,
                 transforms.Resize((64, 64)),
                 transforms.ToTensor(),
                 transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
@@ -87,7 +195,7 @@ class SubsetImageNet(Dataset):
         if self._use_data_augmentation:
             self._train_transform = transforms.Compose(
                 [
-                    transforms.RandomResizedCrop(224),
+                    random_resized_crop,
                     transforms.RandomHorizontalFlip(),
                     ImageNetPolicy(),
                     transforms.Resize((64, 64)),
@@ -99,6 +207,16 @@ class SubsetImageNet(Dataset):
         else:
             self._train_transform = self._test_transform
 
+        if self._use_batched_augmentation:
+            # Pre-resized images are transformed by input_to_torch_tensor
+            (
+                self._batched_train_transform,
+                self._batched_test_transform,
+            ) = SubsetImageNet.batched_input_transforms(
+                self._use_data_augmentation
+            )
+            self._train_transform = self._test_transform = transforms.PILToTensor()
+
 
         if self._setting == 1:
             self._data["num_classes"] = 50
@@ -123,6 +241,32 @@ class SubsetImageNet(Dataset):
         self.num_test_samples  = len(self.test_data)
 
 
+    @staticmethod
+    def batched_input_transforms(use_data_augmentation: bool = True):
+        """
+        Prepare transformations of whole batches of pre-resized uint8 images,
+        similar to the transformations of full-resolution images.
+
+        Parameters:
+        ----------
+        use_data_augmentation : bool, optional
+            If False, training images are only cropped centrally and standardized.
+
+        Returns:
+        --------
+        A tuple containing train_transform and test_transform.
+        """
+        test_transform = BatchedImageTransform(
+            64, crop="center", center_crop_fraction=224 / 256
+        )
+        if not use_data_augmentation:
+            return test_transform, test_transform
+        train_transform = BatchedImageTransform(
+            64, crop="random_resized", horizontal_flip=True,
+            augmentation=BatchedAutoAugment(ImageNetPolicy())
+        )
+        return train_transform, test_transform
+
     def _get_task(self, task_id: int = 0, mode: str = 'train'):
         """
         Retrieves the task-specific data based on the provided task identifier and mode.
@@ -152,10 +296,17 @@ class SubsetImageNet(Dataset):
         else:
             target_transform = lambda x: self._calculate_modulo(x, task_id=task_id)
 
-        if mode == 'train':
-            dataset = ImageFolder(root=self._train_path, transform=self._train_transform, target_transform=target_transform)
-        elif mode == 'test':
-            dataset = ImageFolder(root=self._test_path, transform=self._test_transform, target_transform=target_transform)
+        root = self._train_path if mode == 'train' else self._test_path
+        index = self._load_index(root)
+        images = None
+        if self._preresized_size is not None:
+            images = self._load_shard(root, index["paths"], self._preresized_size)
+        dataset = IndexedImageFolder(
+            root, index["paths"], index["targets"],
+            transform=self._train_transform if mode == 'train' else self._test_transform,
+            target_transform=target_transform,
+            images=images
+        )
 
         if task_id == 0:
             curr_task_labels = self._labels[task_id*MAX_NUM_CLASSES: (task_id+1)*MAX_NUM_CLASSES]
@@ -166,28 +317,21 @@ class SubsetImageNet(Dataset):
             print(f'Order of classes in the current task: {curr_task_labels}')
             print('Preparing task images and labels...')
 
-            val_map = {target: [] for target in curr_task_labels}
-            val_map['all'] = []
-
-            # per each label in task, gather first self._validation_size number of instances
-            for j, label in enumerate(dataset.targets):
-                if label in curr_task_labels and len(val_map[label]) < self._validation_size:
-                    val_map[label] += [j]
-                    val_map['all'] += [j]  # gather all validation indices in one list
-
-            indices = [j for j, label in enumerate(dataset.targets) if label in curr_task_labels and j not in val_map[label]]
-            val_ds = Subset(dataset, val_map['all'])
-            train_ds = Subset(dataset, indices)
+            # per each label in task, the first self._validation_size instances
+            # are validation samples
+            in_task = np.isin(index["targets"], curr_task_labels)
+            is_val = index["rank_in_class"] < self._validation_size
+            val_ds = Subset(dataset, np.flatnonzero(in_task & is_val).tolist())
+            train_ds = Subset(dataset, np.flatnonzero(in_task & ~is_val).tolist())
 
             self._val_data_loader   = DataLoader(val_ds, batch_size=self._batch_size, shuffle=False)
             self._train_data_loader = DataLoader(train_ds, batch_size=self._batch_size, shuffle=True)
 
-            del val_map
             print('Done!')
             return train_ds, val_ds
         else:
-            indices = [j for j, label in enumerate(dataset.targets) if label in curr_task_labels]
-            test_ds = Subset(dataset, indices)
+            indices = np.flatnonzero(np.isin(index["targets"], curr_task_labels))
+            test_ds = Subset(dataset, indices.tolist())
 
             self._test_data_loader = DataLoader(test_ds, batch_size=self._batch_size, shuffle=False)
 
@@ -200,6 +344,108 @@ class SubsetImageNet(Dataset):
         ## labels = np.array([elem[1] for elem in ds])
         # return images, labels
     
+    @staticmethod
+    def _load_index(root: str):
+        """
+        Loads the index of images of a given directory: paths, labels and
+        positions of images within their classes. The index is built by
+        a single scan of the directory, with the same order of images and
+        labels as ImageFolder, and saved next to the directory.
+
+        Parameters:
+        -----------
+        root : str
+            The directory with the training or test set.
+
+        Returns:
+        --------
+        index : dict
+            Arrays "paths" (relative to root), "targets" and "rank_in_class".
+        """
+        if root not in SubsetImageNet._indices:
+            index_path = f"{os.path.normpath(root)}_index.npz"
+            if not os.path.exists(index_path):
+                print(f'Building the index of {root}...')
+                samples = ImageFolder(root=root).samples
+                paths = np.array([os.path.relpath(path, root) for path, _ in samples])
+                targets = np.array([target for _, target in samples], dtype=np.int64)
+                # Position of each image among images of its class
+                order = np.argsort(targets, kind="stable")
+                class_starts = np.searchsorted(targets[order], targets[order])
+                rank_in_class = np.empty_like(targets)
+                rank_in_class[order] = np.arange(targets.shape[0]) - class_starts
+                temporary_path = f"{index_path}.{os.getpid()}.tmp"
+                with open(temporary_path, "wb") as stream:
+                    np.savez(stream, paths=paths, targets=targets,
+                             rank_in_class=rank_in_class)
+                os.replace(temporary_path, index_path)
+            with np.load(index_path) as index:
+                SubsetImageNet._indices[root] = {key: index[key] for key in index.files}
+        return SubsetImageNet._indices[root]
+
+    @staticmethod
+    def _load_shard(root: str, paths: np.ndarray, size: int, number_of_workers: int = None):
+        """
+        Loads the memory-mapped shard of pre-resized images of a given directory.
+        During the first call the shard is built: images are decoded and resized
+        in parallel by a pool of workers (or serially in daemonic processes,
+        which cannot have children) and written to the shard one by one
+        in the order of the index.
+
+        Parameters:
+        -----------
+        root : str
+            The directory with the training or test set.
+
+        paths : np.ndarray
+            Paths of images relative to root, from the index of the directory.
+
+        size : int
+            The side of pre-resized images.
+
+        number_of_workers : int, optional
+            The number of decoding processes. By default, the number of CPUs.
+
+        Returns:
+        --------
+        images : np.memmap
+            uint8 images of the shape [number of images, size, size, 3].
+        """
+        shard_path = f"{os.path.normpath(root)}_{size}px.npy"
+        if shard_path not in SubsetImageNet._shards:
+            if not os.path.exists(shard_path):
+                print(f'Pre-resizing images of {root} to {size}x{size}...')
+                temporary_path = f"{shard_path}.{os.getpid()}.tmp"
+                images = np.lib.format.open_memmap(
+                    temporary_path, mode="w+", dtype=np.uint8,
+                    shape=(len(paths), size, size, 3)
+                )
+                read_image = partial(read_preresized_image, size=size)
+                image_paths = [os.path.join(root, path) for path in paths]
+                if mp.current_process().daemon:
+                    for i, image in enumerate(map(read_image, image_paths)):
+                        images[i] = image
+                else:
+                    with mp.Pool(number_of_workers) as pool:
+                        for i, image in enumerate(pool.imap(read_image, image_paths,
+                                                            chunksize=64)):
+                            images[i] = image
+                images.flush()
+                del images
+                os.replace(temporary_path, shard_path)
+            images = np.load(shard_path, mmap_mode="r")
+            assert images.shape[0] == len(paths)
+            SubsetImageNet._shards[shard_path] = images
+        return SubsetImageNet._shards[shard_path]
+
+    def release_training_data(self):
+        """
+        Releases the training and validation data of a finished task.
+        The test data is kept for evaluation.
+        """
+        self.train_data, self.val_data = None, None
+        self._train_data_loader, self._val_data_loader = None, None
+
     def get_val_inputs(self):
         """
         Retrieves the input images for the validation dataset.
@@ -298,6 +544,10 @@ class SubsetImageNet(Dataset):
         torch.Tensor
             The input data as a PyTorch tensor on the specified device.
         """
+        if x.dtype == torch.uint8 and not force_no_preprocessing:
+            # A batch of pre-resized uint8 images of the shape [B, C, H, W]
+            transform = self._batched_train_transform if mode == 'train' else self._batched_test_transform
+            return torch.permute(transform(x.to(device)), (0, 2, 3, 1))
         return x.to(device)
 
     def output_to_torch_tensor(self, x, device, mode='inference', force_no_preprocessing=False, sample_ids=None):
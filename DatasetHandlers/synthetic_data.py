@@ -0,0 +1,169 @@
+"""
+Synthetic stand-ins of the continual learning datasets used in the experiments.
+They have the same input shapes, class splits and numbers of tasks as the real
+datasets but are generated deterministically, so they do not require downloads.
+Samples of each class are noisy copies of a random class prototype, with values
+in [0, 1] (i.e., non-negative, as required by interval layers).
+"""
+import numpy as np
+
+from hypnettorch.data.dataset import Dataset
+
+# Input shape, numbers of classes in consecutive tasks and, optionally,
+# the default number of tasks (for setups with equal tasks)
+SYNTHETIC_DATASET_SPECIFICATIONS = {
+    "PermutedMNIST": {"in_shape": [28, 28, 1], "classes_per_task": 10,
+                      "number_of_tasks": 10},
+    "SplitMNIST": {"in_shape": [28, 28, 1], "classes_per_task": 2,
+                   "number_of_tasks": 5},
+    "CIFAR10": {"in_shape": [32, 32, 3], "classes_per_task": 2,
+                "number_of_tasks": 5},
+    "CIFAR100": {"in_shape": [32, 32, 3], "classes_per_task": 10,
+                 "number_of_tasks": 10},
+    "CIFAR100_FeCAM_setup": {"in_shape": [32, 32, 3], "classes_per_task": 5,
+                             "number_of_tasks": 20},
+    "TinyImageNet": {"in_shape": [64, 64, 3], "classes_per_task": 5,
+                     "number_of_tasks": 40},
+    "SubsetImageNet": {"in_shape": [64, 64, 3], "classes_per_task": 20,
+                       "number_of_tasks": 5},
+    "CUB200": {"in_shape": [224, 224, 3], "classes_per_task": 10,
+               "number_of_tasks": 20},
+}
+
+
+class SyntheticClassificationData(Dataset):
+    """
+    A single classification task with synthetic samples.
+
+    Parameters:
+    -----------
+        in_shape: List[int]
+            The shape of a single input sample, e.g. [32, 32, 3].
+            Inputs are stored flattened, as in the real data handlers.
+        num_classes: int
+            The number of classes in the task.
+        num_train_per_class: int
+            The number of training samples of each class.
+        num_val_per_class: int
+            The number of validation samples of each class.
+        num_test_per_class: int
+            The number of test samples of each class.
+        noise: float
+            The standard deviation of the noise added to class prototypes.
+        use_one_hot: bool
+            Whether the class labels should be represented in a one-hot encoding.
+        rseed: int
+            The seed of the generator of the task.
+        identifier: str
+            The name of the imitated dataset.
+    """
+    def __init__(self, in_shape, num_classes, num_train_per_class=50,
+                 num_val_per_class=10, num_test_per_class=10, noise=0.2,
+                 use_one_hot=True, rseed=0, identifier="Synthetic"):
+        super().__init__()
+
+        rand = np.random.RandomState(rseed)
+        in_size = int(np.prod(in_shape))
+        prototypes = rand.uniform(0.0, 1.0, size=(num_classes, in_size)).astype(np.float32)
+
+        def generate(num_per_class):
+            labels = np.repeat(np.arange(num_classes), num_per_class)
+            labels = labels[rand.permutation(labels.shape[0])]
+            samples = prototypes[labels] + noise * rand.standard_normal(
+                (labels.shape[0], in_size)).astype(np.float32)
+            return np.clip(samples, 0.0, 1.0), labels
+
+        train_x, train_y = generate(num_train_per_class)
+        test_x, test_y = generate(num_test_per_class)
+        val_x, val_y = generate(num_val_per_class)
+        labels = np.concatenate([train_y, test_y, val_y])
+
+        num_train = train_x.shape[0]
+        num_test = test_x.shape[0]
+        num_val = val_x.shape[0]
+
+        self._data['classification'] = True
+        self._data['sequence'] = False
+        self._data['num_classes'] = num_classes
+        self._data['is_one_hot'] = use_one_hot
+        self._data['in_data'] = np.vstack([train_x, test_x, val_x])
+        self._data['in_shape'] = list(in_shape)
+        if use_one_hot:
+            self._data['out_data'] = np.eye(num_classes, dtype=np.float32)[labels]
+            self._data['out_shape'] = [num_classes]
+        else:
+            self._data['out_data'] = labels.reshape(-1, 1)
+            self._data['out_shape'] = [1]
+        self._data['train_inds'] = np.arange(num_train)
+        self._data['test_inds'] = np.arange(num_train, num_train + num_test)
+        if num_val > 0:
+            self._data['val_inds'] = np.arange(num_train + num_test,
+                                               num_train + num_test + num_val)
+        self._identifier = identifier
+
+    def get_identifier(self):
+        """Returns the name of the dataset."""
+        return f"Synthetic{self._identifier}"
+
+    def _plot_sample(self, fig, inner_grid, num_inner_plots, ind, inputs,
+                     outputs=None, predictions=None):
+        """Not implemented"""
+        raise NotImplementedError()
+
+
+def get_synthetic_handlers(dataset, number_of_tasks=None, num_train_per_class=50,
+                           num_val_per_class=10, num_test_per_class=10,
+                           use_one_hot=True, seed=0, padding=None):
+    """
+    Generate a list of synthetic tasks imitating a given dataset.
+
+    Parameters:
+    -----------
+        dataset: str
+            The name of the imitated dataset, one of the keys of
+            SYNTHETIC_DATASET_SPECIFICATIONS.
+        number_of_tasks: int, optional
+            The number of generated tasks. By default, the number of tasks
+            of the imitated dataset.
+        num_train_per_class: int
+            The number of training samples of each class.
+        num_val_per_class: int
+            The number of validation samples of each class.
+        num_test_per_class: int
+            The number of test samples of each class.
+        use_one_hot: bool
+            Whether the class labels should be represented in a one-hot encoding.
+        seed: int
+            The seed of the generator; the i-th task uses seed + i.
+        padding: int, optional
+            The padding of PermutedMNIST images, which enlarges their
+            height and width by 2 * padding, as in the real handler.
+
+    Returns:
+    --------
+    List[SyntheticClassificationData]
+        A list of tasks.
+    """
+    if dataset not in SYNTHETIC_DATASET_SPECIFICATIONS:
+        raise ValueError("Wrong name of the dataset!")
+    specification = SYNTHETIC_DATASET_SPECIFICATIONS[dataset]
+    if number_of_tasks is None:
+        number_of_tasks = specification["number_of_tasks"]
+    in_shape = list(specification["in_shape"])
+    if dataset == "PermutedMNIST" and padding:
+        in_shape[0] += 2 * padding
+        in_shape[1] += 2 * padding
+
+    return [
+        SyntheticClassificationData(
+            in_shape=in_shape,
+            num_classes=specification["classes_per_task"],
+            num_train_per_class=num_train_per_class,
+            num_val_per_class=num_val_per_class,
+            num_test_per_class=num_test_per_class,
+            use_one_hot=use_one_hot,
+            rseed=seed + i,
+            identifier=dataset
+        )
+        for i in range(number_of_tasks)
+    ]
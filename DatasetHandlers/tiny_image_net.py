@@ -15,7 +15,8 @@ import torch
 import urllib.request
 from zipfile import ZipFile
 from hypnettorch.data.dataset import Dataset
-import torchvision.transforms as transforms
+from DatasetHandlers.batched_transforms import BatchedImageTransform
+from DatasetHandlers.lazy_task_list import keep_only_test_samples
 from skimage import io
 from skimage.color import gray2rgb
 
@@ -24,6 +25,10 @@ class TinyImageNet(Dataset):
     _DOWNLOAD_PATH = "http://cs231n.stanford.edu/"
     _DOWNLOAD_FILE = "tiny-imagenet-200.zip"
     _EXTRACTED_FOLDER = "tiny-imagenet-200"
+    # Decoded images stored as uint8 arrays, built once and memory-mapped
+    _CACHE_FOLDER = "tiny-imagenet-200-uint8"
+    # Memory-mapped arrays shared by all tasks of the process
+    _loaded_caches = {}
 
     def __init__(
         self,
@@ -125,13 +130,15 @@ class TinyImageNet(Dataset):
         end = time.time()
         print(f"Elapsed time to read dataset: {end-start} sec.")
 
-    def torch_input_transforms(self):
+    @staticmethod
+    def torch_input_transforms():
         """
         Prepare data standarization, and potentially also augmentation,
         for TinyImageNet images.
 
         Data augmentation is implemented as in
         https://github.com/ihaeyong/WSN/blob/main/dataloader/idataset.py.
+        Transformations are applied to whole batches of images.
 
         Returns:
         --------
@@ -139,27 +146,9 @@ class TinyImageNet(Dataset):
         and random image transformations and **test_transform** that applies
         only data standarization.
         """
-        test_transform = transforms.Compose(
-            [
-                transforms.ToPILImage("RGB"),
-                transforms.ToTensor(),
-                transforms.Normalize(
-                    (0.485, 0.456, 0.406), (0.229, 0.224, 0.225)
-                ),
-            ]
-        )
-
-        train_transform = transforms.Compose(
-            [
-                transforms.ToPILImage("RGB"),
-                transforms.RandomCrop(64, padding=4),
-                transforms.RandomHorizontalFlip(),
-                transforms.Resize((64, 64)),
-                transforms.ToTensor(),
-                transforms.Normalize(
-                    (0.485, 0.456, 0.406), (0.229, 0.224, 0.225)
-                ),
-            ]
+        test_transform = BatchedImageTransform(64)
+        train_transform = BatchedImageTransform(
+            64, crop="random", crop_padding=4, horizontal_flip=True
         )
 
         return train_transform, test_transform
@@ -170,6 +159,13 @@ class TinyImageNet(Dataset):
     def get_identifier(self):
         return "TinyImageNet"
 
+    def release_training_data(self):
+        """
+        Release training and validation samples of a finished task;
+        test samples are kept for evaluation.
+        """
+        keep_only_test_samples(self)
+
     def _plot_sample(self):
         pass
 
@@ -228,8 +224,8 @@ class TinyImageNet(Dataset):
                 2D array containing TinyImageNet images.
             device: torch.device or int: 
                 PyTorch device on which a final tensor will be moved.
-            transform: torchvision.transforms
-                A method of data modification.
+            transform: BatchedImageTransform
+                A method of data modification of a batch of images.
 
         Returns:
         --------
@@ -237,20 +233,21 @@ class TinyImageNet(Dataset):
         """
         assert len(x.shape) == 2
         # First dimension is related to batch size and second is related
-        # to the flattened image.
-        x = (x * 255.0).astype("uint8")
-        x = x.reshape(-1, *img_shape)
-        x = torch.stack([transform(x[i, ...]) for i in range(x.shape[0])]).to(
-            device
-        )
+        # to the flattened image. Images are stored as uint8 but float
+        # images with values in [0, 1] are accepted too.
+        if x.dtype != np.uint8:
+            x = (x * 255.0).astype("uint8")
+        x = torch.from_numpy(np.ascontiguousarray(x.reshape(-1, *img_shape)))
+        # uint8 images are moved to the device before the transformation
+        x = transform(x.to(device).permute(0, 3, 1, 2))
         x = x.permute(0, 2, 3, 1)
         x = x.contiguous().view(-1, np.prod(img_shape))
         return x
 
     def prepare_training_test_set_with_labels(self, mode="train"):
         """
-        Function implemented on the basis of:
-        https://github.com/pytorch/vision/issues/6127#issuecomment-1555049003
+        Select images of the classes of the current task from the decoded
+        dataset. Images are stored as flattened uint8 arrays.
 
         Parameters:
         ----------
@@ -258,11 +255,74 @@ class TinyImageNet(Dataset):
             'train' for the training set or 'test' for the validation set
         """
         assert mode in ["train", "test"]
-        data, labels = [], []
+        images, real_labels = self._load_cache(mode)
+        selected = np.isin(real_labels, self._labels)
+        data = images[selected]
+        translation = np.zeros(200, dtype=np.int64)
+        translation[list(self.translate_real_label_to_temp_label.keys())] = list(
+            self.translate_real_label_to_temp_label.values()
+        )
+        labels = translation[real_labels[selected]].reshape(-1, 1)
+        # 200 classes in TinyImageNet
+        assert np.min(np.squeeze(labels)) == np.min(
+            list(self.translate_temp_label_to_real_labels.keys())
+        )
+        assert np.max(np.squeeze(labels)) == np.max(
+            list(self.translate_temp_label_to_real_labels.keys())
+        )
+        return data, labels
+
+    def _load_cache(self, mode="train"):
+        """
+        Load decoded images of the whole training or test set as
+        a memory-mapped uint8 array, together with their real labels.
+        The cache is built during the first call and shared by all tasks.
+
+        Parameters:
+        ----------
+           mode: optional string
+            'train' for the training set or 'test' for the validation set
+
+        Returns:
+        --------
+          images: np.memmap
+            Flattened images, of the shape (number of images, 12288).
+          labels: np.ndarray
+            Real labels (from 0 to 199) of consecutive images.
+        """
+        cache_folder = os.path.join(self.data_path, TinyImageNet._CACHE_FOLDER)
+        images_path = os.path.join(cache_folder, f"{mode}_images.npy")
+        labels_path = os.path.join(cache_folder, f"{mode}_labels.npy")
+        if images_path not in TinyImageNet._loaded_caches:
+            if not (os.path.exists(images_path) and os.path.exists(labels_path)):
+                self._build_cache(mode, images_path, labels_path)
+            TinyImageNet._loaded_caches[images_path] = (
+                np.load(images_path, mmap_mode="r"),
+                np.load(labels_path)
+            )
+        return TinyImageNet._loaded_caches[images_path]
+
+    def _build_cache(self, mode, images_path, labels_path):
+        """
+        Decode all images of the training or test set once and save them
+        as a uint8 array with real labels. Function implemented on the basis of:
+        https://github.com/pytorch/vision/issues/6127#issuecomment-1555049003
+
+        Parameters:
+        ----------
+           mode: string
+            'train' for the training set or 'test' for the validation set
+           images_path: string
+            The path of the array with images.
+           labels_path: string
+            The path of the array with labels.
+        """
+        print(f"Decoding TinyImageNet {mode} images to {images_path}...")
         if mode == "train":
             filenames = glob.glob(
                 f"{self.data_path}/tiny-imagenet-200/train/*/*/*.JPEG"
             )
+            labels = [self.ids[file.split("/")[-3]] for file in sorted(filenames)]
         elif mode == "test":
             id_dict_test = {}
             for i, line in enumerate(
@@ -277,31 +337,28 @@ class TinyImageNet(Dataset):
             filenames = glob.glob(
                 f"{self.data_path}/tiny-imagenet-200/val/images/*.JPEG"
             )
-        for file in filenames:
+            labels = [id_dict_test[file.split("/")[-1]] for file in sorted(filenames)]
+        filenames = sorted(filenames)
+
+        os.makedirs(os.path.dirname(images_path), exist_ok=True)
+        # Files are written under temporary names and renamed when complete
+        temporary_images_path = f"{images_path}.{os.getpid()}.tmp"
+        images = np.lib.format.open_memmap(
+            temporary_images_path, mode="w+", dtype=np.uint8,
+            shape=(len(filenames), np.prod(self._data["in_shape"]))
+        )
+        for i, file in enumerate(filenames):
             image = io.imread(file)
             if len(image.shape) == 2:  # gray-scale
                 image = gray2rgb(image)
-            image = image / 255
-            if mode == "train":
-                label = self.ids[file.split("/")[-3]]
-            elif mode == "test":
-                label = id_dict_test[file.split("/")[-1]]
-            # Add to the image only cases which are from the desired class
-            if label in self._labels:
-                label = self.translate_real_label_to_temp_label[label]
-                image = image.reshape(np.prod(image.shape))
-                data.append(image)
-                labels.append([label])
-        data = np.vstack(data)
-        labels = np.array(labels)
-        # 200 classes in TinyImageNet
-        assert np.min(np.squeeze(labels)) == np.min(
-            list(self.translate_temp_label_to_real_labels.keys())
-        )
-        assert np.max(np.squeeze(labels)) == np.max(
-            list(self.translate_temp_label_to_real_labels.keys())
-        )
-        return data, labels
+            images[i] = image.reshape(-1)
+        images.flush()
+        del images
+        temporary_labels_path = f"{labels_path}.{os.getpid()}.tmp"
+        with open(temporary_labels_path, "wb") as stream:
+            np.save(stream, np.array(labels, dtype=np.int16))
+        os.replace(temporary_labels_path, labels_path)
+        os.replace(temporary_images_path, images_path)
 
     def _read_label_names(self):
         """
@@ -405,10 +462,12 @@ class TinyImageNet(Dataset):
                 train_labels_for_val_separation == no_of_class
             )
 
-        np.random.seed(self._seed)
+        # A local generator gives the same split as seeding the global one,
+        # without changing the state of the global generator
+        rng = np.random.RandomState(self._seed)
         train_indices, val_indices = [], []
         for cur_class in list(class_positions.keys()):
-            perm = np.random.permutation(class_positions[cur_class])
+            perm = rng.permutation(class_positions[cur_class])
             cur_class_val_indices = perm[: self._no_of_val_samples_per_class]
             cur_class_train_indices = perm[self._no_of_val_samples_per_class :]
             train_indices.extend(list(cur_class_train_indices.flatten()))
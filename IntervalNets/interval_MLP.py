@@ -422,6 +422,92 @@ class IntervalMLP(MLP, MainNetInterface):
 
         return hidden
 
+    def forward_tasks(self, x, upper_weights, middle_weights, lower_weights,
+                      middle_only=False):
+        """
+        Compute outputs of this network for weights of many tasks at once,
+        e.g., for all candidate tasks during task-agnostic inference.
+        Layers are evaluated with batched matrix multiplications instead
+        of a separate forward pass for each task.
+
+        Parameters:
+        -----------
+        x : torch.Tensor
+            The input tensor of shape (batch_size, input_size), shared by all tasks.
+        upper_weights : list of torch.Tensor
+            The upper weights of the network, stacked along the first
+            dimension for consecutive tasks.
+        middle_weights : list of torch.Tensor
+            The stacked middle weights of the network.
+        lower_weights : list of torch.Tensor
+            The stacked lower weights of the network.
+        middle_only : bool, optional
+            If True, only middle weights are propagated (lower and upper
+            weights may be None), which is a cheap approximation of
+            the interval output.
+
+        Returns:
+        --------
+        torch.Tensor
+            The output tensor of shape (tasks, batch_size, 3, output_size)
+            or (tasks, batch_size, output_size) if middle_only is True.
+            As in forward, if out_fn is given, a tuple of the transformed
+            output and the raw output is returned.
+        """
+        # Dropout is applied only during training
+        assert not self.training or self._dropout_rate == -1, \
+            "Task-batched forward is intended for inference!"
+        assert len(middle_weights) == len(self.param_shapes)
+        assert middle_only or \
+            len(upper_weights) == len(middle_weights) == len(lower_weights)
+        for i, s in enumerate(self.param_shapes):
+            assert list(middle_weights[i].shape[1:]) == list(s)
+
+        step = 2 if self.has_bias else 1
+        number_of_layers = len(middle_weights) // step
+
+        if middle_only:
+            hidden = x
+            for l in range(number_of_layers):
+                i = l * step
+                hidden = hidden @ middle_weights[i].transpose(-1, -2)
+                if self.has_bias:
+                    hidden = hidden + middle_weights[i + 1].unsqueeze(-2)
+                if l < number_of_layers - 1 and self._a_fun is not None:
+                    hidden = self._a_fun(hidden)
+            if self._out_fn is not None:
+                return self._out_fn(hidden), hidden
+            return hidden
+
+        hidden = torch.stack([x, x, x], dim=1)
+        for l in range(number_of_layers):
+            i = l * step
+            if self.has_bias:
+                b_upper = upper_weights[i + 1]
+                b_middle = middle_weights[i + 1]
+                b_lower = lower_weights[i + 1]
+            else:
+                b_upper = None
+                b_middle = None
+                b_lower = None
+
+            hidden = IntervalLinear.apply_linear_tasks(hidden,
+                                                upper_weights=upper_weights[i],
+                                                middle_weights=middle_weights[i],
+                                                lower_weights=lower_weights[i],
+                                                upper_bias=b_upper,
+                                                middle_bias=b_middle,
+                                                lower_bias=b_lower)
+
+            # Only for hidden layers.
+            if l < number_of_layers - 1 and self._a_fun is not None:
+                hidden = self._a_fun(hidden)
+
+        if self._out_fn is not None:
+            return self._out_fn(hidden), hidden
+
+        return hidden
+
     @staticmethod
     def weight_shapes(n_in=1, n_out=1, hidden_layers=[10, 10], use_bias=True):
         """Compute the tensor shapes of all parameters in a fully-connected
@@ -148,6 +148,84 @@ class IntervalLinear(IntervalModuleWithWeights):
         assert (middle <= upper).all(), "Middle bound must be less than or equal to upper bound."
 
         return torch.stack([lower, middle, upper], dim=1).refine_names("N", "bounds", "features")  # type: ignore
+
+    @staticmethod
+    def apply_linear_tasks(
+                x: Tensor,
+                upper_weights: Tensor,
+                middle_weights: Tensor,
+                lower_weights: Tensor,
+                upper_bias: Tensor,
+                middle_bias: Tensor,
+                lower_bias: Tensor
+                ) -> Tensor:  # type: ignore
+        """
+        Computes the output bounds for weights of many tasks at once,
+        using batched matrix multiplications.
+
+        Parameters:
+        -----------
+            x: torch.Tensor
+                Input tensor with shape (batch_size, bounds, features), shared
+                by all tasks, or (tasks, batch_size, bounds, features).
+            upper_weights: torch.Tensor
+                Upper weights with shape (tasks, out_features, in_features).
+            middle_weights: torch.Tensor
+                Middle weights with shape (tasks, out_features, in_features).
+            lower_weights: torch.Tensor
+                Lower weights with shape (tasks, out_features, in_features).
+            upper_bias: torch.Tensor or None
+                Upper bias with shape (tasks, out_features).
+            middle_bias: torch.Tensor or None
+                Middle bias with shape (tasks, out_features).
+            lower_bias: torch.Tensor or None
+                Lower bias with shape (tasks, out_features).
+
+        Returns:
+            torch.Tensor:
+                Output tensor with bounds (tasks, batch_size, bounds, features).
+
+        Raises:
+            AssertionError:
+                If input bounds violate constraints.
+        """
+
+        assert (lower_weights <= middle_weights).all(), "Lower bound must be less than or equal to middle bound."
+        assert (middle_weights <= upper_weights).all(), "Middle bound must be less than or equal to upper bound."
+        if middle_bias is not None:
+            assert (lower_bias <= middle_bias).all(), "Lower bias must be less than or equal to middle bias."
+            assert (middle_bias <= upper_bias).all(), "Middle bias must be less than or equal to upper bias."
+
+        x = x.rename(None)
+        assert (x >= 0.0).all(), "All input features must be non-negative."
+
+        x_lower, x_middle, x_upper = x.unbind(dim=-2)
+        assert (x_lower <= x_middle).all(), "Lower bound must be less than or equal to middle bound."
+        assert (x_middle <= x_upper).all(), "Middle bound must be less than or equal to upper bound."
+
+        # Inputs shared by all tasks are broadcasted by matmul
+        w_lower_pos = lower_weights.clamp(min=0).transpose(-1, -2)
+        w_lower_neg = lower_weights.clamp(max=0).transpose(-1, -2)
+        w_upper_pos = upper_weights.clamp(min=0).transpose(-1, -2)
+        w_upper_neg = upper_weights.clamp(max=0).transpose(-1, -2)
+
+        # Further splits only needed for numeric stability with asserts
+        w_middle_pos = middle_weights.clamp(min=0).transpose(-1, -2)
+        w_middle_neg = middle_weights.clamp(max=0).transpose(-1, -2)
+
+        lower = x_lower @ w_lower_pos + x_upper @ w_lower_neg
+        upper = x_upper @ w_upper_pos + x_lower @ w_upper_neg
+        middle = x_middle @ w_middle_pos + x_middle @ w_middle_neg
+
+        if middle_bias is not None:
+            lower = lower + lower_bias.unsqueeze(-2)
+            upper = upper + upper_bias.unsqueeze(-2)
+            middle = middle + middle_bias.unsqueeze(-2)
+
+        assert (lower <= middle).all(), "Lower bound must be less than or equal to middle bound."
+        assert (middle <= upper).all(), "Middle bound must be less than or equal to upper bound."
+
+        return torch.stack([lower, middle, upper], dim=-2)
         
 
 class IntervalDropout(nn.Module):
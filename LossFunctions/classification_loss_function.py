@@ -4,6 +4,47 @@ This file implements worst-case loss function used in the framework.
 
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
+
+
+def calculate_ibp_loss(y_pred, y, z_l, z_u, kappa):
+    """
+    Functional form of the IBP loss which does not synchronize
+    with the device and has no side effects, so it may be used
+    inside torch.func transformations (e.g., vmap).
+
+    Parameters:
+    -----------
+    y_pred: torch.Tensor
+        Predicted logits.
+    y: torch.Tensor
+        Ground-truth labels.
+    z_l: torch.Tensor
+        Tensor with lower logits.
+    z_u: torch.Tensor
+        Tensor with upper logits.
+    kappa: float
+        Weighting factor for combining fit loss and worst-case loss.
+
+    Returns:
+    --------
+    Tuple[torch.Tensor, torch.Tensor]
+        Total calculated loss and worst-case prediction logits.
+    """
+    # Standard cross-entropy loss component
+    loss_fit = F.cross_entropy(y_pred, y)
+
+    # Calculate worst-case prediction logits
+    tmp = F.one_hot(y, y_pred.size(-1))
+    z = torch.where(tmp.bool(), z_l, z_u)
+
+    # Worst-case loss component
+    loss_spec = F.cross_entropy(z, y)
+
+    total_loss = kappa * loss_fit + (1 - kappa) * loss_spec
+
+    return total_loss, z
+
 
 class IBP_Loss(nn.Module):
     """
@@ -0,0 +1,635 @@
+"""
+This file implements training of several independent HINT models (one per seed)
+in lockstep in a single process. Parameters of hypernetworks are stacked and
+a single forward/backward pass is vectorized over seeds with torch.func.vmap.
+
+It is intended for small models (PermutedMNIST and SplitMNIST with LeNet or MLP
+target networks) which, trained separately, do not load the hardware.
+"""
+
+import torch
+
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+from copy import deepcopy
+from datetime import datetime
+from itertools import product
+from torch.func import functional_call, stack_module_state, vmap
+
+# Get the parent directory path
+parent_dir = os.path.abspath(os.path.join(os.getcwd(), '.'))
+
+# Add the parent directory to sys.path
+sys.path.insert(0, parent_dir)
+
+from IntervalNets.hmlp_ibp_wo_nesting import HMLP_IBP
+
+from VanillaNets.LeNet_300_100 import LeNet
+from hypnettorch.mnets.mlp import MLP
+
+import Utils.hnet_middle_regularizer as hreg
+from LossFunctions.classification_loss_function import calculate_ibp_loss
+from Utils.prepare_non_forced_scenario_params import set_hyperparameters
+from Utils.dataset_utils import *
+from Utils.handy_functions import *
+
+
+def prepare_tasks(path_to_datasets, parameters, seed):
+    """
+    Prepare a list of tasks for a given seed. For PermutedMNIST
+    permutations depend on the seed, therefore each seed has
+    its own list of tasks.
+
+    Parameters:
+    -----------
+    path_to_datasets: str
+        Path to files with datasets.
+    parameters: dict
+        Contains multiple experiment hyperparameters.
+    seed: int
+        The seed of the current model.
+
+    Returns:
+    --------
+    A list of tasks for the CL scenario.
+    """
+    set_seed(seed)
+    if parameters["dataset"] == "PermutedMNIST":
+        return prepare_permuted_mnist_tasks(
+            path_to_datasets,
+            parameters["input_shape"],
+            parameters["number_of_tasks"],
+            parameters["padding"],
+            parameters["no_of_validation_samples"],
+            device=parameters["device"]
+        )
+    elif parameters["dataset"] == "SplitMNIST":
+        return prepare_split_mnist_tasks(
+            path_to_datasets,
+            validation_size=parameters["no_of_validation_samples"],
+            use_augmentation=parameters["augmentation"],
+            number_of_tasks=parameters["number_of_tasks"],
+        )
+    else:
+        raise ValueError("Multi-seed training supports only MNIST-based datasets!")
+
+
+def prepare_networks(parameters, output_shape, seed):
+    """
+    Create a target network and a hypernetwork initialized with a given seed.
+
+    Parameters:
+    -----------
+    parameters: dict
+        Contains multiple experiment hyperparameters.
+    output_shape: int
+        The number of outputs of the target network.
+    seed: int
+        The seed of the current model.
+
+    Returns:
+    --------
+    Tuple[HMLP_IBP, torch.nn.Module]
+        A hypernetwork and a target network.
+    """
+    set_seed(seed)
+    if parameters["target_network"] == "MLP":
+        target_network = MLP(n_in=parameters["input_shape"],
+                             n_out=output_shape,
+                             hidden_layers=parameters["target_hidden_layers"],
+                             use_bias=parameters["use_bias"],
+                             no_weights=True,
+                             use_batch_norm=False,
+                             bn_track_stats=False,
+                             dropout_rate=parameters["dropout_rate"]).to(parameters["device"])
+    elif parameters["target_network"] == "LeNet":
+        target_network = LeNet(
+            in_shape=(28, 28, 1),
+            num_classes=output_shape
+        ).to(parameters["device"])
+    else:
+        raise ValueError("Multi-seed training supports only MLP and LeNet target networks!")
+
+    hypernetwork = HMLP_IBP(
+        perturbated_eps=parameters["perturbated_epsilon"],
+        target_shapes=target_network.param_shapes,
+        uncond_in_size=0,
+        cond_in_size=parameters["embedding_size"],
+        activation_fn=parameters["activation_function"],
+        layers=parameters["hypernetwork_hidden_layers"],
+        num_cond_embs=parameters["number_of_tasks"]).to(
+            parameters["device"])
+    return hypernetwork, target_network
+
+
+def load_seed_parameters(hypernetwork, stacked_params, seed_index):
+    """
+    Copy parameters of a single seed from stacked tensors
+    into a hypernetwork.
+
+    Parameters:
+    -----------
+    hypernetwork: HMLP_IBP
+        A hypernetwork of the given seed.
+    stacked_params: dict
+        Parameters of all hypernetworks stacked along the first dimension.
+    seed_index: int
+        The position of the seed in the stack.
+    """
+    with torch.no_grad():
+        for name, param in hypernetwork.named_parameters():
+            param.copy_(stacked_params[name][seed_index])
+
+
+def train_single_task(hypernetworks,
+                      base_hypernetwork,
+                      target_network,
+                      stacked_params,
+                      stacked_buffers,
+                      parameters,
+                      list_of_seeds_tasks,
+                      current_no_of_task):
+    """
+    Train hypernetworks of all seeds on a single task in lockstep.
+
+    Parameters:
+    -----------
+    hypernetworks: List[HMLP_IBP]
+        Hypernetworks of consecutive seeds, used for the calculation of targets
+        of the regularization and for validation.
+    base_hypernetwork: HMLP_IBP
+        A hypernetwork which structure is used by the functional call.
+    target_network: hypnettorch.mnets module
+        A target network shared by all seeds (it has no internal weights).
+    stacked_params: dict
+        Parameters of all hypernetworks stacked along the first dimension.
+    stacked_buffers: dict
+        Buffers of all hypernetworks stacked along the first dimension.
+    parameters: dict
+        Contains necessary hyperparameters describing an experiment.
+    list_of_seeds_tasks: List
+        Lists of tasks for the CL scenario for consecutive seeds.
+    current_no_of_task: int
+        Specifies the number of the currently solving task.
+    """
+    number_of_seeds = len(hypernetworks)
+
+    # Only unconditional weights and the embedding (with its perturbation
+    # vector) of the current task are trained
+    current_task_params = {
+        id(hypernetworks[0].conditional_params[current_no_of_task]),
+        id(hypernetworks[0].perturbated_eps_T[current_no_of_task])
+    }
+    frozen_params = set(
+        [id(p) for p in hypernetworks[0].conditional_params] +
+        [id(p) for p in hypernetworks[0].perturbated_eps_T]
+    ) - current_task_params
+    trainable_names = []
+    for name, param in hypernetworks[0].named_parameters():
+        is_trainable = id(param) not in frozen_params
+        stacked_params[name].requires_grad_(is_trainable)
+        if is_trainable:
+            trainable_names.append(name)
+    trainable_params = [stacked_params[name] for name in trainable_names]
+
+    # Adam and RMSprop are element-wise, so a single optimizer over stacked
+    # parameters is equivalent to separate optimizers of all seeds
+    if parameters["optimizer"] == "adam":
+        optimizer = torch.optim.Adam(
+            trainable_params,
+            lr=parameters["learning_rate"]
+        )
+    elif parameters["optimizer"] == "rmsprop":
+        optimizer = torch.optim.RMSprop(
+            trainable_params,
+            lr=parameters["learning_rate"]
+        )
+    else:
+        raise ValueError("Wrong type of the selected optimizer!")
+
+    if parameters["best_model_selection_method"] == "val_loss":
+        best_params = [
+            {name: stacked_params[name][s].detach().clone() for name in trainable_names}
+            for s in range(number_of_seeds)
+        ]
+        best_val_accuracies = [0.0] * number_of_seeds
+    elif parameters["best_model_selection_method"] != "last_model":
+        raise ValueError("Wrong value of best_model_selection_method parameter!")
+
+    print(f"task: {current_no_of_task}")
+    # Compute targets for the regularization part of loss before starting
+    # the training of a current task
+    middle_reg_targets = []
+    if current_no_of_task > 0:
+        targets_of_seeds = []
+        for s in range(number_of_seeds):
+            load_seed_parameters(hypernetworks[s], stacked_params, s)
+            targets_of_seeds.append(hreg.get_current_targets(
+                task_id=current_no_of_task,
+                hnet=hypernetworks[s],
+                eps=parameters["perturbated_epsilon"],
+            ))
+        # Stack targets of consecutive seeds for each task and layer
+        middle_reg_targets = [
+            [torch.stack([targets_of_seeds[s][t][k] for s in range(number_of_seeds)])
+             for k in range(len(targets_of_seeds[0][t]))]
+            for t in range(current_no_of_task)
+        ]
+
+    def calculate_loss(params, buffers, tensor_input, gt_output,
+                       middle_targets, eps, kappa):
+        # Loss of a single seed, vectorized over seeds by vmap
+        lower_weights, target_weights, upper_weights, _ = functional_call(
+            base_hypernetwork, (params, buffers), args=(),
+            kwargs={"cond_id": current_no_of_task,
+                    "return_extended_output": True,
+                    "perturbated_eps": eps}
+        )
+        lower_pred, middle_pred, upper_pred = reverse_predictions(target_network,
+                                                                  tensor_input,
+                                                                  lower_weights,
+                                                                  target_weights,
+                                                                  upper_weights)
+        loss_current_task, worst_case_logits = calculate_ibp_loss(
+            y_pred=middle_pred,
+            y=gt_output,
+            z_l=lower_pred,
+            z_u=upper_pred,
+            kappa=kappa
+        )
+        worst_case_error = (worst_case_logits.argmax(dim=1) != gt_output).float().sum()
+
+        loss_regularization = torch.zeros_like(loss_current_task)
+        if current_no_of_task > 0:
+            # Outputs for all previous tasks are calculated at once
+            middle_weights_predicted = functional_call(
+                base_hypernetwork, (params, buffers), args=(),
+                kwargs={"cond_id": list(range(current_no_of_task)),
+                        "ret_format": "sequential",
+                        "perturbated_eps": parameters["perturbated_epsilon"],
+                        "return_extended_output": False}
+            )
+            for middle_target, middle_predicted in zip(middle_targets,
+                                                       middle_weights_predicted):
+                middle_W_target = torch.cat([w.view(-1) for w in middle_target])
+                middle_W_predicted = torch.cat([w.view(-1) for w in middle_predicted])
+                loss_regularization = loss_regularization + \
+                    (middle_W_target - middle_W_predicted).pow(2).sum()
+            loss_regularization = loss_regularization / current_no_of_task
+
+        loss = loss_current_task + \
+            parameters["beta"] * loss_regularization / max(1, current_no_of_task)
+        return loss, loss_current_task, worst_case_error, loss_regularization
+
+    vectorized_loss = vmap(calculate_loss,
+                           in_dims=(0, 0, 0, 0, 0, None, None),
+                           randomness="different")
+
+    iterations_to_adjust = (parameters["number_of_iterations"] // 2)
+    iterations_to_adjust = int(iterations_to_adjust)
+
+    for iteration in range(parameters["number_of_iterations"]):
+        tensor_inputs, gt_outputs = [], []
+        for s in range(number_of_seeds):
+            current_dataset_instance = list_of_seeds_tasks[s][current_no_of_task]
+            current_batch = current_dataset_instance.next_train_batch(
+                parameters["batch_size"]
+            )
+            tensor_input = current_dataset_instance.input_to_torch_tensor(
+                current_batch[0], parameters["device"], mode="train"
+            )
+            tensor_output = current_dataset_instance.output_to_torch_tensor(
+                current_batch[1], parameters["device"], mode="train"
+            )
+            tensor_inputs.append(tensor_input)
+            gt_outputs.append(tensor_output.max(dim=1)[1])
+        tensor_inputs = torch.stack(tensor_inputs)
+        gt_outputs = torch.stack(gt_outputs)
+        optimizer.zero_grad()
+
+        # Adjust kappa and epsilon
+        if iteration < iterations_to_adjust:
+            kappa = max(1 - 0.00005*iteration, parameters["kappa"])
+            eps   = (iteration / (iterations_to_adjust-1)) * parameters["perturbated_epsilon"]
+        else:
+            kappa = parameters["kappa"]
+            eps   = parameters["perturbated_epsilon"]
+
+        losses, losses_current_task, worst_case_errors, losses_regularization = \
+            vectorized_loss(stacked_params, stacked_buffers, tensor_inputs,
+                            gt_outputs, middle_reg_targets, eps, kappa)
+
+        # Seeds are independent, so the gradient of the sum
+        # is the gradient of the loss of each seed
+        losses.sum().backward()
+        optimizer.step()
+
+        # Save total loss to files of consecutive seeds
+        rows = torch.stack([losses, losses_current_task,
+                            worst_case_errors, losses_regularization], dim=1).tolist()
+        for s in range(number_of_seeds):
+            if iteration > 0 or current_no_of_task > 0:
+                header = ""
+            else:
+                header = "current_no_of_task;iteration;total_loss;cross_entropy_loss;" + \
+                         "worst_case_error;loss_regularization"
+            append_row_to_file(
+                filename=f'{parameters["saving_folders"][s]}total_loss',
+                elements=f"{current_no_of_task};{iteration};" + ";".join(map(str, rows[s])),
+                header=header
+            )
+
+        if (iteration % 10 == 0) or \
+           (iteration == (parameters["number_of_iterations"] - 1)):
+            for s in range(number_of_seeds):
+                load_seed_parameters(hypernetworks[s], stacked_params, s)
+                with torch.no_grad():
+                    lower_weights, target_weights, upper_weights, _ = hypernetworks[s].forward(
+                        cond_id=current_no_of_task,
+                        return_extended_output=True,
+                        perturbated_eps=eps)
+                accuracy = calculate_accuracy(
+                    list_of_seeds_tasks[s][current_no_of_task],
+                    target_network,
+                    lower_weights,
+                    target_weights,
+                    upper_weights,
+                    parameters={
+                        "device": parameters["device"],
+                        "use_batch_norm_memory": False,
+                        "number_of_task": current_no_of_task,
+                        "full_interval": False
+                    },
+                    evaluation_dataset="validation")
+                target_network.train()
+
+                print(f"Seed {parameters['seeds'][s]}, task {current_no_of_task}, "
+                      f"iteration: {iteration + 1}, loss: {rows[s][0]}, "
+                      f"validation accuracy: {accuracy}, "
+                      f"worst case error: {rows[s][2]}, perturbated_epsilon: {eps}")
+                if parameters["best_model_selection_method"] == "val_loss" and \
+                   accuracy > best_val_accuracies[s]:
+                    best_val_accuracies[s] = accuracy
+                    best_params[s] = {
+                        name: stacked_params[name][s].detach().clone()
+                        for name in trainable_names
+                    }
+
+    if parameters["best_model_selection_method"] == "val_loss":
+        with torch.no_grad():
+            for s in range(number_of_seeds):
+                for name in trainable_names:
+                    stacked_params[name][s].copy_(best_params[s][name])
+
+
+def build_multiple_task_experiment(list_of_seeds_tasks, parameters):
+    """
+    Train hypernetworks of all seeds on consecutive tasks and evaluate them
+    after each task. Results of each seed are stored in its own folder.
+
+    Parameters:
+    -----------
+    list_of_seeds_tasks: List
+        Lists of tasks for the CL scenario for consecutive seeds.
+    parameters: dict
+        Contains multiple experiment hyperparameters.
+
+    Returns:
+    --------
+    List[pd.DataFrame]
+        Dataframes with results from consecutive evaluations of each seed.
+    """
+    output_shape = list(
+        list_of_seeds_tasks[0][0].get_train_outputs())[0].shape[0]
+
+    hypernetworks = []
+    for s, seed in enumerate(parameters["seeds"]):
+        hypernetwork, target_network = prepare_networks(parameters, output_shape, seed)
+        hypernetwork.train()
+        hypernetworks.append(hypernetwork)
+    target_network.train()
+
+    stacked_params, stacked_buffers = stack_module_state(hypernetworks)
+    base_hypernetwork = deepcopy(hypernetworks[0])
+
+    dataframes = [
+        pd.DataFrame(columns=["after_learning_of_task", "tested_task", "accuracy"])
+        for _ in parameters["seeds"]
+    ]
+
+    for no_of_task in range(parameters["number_of_tasks"]):
+        train_single_task(
+            hypernetworks,
+            base_hypernetwork,
+            target_network,
+            stacked_params,
+            stacked_buffers,
+            parameters,
+            list_of_seeds_tasks,
+            no_of_task
+        )
+
+        for s in range(len(hypernetworks)):
+            saving_folder = parameters["saving_folders"][s]
+            load_seed_parameters(hypernetworks[s], stacked_params, s)
+
+            # Save current state of networks
+            write_pickle_file(
+                f'{saving_folder}/hypernetwork_after_{no_of_task}_task',
+                hypernetworks[s].weights
+            )
+            write_pickle_file(
+                f'{saving_folder}/perturbation_vectors_after_{no_of_task}_task',
+                hypernetworks[s]._perturbated_eps_T
+            )
+            if no_of_task > 0:
+                for name in ["hypernetwork", "perturbation_vectors"]:
+                    path = f'{saving_folder}/{name}_after_{no_of_task-1}_task.pt'
+                    if os.path.exists(path):
+                        os.remove(path)
+
+            # Freeze the already learned embeddings and radii
+            hypernetworks[s].detach_tensor(idx=no_of_task)
+
+            # Evaluate previous tasks
+            dataframes[s] = evaluate_previous_classification_tasks(
+                hypernetworks[s],
+                target_network,
+                dataframes[s],
+                list_of_seeds_tasks[s],
+                parameters={
+                    "device": parameters["device"],
+                    "use_batch_norm_memory": False,
+                    "number_of_task": no_of_task,
+                    "perturbated_epsilon": parameters["perturbated_epsilon"],
+                    "full_interval": False
+                }
+            )
+            dataframes[s] = dataframes[s].astype({
+                "after_learning_of_task": "int",
+                "tested_task": "int"
+            })
+            dataframes[s].to_csv(f"{saving_folder}/results.csv", sep=";")
+            hypernetworks[s].train()
+        target_network.train()
+
+    return dataframes
+
+
+def main_running_experiments(path_to_datasets, parameters):
+    """
+    Perform experiments for all seeds at once.
+
+    Parameters:
+    -----------
+    path_to_datasets: str
+        Path to files with datasets.
+    parameters: dict
+        Contains multiple experiment hyperparameters, including
+        "seeds" and corresponding "saving_folders".
+
+    Returns:
+    --------
+    List[pd.DataFrame]
+        Dataframes with results from consecutive evaluations of each seed.
+    """
+    list_of_seeds_tasks = [
+        prepare_tasks(path_to_datasets, parameters, seed)
+        for seed in parameters["seeds"]
+    ]
+
+    start_time = time.time()
+    dataframes = build_multiple_task_experiment(list_of_seeds_tasks, parameters)
+    elapsed_time = time.time() - start_time
+
+    no_of_last_task = parameters["number_of_tasks"] - 1
+    for s, seed in enumerate(parameters["seeds"]):
+        accuracies = dataframes[s].loc[
+            dataframes[s]["after_learning_of_task"] == no_of_last_task
+        ]["accuracy"].values
+        # Time of all seeds is shared
+        row_with_results = (
+            f"{list_of_seeds_tasks[s][0].get_identifier()};"
+            f'{parameters["augmentation"]};'
+            f'{parameters["embedding_size"]};'
+            f"{seed};"
+            f'{str(parameters["hypernetwork_hidden_layers"]).replace(" ", "")};'
+            f'{parameters["target_network"]};'
+            f'{str(parameters["target_hidden_layers"]).replace(" ", "")};'
+            f'{parameters["best_model_selection_method"]};'
+            f'{parameters["optimizer"]};'
+            f'{parameters["activation_function"]};'
+            f'{parameters["learning_rate"]};{parameters["batch_size"]};'
+            f'{parameters["beta"]};'
+            f'{parameters["perturbated_epsilon"]};'
+            f'{parameters["kappa"]};'
+            f"{np.mean(accuracies)};{np.std(accuracies)};"
+            f"{elapsed_time}"
+        )
+        append_row_to_file(
+            f'{parameters["grid_search_folder"]}'
+            f'{parameters["summary_results_filename"]}.csv',
+            row_with_results
+        )
+        plot_heatmap(f'{parameters["saving_folders"][s]}/results.csv')
+
+    return dataframes
+
+
+if __name__ == "__main__":
+    path_to_datasets = "./Data"
+    dataset = "PermutedMNIST"  # "PermutedMNIST", "SplitMNIST"
+    TIMESTAMP = datetime.now().strftime("%Y-%m-%d_%H-%M-%S") # Generate timestamp
+    create_grid_search = True
+
+    if create_grid_search:
+        summary_results_filename = "grid_search_results"
+    else:
+        summary_results_filename = "summary_results"
+    hyperparameters = set_hyperparameters(
+        dataset,
+        grid_search=create_grid_search,
+    )
+    # Interval target networks check their bounds with data-dependent
+    # assertions, which cannot be vectorized over seeds
+    assert not hyperparameters["full_interval"], \
+        "Multi-seed training supports only full_interval=False!"
+
+    header = (
+        "dataset_name;augmentation;embedding_size;seed;hypernetwork_hidden_layers;"
+        "target_network;target_hidden_layers;final_model;optimizer;"
+        "hypernet_activation_function;learning_rate;batch_size;beta;"
+        "perturbated_epsilon;kappa;mean_accuracy;std_accuracy;elapsed_time"
+    )
+    os.makedirs(hyperparameters["saving_folder"], exist_ok=True)
+    append_row_to_file(
+        f'{hyperparameters["saving_folder"]}/{summary_results_filename}.csv',
+        header
+    )
+
+    # All seeds of a given configuration are trained at once
+    seeds = hyperparameters["seed"]
+    for no, elements in enumerate(
+        product(hyperparameters["embedding_sizes"],
+                hyperparameters["learning_rates"],
+                hyperparameters["betas"],
+                hyperparameters["hypernetworks_hidden_layers"],
+                hyperparameters["batch_sizes"],
+                hyperparameters["perturbated_epsilon"],
+                hyperparameters["dropout_rate"])
+    ):
+        embedding_size = elements[0]
+        learning_rate = elements[1]
+        beta = elements[2]
+        hypernetwork_hidden_layers = elements[3]
+        batch_size = elements[4]
+        perturbated_eps = elements[5]
+        dropout_rate = elements[6]
+
+        parameters = {
+            "input_shape": hyperparameters["shape"],
+            "augmentation": hyperparameters["augmentation"],
+            "number_of_tasks": hyperparameters["number_of_tasks"],
+            "seeds": seeds,
+            "dataset": dataset,
+            "hypernetwork_hidden_layers": hypernetwork_hidden_layers,
+            "activation_function": hyperparameters["activation_function"],
+            "target_network": hyperparameters["target_network"],
+            "target_hidden_layers": hyperparameters["target_hidden_layers"],
+            "learning_rate": learning_rate,
+            "best_model_selection_method": hyperparameters["best_model_selection_method"],
+            "batch_size": batch_size,
+            "no_of_validation_samples": hyperparameters[
+                "no_of_validation_samples"
+            ],
+            "number_of_iterations": hyperparameters["number_of_iterations"],
+            "embedding_size": embedding_size,
+            "optimizer": hyperparameters["optimizer"],
+            "beta": beta,
+            "padding": hyperparameters["padding"],
+            "use_bias": hyperparameters["use_bias"],
+            "device": hyperparameters["device"],
+            "saving_folders": [
+                f'{hyperparameters["saving_folder"]}/{TIMESTAMP}/{no}/seed_{seed}/'
+                for seed in seeds
+            ],
+            "grid_search_folder": hyperparameters["saving_folder"],
+            "summary_results_filename": summary_results_filename,
+            "perturbated_epsilon": perturbated_eps,
+            "kappa": hyperparameters["kappa"],
+            "dropout_rate": dropout_rate,
+            "full_interval": hyperparameters["full_interval"]
+        }
+        assert hyperparameters["number_of_epochs"] is None, \
+            "Multi-seed training supports only a fixed number of iterations!"
+
+        for seed, saving_folder in zip(seeds, parameters["saving_folders"]):
+            os.makedirs(saving_folder, exist_ok=True)
+            save_parameters(saving_folder,
+                            {**parameters, "seed": seed},
+                            name=f"parameters.csv")
+
+        main_running_experiments(path_to_datasets, parameters)
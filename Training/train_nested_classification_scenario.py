@@ -2,6 +2,7 @@ import os
 import sys
 import time
 from datetime import datetime
+from functools import partial
 from itertools import product
 import numpy as np
 import pandas as pd
@@ -30,6 +31,10 @@ import Utils.hnet_interval_regularizer as hreg
 from Utils.prepare_nested_scenario_params import set_hyperparameters
 from Utils.handy_functions import *
 from Utils.dataset_utils import *
+from Utils.grid_search_scheduler import run_grid_search, prepare_summary_file
+from DatasetHandlers.lazy_task_list import LazyTaskList
+from Utils.results_store import store_experiment_results
+from Utils.training_checkpoints import *
 
 
 def train_single_task(hypernetwork,
@@ -37,7 +42,8 @@ def train_single_task(hypernetwork,
                       criterion,
                       parameters,
                       dataset_list_of_tasks,
-                      current_no_of_task):
+                      current_no_of_task,
+                      checkpoint=None):
     """
     Train a hypernetwork that generates the weights of the target neural network.
     This module operates on a single training task with a specific number.
@@ -56,6 +62,9 @@ def train_single_task(hypernetwork,
         Contains a list of tasks for the CL scenario (e.g., permuted_mnist.PermutedMNISTList).
     current_no_of_task: int
         Specifies the number of the currently solving task.
+    checkpoint: dict, optional
+        The state of the training saved in the middle of the current task.
+        If given, the training is resumed from the saved iteration.
 
     Returns:
     --------
@@ -97,10 +106,18 @@ def train_single_task(hypernetwork,
         # Save previous hnet weights
         hypernetwork._prev_hnet_weights = deepcopy(hypernetwork.unconditional_params)
 
-        lower_reg_targets, middle_reg_targets, upper_reg_targets = hreg.get_current_targets(
-                                                                                task_id=current_no_of_task,
-                                                                                hnet=hypernetwork,
-                                                                                eps=parameters["perturbated_epsilon"])
+        if checkpoint is None:
+            lower_reg_targets, middle_reg_targets, upper_reg_targets = hreg.get_current_targets(
+                                                                                    task_id=current_no_of_task,
+                                                                                    hnet=hypernetwork,
+                                                                                    eps=parameters["perturbated_epsilon"])
+        else:
+            # The hypernetwork has already changed during the current task,
+            # so targets have to be taken from the checkpoint
+            lower_reg_targets, middle_reg_targets, upper_reg_targets = [
+                [[p.to(parameters["device"]) for p in W_tid] for W_tid in targets]
+                for targets in checkpoint["reg_targets"]
+            ]
 
     if (parameters["target_network"] == "ResNet") and \
        parameters["use_batch_norm"]:
@@ -142,7 +159,23 @@ def train_single_task(hypernetwork,
     iterations_to_adjust = (parameters["number_of_iterations"] // 2)
     iterations_to_adjust = int(iterations_to_adjust)
 
-    for iteration in range(parameters["number_of_iterations"]):
+    start_iteration = 0
+    if checkpoint is not None:
+        # Kappa and epsilon depend only on the number of iteration,
+        # so restoring it restores the position in their schedule
+        start_iteration = checkpoint["iteration"]
+        optimizer.load_state_dict(checkpoint["optimizer"])
+        if checkpoint["plateau_scheduler"] is not None:
+            plateau_scheduler.load_state_dict(checkpoint["plateau_scheduler"])
+        if parameters["best_model_selection_method"] == "val_loss":
+            best_val_loss = checkpoint["best_val_loss"]
+            best_hypernetwork.load_state_dict(checkpoint["best_hypernetwork"])
+            best_target_network.load_state_dict(checkpoint["best_target_network"])
+        set_rng_state(checkpoint["rng_state"])
+        print(f"Resuming task {current_no_of_task} from iteration {start_iteration}")
+    checkpoint_interval = parameters.get("checkpoint_interval", None)
+
+    for iteration in range(start_iteration, parameters["number_of_iterations"]):
         
         current_batch = current_dataset_instance.next_train_batch(
             parameters["batch_size"]
@@ -160,7 +193,7 @@ def train_single_task(hypernetwork,
 
         # Adjust kappa and epsilon
         if iteration < iterations_to_adjust:
-            kappa = max(1 - 0.00005*iteration, hyperparameters["kappa"])
+            kappa = max(1 - 0.00005*iteration, parameters["kappa"])
             eps   = (iteration / (iterations_to_adjust-1)) * parameters["perturbated_epsilon"]
         else:
             kappa = parameters["kappa"]
@@ -309,6 +342,31 @@ def train_single_task(hypernetwork,
                 # scheduler.step()
                 plateau_scheduler.step(accuracy)
 
+        if checkpoint_interval is not None and \
+           ((iteration + 1) % checkpoint_interval == 0) and \
+           (iteration + 1) < parameters["number_of_iterations"]:
+            state = {
+                "task": current_no_of_task,
+                "iteration": iteration + 1,
+                "hypernetwork": hypernetwork.state_dict(),
+                "target_network": target_network.state_dict(),
+                "optimizer": optimizer.state_dict(),
+                "plateau_scheduler": None,
+                "reg_targets": None
+            }
+            if parameters["number_of_epochs"] is not None and \
+               parameters["lr_scheduler"]:
+                state["plateau_scheduler"] = plateau_scheduler.state_dict()
+            if current_no_of_task > 0:
+                state["reg_targets"] = (lower_reg_targets,
+                                        middle_reg_targets,
+                                        upper_reg_targets)
+            if parameters["best_model_selection_method"] == "val_loss":
+                state["best_val_loss"] = best_val_loss
+                state["best_hypernetwork"] = best_hypernetwork.state_dict()
+                state["best_target_network"] = best_target_network.state_dict()
+            save_training_checkpoint(parameters["saving_folder"], state)
+
     if parameters["best_model_selection_method"] == "val_loss":
         return best_hypernetwork, best_target_network
     else:
@@ -453,9 +511,32 @@ def build_multiple_task_experiment(dataset_list_of_tasks,
     # Declare total number of tasks
     no_tasks = parameters["number_of_tasks"]
 
-    for no_of_task in range(no_tasks):
-
-        if parameters["custom_init"] and no_of_task > 0:
+    # Resume an interrupted experiment from the last checkpoint
+    first_task = 0
+    checkpoint = load_training_checkpoint(parameters["saving_folder"])
+    if checkpoint is not None:
+        first_task = checkpoint["task"]
+        hypernetwork.load_state_dict(checkpoint["hypernetwork"])
+        target_network.load_state_dict(checkpoint["target_network"])
+        for no_of_task in range(first_task):
+            hypernetwork.detach_tensor(idx=no_of_task)
+        results_path = f'{parameters["saving_folder"]}/results.csv'
+        if os.path.exists(results_path):
+            dataframe = pd.read_csv(results_path, sep=";", index_col=0)
+        results_path = f'{parameters["saving_folder"]}/results_intersection.csv'
+        if os.path.exists(results_path):
+            results_from_interval_intersection = pd.read_csv(
+                results_path, sep=";", index_col=0)
+        # A checkpoint saved between tasks does not contain
+        # the state of the training in the middle of a task
+        if checkpoint["iteration"] == 0:
+            set_rng_state(checkpoint["rng_state"])
+            checkpoint = None
+
+    for no_of_task in range(first_task, no_tasks):
+
+        # The embedding of a task resumed in the middle is already trained
+        if parameters["custom_init"] and no_of_task > 0 and checkpoint is None:
             
            prev_emb = hypernetwork.conditional_params[no_of_task-1].detach().clone()
            prev_emb.requires_grad = False
@@ -471,8 +552,10 @@ def build_multiple_task_experiment(dataset_list_of_tasks,
             criterion,
             parameters,
             dataset_list_of_tasks,
-            no_of_task
+            no_of_task,
+            checkpoint=checkpoint
         )
+        checkpoint = None
 
         if no_of_task == (parameters["number_of_tasks"] - 1):
         # Save current state of networks
@@ -490,6 +573,10 @@ def build_multiple_task_experiment(dataset_list_of_tasks,
         # Freeze the already learned embeddings and radii
         hypernetwork.detach_tensor(idx = no_of_task)
 
+        # Only test data of the finished task is necessary for evaluation
+        if isinstance(dataset_list_of_tasks, LazyTaskList):
+            dataset_list_of_tasks.release_training_data(no_of_task)
+
         # Evaluate previous tasks
         dataframe = evaluate_previous_classification_tasks(
             hypernetwork,
@@ -555,6 +642,19 @@ def build_multiple_task_experiment(dataset_list_of_tasks,
                                         current_task=no_of_task,
                                         plot_universal_embedding=True)
 
+        if parameters.get("checkpoint_interval", None) is not None:
+            save_training_checkpoint(
+                parameters["saving_folder"],
+                {
+                    "task": no_of_task + 1,
+                    "iteration": 0,
+                    "hypernetwork": hypernetwork.state_dict(),
+                    "target_network": target_network.state_dict()
+                }
+            )
+
+    remove_training_checkpoint(parameters["saving_folder"])
+
     return hypernetwork, target_network, dataframe
 
 
@@ -579,13 +679,26 @@ def main_running_experiments(path_to_datasets,
         - target_network: A learned target network that performs classification.
         - dataframe: A Pandas DataFrame with single results from consecutive evaluations for all previous tasks.
     """
-    if parameters["dataset"] == "PermutedMNIST":
+    if parameters.get("packed_dataset_path") is not None:
+        dataset_tasks_list = prepare_packed_experiment_tasks(
+            parameters["dataset"],
+            parameters["packed_dataset_path"],
+            number_of_tasks=parameters["number_of_tasks"],
+            no_of_validation_samples=parameters["no_of_validation_samples"],
+            no_of_validation_samples_per_class=parameters.get(
+                "no_of_validation_samples_per_class"
+            ),
+            use_augmentation=parameters["augmentation"],
+            seed=parameters["seed"]
+        )
+    elif parameters["dataset"] == "PermutedMNIST":
         dataset_tasks_list = prepare_permuted_mnist_tasks(
             path_to_datasets,
             parameters["input_shape"],
             parameters["number_of_tasks"],
             parameters["padding"],
             parameters["no_of_validation_samples"],
+            device=parameters["device"]
         )
     elif parameters["dataset"] == "CIFAR100":
         dataset_tasks_list = prepare_split_cifar100_tasks(
@@ -612,6 +725,7 @@ def main_running_experiments(path_to_datasets,
             seed=parameters["seed"],
             validation_size=parameters["no_of_validation_samples"],
             number_of_tasks=parameters["number_of_tasks"],
+            lazy=parameters.get("lazy_task_loading", False)
         )
     elif parameters["dataset"] == "CIFAR100_FeCAM_setup":
         dataset_tasks_list = prepare_split_cifar100_tasks_aka_FeCAM(
@@ -621,6 +735,9 @@ def main_running_experiments(path_to_datasets,
                 "no_of_validation_samples_per_class"
             ],
             use_augmentation=parameters["augmentation"],
+            use_batched_augmentation=parameters.get(
+                "batched_augmentation", False
+            ),
         )
     elif parameters["dataset"] == "SubsetImageNet":
         dataset_tasks_list = prepare_subset_imagenet_tasks(
@@ -630,7 +747,12 @@ def main_running_experiments(path_to_datasets,
                 "no_of_validation_samples_per_class"
             ],
             use_augmentation=parameters["augmentation"],
-            batch_size=parameters["batch_size"]
+            batch_size=parameters["batch_size"],
+            preresized_size=parameters.get("preresized_size"),
+            lazy=parameters.get("lazy_task_loading", False),
+            use_batched_augmentation=parameters.get(
+                "batched_augmentation", False
+            )
         )
     else:
         raise ValueError("Wrong name of the dataset!")
@@ -677,6 +799,19 @@ def main_running_experiments(path_to_datasets,
         row_with_results
     )
 
+    # Save results into the store indexed by hyperparameters and seeds
+    if parameters.get("results_store", None) is not None:
+        dataframes = {"standard": dataframe}
+        intersection_path = (f'{parameters["saving_folder"]}/'
+                             f"results_intersection.csv")
+        if os.path.exists(intersection_path):
+            dataframes["intersection"] = pd.read_csv(intersection_path, sep=";")
+        store_experiment_results(parameters["results_store"],
+                                 parameters,
+                                 dataframes,
+                                 scenario="nested",
+                                 elapsed_time=elapsed_time)
+
     # Plot heatmap for results
     load_path = (f'{parameters["saving_folder"]}/'
                  f"results.csv")
@@ -690,12 +825,63 @@ def main_running_experiments(path_to_datasets,
     return hypernetwork, target_network, dataframe
 
 
+def run_single_configuration(path_to_datasets, parameters):
+    """
+    Prepare the saving folder, set the seed and run a single experiment
+    of the grid search. It is a top-level function to be picklable
+    by worker processes.
+
+    Parameters:
+    -----------
+    path_to_datasets: str
+        Path to files with datasets.
+    parameters: dict
+        Contains multiple experiment hyperparameters.
+    """
+    os.makedirs(f'{parameters["saving_folder"]}', exist_ok=True)
+    save_parameters(parameters["saving_folder"],
+                    parameters,
+                    name=f"parameters.csv")
+
+    # Important! Seed is set before the preparation of the dataset!
+    if parameters["seed"] is not None:
+        set_seed(parameters["seed"])
+
+    main_running_experiments(path_to_datasets, parameters)
+
+
 if __name__ == "__main__":
     path_to_datasets = "./Data"
     dataset = "TinyImageNet"  # "PermutedMNIST", "CIFAR100", "SplitMNIST", "TinyImageNet", "CIFAR100_FeCAM_setup", "SubsetImageNet", "CIFAR10"
     part = 0
-    TIMESTAMP = datetime.now().strftime("%Y-%m-%d_%H-%M-%S") # Generate timestamp
+    # A fixed name of the grid search (e.g. shared by several machines)
+    # allows to resume it, finished configurations are skipped
+    TIMESTAMP = os.environ.get(
+        "GRID_SEARCH_NAME",
+        datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    )
     create_grid_search = True
+    number_of_workers = 1
+    threads_per_worker = None
+    # Results of all runs are also saved into an SQLite store
+    # (see Utils/results_store.py) in the main saving folder
+    use_results_store = True
+    # SubsetImageNet images may be pre-resized once to this resolution
+    # (e.g. 80) and transformed at it; None reads full-resolution files
+    preresized_size = None
+    # CIFAR-100 (FeCAM) and pre-resized SubsetImageNet images are augmented
+    # in whole batches on the device; the batched pipeline differs from
+    # the original per-image one
+    batched_augmentation = False
+    # Tasks are created on first access, the next task is prepared in
+    # the background and training data of finished tasks is released
+    # (TinyImageNet and SubsetImageNet)
+    lazy_task_loading = False
+    # Number of iterations between consecutive checkpoints of the training
+    # (None disables checkpoints in the middle of tasks)
+    checkpoint_interval = None
+    number_of_shards = int(os.environ.get("GRID_SEARCH_NUMBER_OF_SHARDS", 1))
+    shard_id = int(os.environ.get("GRID_SEARCH_SHARD_ID", 0))
 
     if create_grid_search:
         summary_results_filename = "grid_search_results"
@@ -714,11 +900,13 @@ if __name__ == "__main__":
         "elapsed_time"
     )
 
-    append_row_to_file(
+    os.makedirs(hyperparameters["saving_folder"], exist_ok=True)
+    prepare_summary_file(
         f'{hyperparameters["saving_folder"]}/{summary_results_filename}.csv',
         header
     )
 
+    configurations = []
     for no, elements in enumerate(
         product(hyperparameters["embedding_sizes"],
                 hyperparameters["learning_rates"],
@@ -779,7 +967,14 @@ if __name__ == "__main__":
             "kappa": hyperparameters["kappa"],
             "dropout_rate": dropout_rate,
             "custom_init": custom_init,
-            "full_interval": hyperparameters["full_interval"]
+            "full_interval": hyperparameters["full_interval"],
+            "results_store": (f'{hyperparameters["saving_folder"]}/results.sqlite'
+                              if use_results_store else None),
+            "preresized_size": preresized_size,
+            "batched_augmentation": batched_augmentation,
+            "lazy_task_loading": lazy_task_loading,
+            "packed_dataset_path": hyperparameters["packed_dataset_path"],
+            "checkpoint_interval": checkpoint_interval
         }
 
         if "no_of_validation_samples_per_class" in hyperparameters:
@@ -787,16 +982,13 @@ if __name__ == "__main__":
                 "no_of_validation_samples_per_class"
             ]
 
-        os.makedirs(f'{parameters["saving_folder"]}', exist_ok=True)
-        # start_time = datetime.now().strftime("%Y%m%d_%H%M%S")
-        save_parameters(parameters["saving_folder"],
-                        parameters,
-                        name=f"parameters.csv")
+        configurations.append(parameters)
 
-        # Important! Seed is set before the preparation of the dataset!
-        if seed is not None:
-            set_seed(seed)
-
-        hypernetwork, target_network, dataframe = \
-            main_running_experiments(path_to_datasets,
-                                     parameters)
\ No newline at end of file
+    run_grid_search(
+        configurations,
+        partial(run_single_configuration, path_to_datasets),
+        number_of_workers=number_of_workers,
+        threads_per_worker=threads_per_worker,
+        shard_id=shard_id,
+        number_of_shards=number_of_shards
+    )
@@ -8,6 +8,7 @@ import numpy as np
 import pandas as pd
 from copy import deepcopy
 from datetime import datetime
+from functools import partial
 from itertools import product
 
 # Get the parent directory path
@@ -30,13 +31,19 @@ from LossFunctions.classification_loss_function import IBP_Loss
 from Utils.prepare_non_forced_scenario_params import set_hyperparameters
 from Utils.dataset_utils import *
 from Utils.handy_functions import *
+from Utils.grid_search_scheduler import run_grid_search, prepare_summary_file
+from DatasetHandlers.lazy_task_list import LazyTaskList
+from Utils.results_store import store_experiment_results
+from Utils.training_checkpoints import *
+from Utils.step_profiler import StepProfiler
 
 def train_single_task(hypernetwork,
                       target_network,
                       criterion,
                       parameters,
                       dataset_list_of_tasks,
-                      current_no_of_task):
+                      current_no_of_task,
+                      checkpoint=None):
     """
     Train a hypernetwork that generates the weights of the target neural network.
     This module operates on a single training task with a specific number.
@@ -55,6 +62,9 @@ def train_single_task(hypernetwork,
         Contains a list of tasks for the CL scenario (e.g., permuted_mnist.PermutedMNISTList).
     current_no_of_task: int
         Specifies the number of the currently solving task.
+    checkpoint: dict, optional
+        The state of the training saved in the middle of the current task.
+        If given, the training is resumed from the saved iteration.
 
     Returns:
     --------
@@ -75,6 +85,27 @@ def train_single_task(hypernetwork,
         )
     else:
         raise ValueError("Wrong type of the selected optimizer!")
+
+    # In the mixed precision mode only the target network is run in a reduced
+    # precision, the hypernetwork (and thus the radii of weights) stays in float32
+    autocast_dtype = get_autocast_dtype(parameters.get("mixed_precision", None))
+    autocast_device = "cuda" if "cuda" in str(parameters["device"]) else "cpu"
+    if autocast_dtype == torch.float16 and autocast_device == "cpu":
+        raise ValueError("Float16 mixed precision is supported only on GPU!")
+    if autocast_dtype is not None and parameters["full_interval"]:
+        print("Interval target networks are always trained in float32!")
+    # Loss scaling is necessary only for float16 with its narrow range
+    # torch.amp.GradScaler is available since PyTorch 2.3
+    if hasattr(torch.amp, "GradScaler"):
+        grad_scaler = torch.amp.GradScaler(
+            "cuda",
+            enabled=(autocast_dtype == torch.float16)
+        )
+    else:
+        grad_scaler = torch.cuda.amp.GradScaler(
+            enabled=(autocast_dtype == torch.float16)
+        )
+
     if parameters["best_model_selection_method"] == "val_loss":
         # Store temporary best models to keep those with the highest
         # validation accuracy.
@@ -96,12 +127,19 @@ def train_single_task(hypernetwork,
         # Save previous hnet weights
         hypernetwork._prev_hnet_weights = deepcopy(hypernetwork.unconditional_params)
 
-
-        middle_reg_targets = hreg.get_current_targets(
-                                        task_id=current_no_of_task,
-                                        hnet=hypernetwork,
-                                        eps=parameters["perturbated_epsilon"],
-                                        )
+        if checkpoint is None:
+            middle_reg_targets = hreg.get_current_targets(
+                                            task_id=current_no_of_task,
+                                            hnet=hypernetwork,
+                                            eps=parameters["perturbated_epsilon"],
+                                            )
+        else:
+            # The hypernetwork has already changed during the current task,
+            # so targets have to be taken from the checkpoint
+            middle_reg_targets = [
+                [p.to(parameters["device"]) for p in W_tid]
+                for W_tid in checkpoint["middle_reg_targets"]
+            ]
 
     if (parameters["target_network"] == "ResNet") and \
        parameters["use_batch_norm"]:
@@ -142,23 +180,51 @@ def train_single_task(hypernetwork,
     iterations_to_adjust = (parameters["number_of_iterations"] // 2)
     iterations_to_adjust = int(iterations_to_adjust)
 
-    for iteration in range(parameters["number_of_iterations"]):
-        current_batch = current_dataset_instance.next_train_batch(
-            parameters["batch_size"]
-        )
-        tensor_input = current_dataset_instance.input_to_torch_tensor(
-            current_batch[0], parameters["device"], mode="train"
-        )
-        tensor_output = current_dataset_instance.output_to_torch_tensor(
-            current_batch[1], parameters["device"], mode="train"
-        )
-        tensor_output = torch.Tensor(tensor_output).to("cuda")
-        gt_output = tensor_output.max(dim=1)[1]
+    start_iteration = 0
+    if checkpoint is not None:
+        # Kappa and epsilon depend only on the number of iteration,
+        # so restoring it restores the position in their schedule
+        start_iteration = checkpoint["iteration"]
+        optimizer.load_state_dict(checkpoint["optimizer"])
+        if checkpoint.get("grad_scaler", None):
+            grad_scaler.load_state_dict(checkpoint["grad_scaler"])
+        if checkpoint["plateau_scheduler"] is not None:
+            plateau_scheduler.load_state_dict(checkpoint["plateau_scheduler"])
+        if parameters["best_model_selection_method"] == "val_loss":
+            best_val_accuracy = checkpoint["best_val_accuracy"]
+            best_hypernetwork.load_state_dict(checkpoint["best_hypernetwork"])
+            best_target_network.load_state_dict(checkpoint["best_target_network"])
+        set_rng_state(checkpoint["rng_state"])
+        print(f"Resuming task {current_no_of_task} from iteration {start_iteration}")
+    checkpoint_interval = parameters.get("checkpoint_interval", None)
+
+    profiler = StepProfiler(
+        enabled=parameters.get("profile_steps", False),
+        device=parameters["device"],
+        trace_window=parameters.get("profiler_trace_window", None),
+        trace_folder=f'{parameters["saving_folder"]}/profiler_traces/'
+    )
+
+    for iteration in range(start_iteration, parameters["number_of_iterations"]):
+        profiler.start_iteration(current_no_of_task, iteration)
+
+        with profiler.phase("data"):
+            current_batch = current_dataset_instance.next_train_batch(
+                parameters["batch_size"]
+            )
+            tensor_input = current_dataset_instance.input_to_torch_tensor(
+                current_batch[0], parameters["device"], mode="train"
+            )
+            tensor_output = current_dataset_instance.output_to_torch_tensor(
+                current_batch[1], parameters["device"], mode="train"
+            )
+            tensor_output = torch.Tensor(tensor_output).to(parameters["device"])
+            gt_output = tensor_output.max(dim=1)[1]
         optimizer.zero_grad()
 
         # Adjust kappa and epsilon
         if iteration < iterations_to_adjust:
-            kappa = max(1 - 0.00005*iteration, hyperparameters["kappa"])
+            kappa = max(1 - 0.00005*iteration, parameters["kappa"])
             eps   = (iteration / (iterations_to_adjust-1)) * parameters["perturbated_epsilon"]
         else:
             kappa = parameters["kappa"]
@@ -166,41 +232,54 @@ def train_single_task(hypernetwork,
 
         # Get weights, lower weights, upper weights and predicted radii
         # returned by the hypernetwork
-        lower_weights, target_weights, upper_weights, _ = hypernetwork.forward(cond_id=current_no_of_task, 
-                                                                                return_extended_output=True,
-                                                                                perturbated_eps=eps)
-
-        if parameters["full_interval"]:
-            predictions = target_network.forward(x=tensor_input,
-                                                upper_weights=upper_weights,
-                                                middle_weights=target_weights,
-                                                lower_weights=lower_weights)
-            
-            lower_pred, middle_pred, upper_pred = parse_logits(predictions)
-        else:
-            lower_pred, middle_pred, upper_pred = reverse_predictions(target_network,
-                                                                      tensor_input,
-                                                                      lower_weights,
-                                                                      target_weights,
-                                                                      upper_weights)
-        
+        with profiler.phase("hypernetwork_forward"):
+            lower_weights, target_weights, upper_weights, _ = hypernetwork.forward(cond_id=current_no_of_task, 
+                                                                                    return_extended_output=True,
+                                                                                    perturbated_eps=eps)
+
+        with profiler.phase("target_forward"):
+            if parameters["full_interval"]:
+                predictions = target_network.forward(x=tensor_input,
+                                                    upper_weights=upper_weights,
+                                                    middle_weights=target_weights,
+                                                    lower_weights=lower_weights)
+                
+                lower_pred, middle_pred, upper_pred = parse_logits(predictions)
+            else:
+                with torch.autocast(device_type=autocast_device,
+                                    dtype=autocast_dtype or torch.float32,
+                                    enabled=autocast_dtype is not None):
+                    lower_pred, middle_pred, upper_pred = reverse_predictions(target_network,
+                                                                              tensor_input,
+                                                                              lower_weights,
+                                                                              target_weights,
+                                                                              upper_weights)
+                if autocast_dtype is not None:
+                    lower_pred, middle_pred, upper_pred = widen_bounds_for_rounding(
+                        lower_pred,
+                        middle_pred,
+                        upper_pred,
+                        dtype=autocast_dtype,
+                        rounding_margin=parameters.get("rounding_margin", 4.0)
+                    )
         
-        # We need to check wheter the distance between the lower weights
-        # and the upper weights isn"t collapsed into "one point" (short interval)
-        loss_weights = 0.0
-        for W_u, W_l in zip(upper_weights, lower_weights):
-            loss_weights += (W_u - W_l).abs().mean()
-
-        loss_current_task = criterion(
-            y_pred=middle_pred,
-            y=gt_output,
-            z_l=lower_pred,
-            z_u=upper_pred,
-            kappa=kappa
-        )
+        with profiler.phase("loss"):
+            # We need to check wheter the distance between the lower weights
+            # and the upper weights isn"t collapsed into "one point" (short interval)
+            loss_weights = 0.0
+            for W_u, W_l in zip(upper_weights, lower_weights):
+                loss_weights += (W_u - W_l).abs().mean()
+
+            loss_current_task = criterion(
+                y_pred=middle_pred,
+                y=gt_output,
+                z_l=lower_pred,
+                z_u=upper_pred,
+                kappa=kappa
+            )
 
-        # Get the worst case error
-        worst_case_error = criterion.worst_case_error
+            # Get the worst case error
+            worst_case_error = criterion.worst_case_error
             
         loss_regularization = 0.
 
@@ -208,13 +287,14 @@ def train_single_task(hypernetwork,
             
             # If number of tasks is greater than 100, we sample 32 task ids
             # and regularize corresponding embeddings
-            loss_regularization = hreg.calc_fix_target_reg(
-                hypernetwork, current_no_of_task,
-                middle_targets=middle_reg_targets,
-                mnet=target_network, prev_theta=previous_hnet_theta,
-                prev_task_embs=previous_hnet_embeddings,
-                eps=parameters["perturbated_epsilon"],
-            )
+            with profiler.phase("regularizer"):
+                loss_regularization = hreg.calc_fix_target_reg(
+                    hypernetwork, current_no_of_task,
+                    middle_targets=middle_reg_targets,
+                    mnet=target_network, prev_theta=previous_hnet_theta,
+                    prev_task_embs=previous_hnet_embeddings,
+                    eps=parameters["perturbated_epsilon"],
+                )
         
         # Calculate total loss
         loss = loss_current_task + \
@@ -227,15 +307,19 @@ def train_single_task(hypernetwork,
             header = "current_no_of_task;iteration;total_loss;cross_entropy_loss;" + \
                      "worst_case_error;loss_regularization;loss_weights"
             
-        append_row_to_file(
-        filename=f'{parameters["saving_folder"]}total_loss',
-        elements=f"{current_no_of_task};{iteration};{loss};{loss_current_task};"
-                 f"{worst_case_error};{loss_regularization};{loss_weights}",
-        header=header
-        )  
-
-        loss.backward()
-        optimizer.step()
+        with profiler.phase("logging"):
+            append_row_to_file(
+            filename=f'{parameters["saving_folder"]}total_loss',
+            elements=f"{current_no_of_task};{iteration};{loss};{loss_current_task};"
+                     f"{worst_case_error};{loss_regularization};{loss_weights}",
+            header=header
+            )  
+
+        with profiler.phase("backward"):
+            grad_scaler.scale(loss).backward()
+        with profiler.phase("optimizer_step"):
+            grad_scaler.step(optimizer)
+            grad_scaler.update()
 
         if iteration % 500 == 499:
         # if iteration % 10 == 9:
@@ -243,12 +327,13 @@ def train_single_task(hypernetwork,
             interval_plot_save_path = f'{parameters["saving_folder"]}/plots/'
             plot_universal_embedding = iteration >= iterations_to_adjust
 
-            plot_intervals_around_embeddings(hypernetwork=hypernetwork,
-                                            parameters=parameters,
-                                            save_folder=interval_plot_save_path,
-                                            iteration=iteration,
-                                            current_task=current_no_of_task,
-                                            plot_universal_embedding=plot_universal_embedding)
+            with profiler.phase("plotting"):
+                plot_intervals_around_embeddings(hypernetwork=hypernetwork,
+                                                parameters=parameters,
+                                                save_folder=interval_plot_save_path,
+                                                iteration=iteration,
+                                                current_task=current_no_of_task,
+                                                plot_universal_embedding=plot_universal_embedding)
 
         if parameters["number_of_epochs"] is None:
             condition = (iteration % 10 == 0) or \
@@ -265,25 +350,27 @@ def train_single_task(hypernetwork,
 
 
             # Save distance between the upper and lower weights to file
-            append_row_to_file(
-            filename=f'{parameters["saving_folder"]}upper_lower_weights_distance',
-            elements=f'{current_no_of_task};{iteration};{loss_weights}'
-            )
+            with profiler.phase("logging"):
+                append_row_to_file(
+                filename=f'{parameters["saving_folder"]}upper_lower_weights_distance',
+                elements=f'{current_no_of_task};{iteration};{loss_weights}'
+                )
 
-            accuracy = 0.0
-            accuracy = calculate_accuracy(
-                current_dataset_instance,
-                target_network,
-                lower_weights,
-                target_weights,
-                upper_weights,
-                parameters={
-                    "device": parameters["device"],
-                    "use_batch_norm_memory": use_batch_norm_memory,
-                    "number_of_task": current_no_of_task,
-                    "full_interval": parameters["full_interval"]
-                },
-                evaluation_dataset="validation")
+            with profiler.phase("validation"):
+                accuracy = 0.0
+                accuracy = calculate_accuracy(
+                    current_dataset_instance,
+                    target_network,
+                    lower_weights,
+                    target_weights,
+                    upper_weights,
+                    parameters={
+                        "device": parameters["device"],
+                        "use_batch_norm_memory": use_batch_norm_memory,
+                        "number_of_task": current_no_of_task,
+                        "full_interval": parameters["full_interval"]
+                    },
+                    evaluation_dataset="validation")
             
             print(f"Task {current_no_of_task}, iteration: {iteration + 1}, "
                   f" loss: {loss.item()}, validation accuracy: {accuracy}, "
@@ -304,6 +391,36 @@ def train_single_task(hypernetwork,
                 # scheduler.step()
                 plateau_scheduler.step(accuracy)
 
+        profiler.end_iteration(current_no_of_task, iteration)
+
+        if checkpoint_interval is not None and \
+           ((iteration + 1) % checkpoint_interval == 0) and \
+           (iteration + 1) < parameters["number_of_iterations"]:
+            state = {
+                "task": current_no_of_task,
+                "iteration": iteration + 1,
+                "hypernetwork": hypernetwork.state_dict(),
+                "target_network": target_network.state_dict(),
+                "optimizer": optimizer.state_dict(),
+                "grad_scaler": grad_scaler.state_dict(),
+                "plateau_scheduler": None,
+                "middle_reg_targets": None
+            }
+            if parameters["number_of_epochs"] is not None and \
+               parameters["lr_scheduler"]:
+                state["plateau_scheduler"] = plateau_scheduler.state_dict()
+            if current_no_of_task > 0:
+                state["middle_reg_targets"] = middle_reg_targets
+            if parameters["best_model_selection_method"] == "val_loss":
+                state["best_val_accuracy"] = best_val_accuracy
+                state["best_hypernetwork"] = best_hypernetwork.state_dict()
+                state["best_target_network"] = best_target_network.state_dict()
+            save_training_checkpoint(parameters["saving_folder"], state)
+
+    profiler.save_task_summary(
+        f'{parameters["saving_folder"]}/profiling.csv', current_no_of_task
+    )
+
     if parameters["best_model_selection_method"] == "val_loss":
         return best_hypernetwork, best_target_network
     else:
@@ -438,7 +555,25 @@ def build_multiple_task_experiment(dataset_list_of_tasks,
     # Declare total number of tasks
     no_tasks = parameters["number_of_tasks"]
 
-    for no_of_task in range(no_tasks):
+    # Resume an interrupted experiment from the last checkpoint
+    first_task = 0
+    checkpoint = load_training_checkpoint(parameters["saving_folder"])
+    if checkpoint is not None:
+        first_task = checkpoint["task"]
+        hypernetwork.load_state_dict(checkpoint["hypernetwork"])
+        target_network.load_state_dict(checkpoint["target_network"])
+        for no_of_task in range(first_task):
+            hypernetwork.detach_tensor(idx=no_of_task)
+        results_path = f'{parameters["saving_folder"]}/results.csv'
+        if os.path.exists(results_path):
+            dataframe = pd.read_csv(results_path, sep=";", index_col=0)
+        # A checkpoint saved between tasks does not contain
+        # the state of the training in the middle of a task
+        if checkpoint["iteration"] == 0:
+            set_rng_state(checkpoint["rng_state"])
+            checkpoint = None
+
+    for no_of_task in range(first_task, no_tasks):
 
         hypernetwork, target_network = train_single_task(
             hypernetwork,
@@ -446,27 +581,12 @@ def build_multiple_task_experiment(dataset_list_of_tasks,
             criterion,
             parameters,
             dataset_list_of_tasks,
-            no_of_task
+            no_of_task,
+            checkpoint=checkpoint
         )
+        checkpoint = None
 
         if no_of_task <= (parameters["number_of_tasks"] - 1):
-            
-            if no_of_task > 0:
-                # Remove previous parameters
-                os.remove(
-                    path=f'{parameters["saving_folder"]}/'
-                        f'hypernetwork_after_{no_of_task-1}_task.pt'
-                )
-
-                os.remove(
-                    path=f'{parameters["saving_folder"]}/'
-                        f'target_network_after_{no_of_task-1}_task.pt'
-                )
-
-                os.remove(
-                    path=f'{parameters["saving_folder"]}/'
-                        f'perturbation_vectors_after_{no_of_task-1}_task.pt'
-                )
 
             # Save current state of networks
             write_pickle_file(
@@ -484,10 +604,24 @@ def build_multiple_task_experiment(dataset_list_of_tasks,
                 f'perturbation_vectors_after_{no_of_task}_task',
                 hypernetwork._perturbated_eps_T
             )
+
+            if no_of_task > 0:
+                # Remove previous parameters only when the current ones
+                # are safely stored
+                for name in ["hypernetwork", "target_network",
+                             "perturbation_vectors"]:
+                    path = (f'{parameters["saving_folder"]}/'
+                            f'{name}_after_{no_of_task-1}_task.pt')
+                    if os.path.exists(path):
+                        os.remove(path)
         
         # Freeze the already learned embeddings and radii
         hypernetwork.detach_tensor(idx = no_of_task)
 
+        # Only test data of the finished task is necessary for evaluation
+        if isinstance(dataset_list_of_tasks, LazyTaskList):
+            dataset_list_of_tasks.release_training_data(no_of_task)
+
         # Evaluate previous tasks
         dataframe = evaluate_previous_classification_tasks(
             hypernetwork,
@@ -519,6 +653,19 @@ def build_multiple_task_experiment(dataset_list_of_tasks,
                                         current_task=no_of_task,
                                         plot_universal_embedding=True)
 
+        if parameters.get("checkpoint_interval", None) is not None:
+            save_training_checkpoint(
+                parameters["saving_folder"],
+                {
+                    "task": no_of_task + 1,
+                    "iteration": 0,
+                    "hypernetwork": hypernetwork.state_dict(),
+                    "target_network": target_network.state_dict()
+                }
+            )
+
+    remove_training_checkpoint(parameters["saving_folder"])
+
     return hypernetwork, target_network, dataframe
 
 
@@ -542,13 +689,26 @@ def main_running_experiments(path_to_datasets,
         Returns learned hypernetwork, target network and a dataframe
         with single results.
     """
-    if parameters["dataset"] == "PermutedMNIST":
+    if parameters.get("packed_dataset_path") is not None:
+        dataset_tasks_list = prepare_packed_experiment_tasks(
+            parameters["dataset"],
+            parameters["packed_dataset_path"],
+            number_of_tasks=parameters["number_of_tasks"],
+            no_of_validation_samples=parameters["no_of_validation_samples"],
+            no_of_validation_samples_per_class=parameters.get(
+                "no_of_validation_samples_per_class"
+            ),
+            use_augmentation=parameters["augmentation"],
+            seed=parameters["seed"]
+        )
+    elif parameters["dataset"] == "PermutedMNIST":
         dataset_tasks_list = prepare_permuted_mnist_tasks(
             path_to_datasets,
             parameters["input_shape"],
             parameters["number_of_tasks"],
             parameters["padding"],
             parameters["no_of_validation_samples"],
+            device=parameters["device"]
         )
     elif parameters["dataset"] == "CIFAR100":
         dataset_tasks_list = prepare_split_cifar100_tasks(
@@ -575,6 +735,7 @@ def main_running_experiments(path_to_datasets,
             seed=parameters["seed"],
             validation_size=parameters["no_of_validation_samples"],
             number_of_tasks=parameters["number_of_tasks"],
+            lazy=parameters.get("lazy_task_loading", False)
         )
     elif parameters["dataset"] == "CIFAR100_FeCAM_setup":
         dataset_tasks_list = prepare_split_cifar100_tasks_aka_FeCAM(
@@ -584,6 +745,9 @@ def main_running_experiments(path_to_datasets,
                 "no_of_validation_samples_per_class"
             ],
             use_augmentation=parameters["augmentation"],
+            use_batched_augmentation=parameters.get(
+                "batched_augmentation", False
+            ),
         )
     elif parameters["dataset"] == "SubsetImageNet":
         dataset_tasks_list = prepare_subset_imagenet_tasks(
@@ -593,13 +757,20 @@ def main_running_experiments(path_to_datasets,
                 "no_of_validation_samples_per_class"
             ],
             use_augmentation=parameters["augmentation"],
-            batch_size=parameters["batch_size"]
+            batch_size=parameters["batch_size"],
+            preresized_size=parameters.get("preresized_size"),
+            lazy=parameters.get("lazy_task_loading", False),
+            use_batched_augmentation=parameters.get(
+                "batched_augmentation", False
+            )
         )
     elif parameters["dataset"] == "CUB200":
         dataset_tasks_list = prepare_CUB200_tasks(
             path_to_datasets,
             validation_size_per_class=parameters["no_of_validation_samples"],
-            number_of_tasks=parameters["number_of_tasks"]
+            number_of_tasks=parameters["number_of_tasks"],
+            lazy=parameters.get("lazy_task_loading", False),
+            use_image_store=parameters.get("cub_image_store", False)
         )
     else:
         raise ValueError("Wrong name of the dataset!")
@@ -645,6 +816,14 @@ def main_running_experiments(path_to_datasets,
         row_with_results
     )
 
+    # Save results into the store indexed by hyperparameters and seeds
+    if parameters.get("results_store", None) is not None:
+        store_experiment_results(parameters["results_store"],
+                                 parameters,
+                                 {"standard": dataframe},
+                                 scenario="non_forced",
+                                 elapsed_time=elapsed_time)
+
     # Plot heatmap for results
     load_path = (f'{parameters["saving_folder"]}/'
                  f"results.csv")
@@ -653,13 +832,79 @@ def main_running_experiments(path_to_datasets,
     return hypernetwork, target_network, dataframe
 
 
+def run_single_configuration(path_to_datasets, parameters):
+    """
+    Prepare the saving folder, set the seed and run a single experiment
+    of the grid search. It is a top-level function to be picklable
+    by worker processes.
+
+    Parameters:
+    -----------
+    path_to_datasets: str
+        Path to files with datasets.
+    parameters: dict
+        Contains multiple experiment hyperparameters.
+    """
+    os.makedirs(f'{parameters["saving_folder"]}', exist_ok=True)
+    save_parameters(parameters["saving_folder"],
+                    parameters,
+                    name=f"parameters.csv")
+
+    # Important! Seed is set before the preparation of the dataset!
+    if parameters["seed"] is not None:
+        set_seed(parameters["seed"])
+
+    main_running_experiments(path_to_datasets, parameters)
+
+
 if __name__ == "__main__":
     path_to_datasets = "./Data"
     dataset = "CUB200"  # "PermutedMNIST", "CIFAR100", "SplitMNIST", "TinyImageNet", "CIFAR100_FeCAM_setup", "SubsetImageNet", "CIFAR10",
                                 # "CUB200"
     part = 0
-    TIMESTAMP = datetime.now().strftime("%Y-%m-%d_%H-%M-%S") # Generate timestamp
+    # A fixed name of the grid search (e.g. shared by several machines)
+    # allows to resume it, finished configurations are skipped
+    TIMESTAMP = os.environ.get(
+        "GRID_SEARCH_NAME",
+        datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    )
     create_grid_search = True
+    number_of_workers = 1
+    # Number of iterations between consecutive checkpoints of the training
+    # (None disables checkpoints in the middle of tasks)
+    checkpoint_interval = None
+    # None (float32), "bf16" or "fp16" (only GPU) for the target network;
+    # bounds computed in a reduced precision are heuristically widened by
+    # rounding_margin unit roundoffs relative to their magnitude (they are
+    # not verified bounds of the float32 network)
+    mixed_precision = None
+    rounding_margin = 4.0
+    # Measure time and peak memory of phases of training iterations
+    # (saved to profiling.csv); profiler_trace_window = (task, first iteration,
+    # number of iterations) additionally stores a trace of torch.profiler
+    profile_steps = False
+    profiler_trace_window = None
+    threads_per_worker = None
+    # Results of all runs are also saved into an SQLite store
+    # (see Utils/results_store.py) in the main saving folder
+    use_results_store = True
+    # SubsetImageNet images may be pre-resized once to this resolution
+    # (e.g. 80) and transformed at it; None reads full-resolution files
+    preresized_size = None
+    # CIFAR-100 (FeCAM) and pre-resized SubsetImageNet images are augmented
+    # in whole batches on the device; the batched pipeline differs from
+    # the original per-image one
+    batched_augmentation = False
+    # Tasks are created on first access, the next task is prepared in
+    # the background and training data of finished tasks is released
+    # (TinyImageNet, SubsetImageNet and CUB200)
+    lazy_task_loading = False
+    # CUB200 images are decoded once to a store of central squares and
+    # transformed in batches on the device; random crops are then drawn
+    # from the central squares, unlike in the original augmentation
+    cub_image_store = False
+    number_of_shards = int(os.environ.get("GRID_SEARCH_NUMBER_OF_SHARDS", 1))
+    shard_id = int(os.environ.get("GRID_SEARCH_SHARD_ID", 0))
 
     if create_grid_search:
         summary_results_filename = "grid_search_results"
@@ -678,11 +923,13 @@ if __name__ == "__main__":
         "elapsed_time"
     )
 
-    append_row_to_file(
+    os.makedirs(hyperparameters["saving_folder"], exist_ok=True)
+    prepare_summary_file(
         f'{hyperparameters["saving_folder"]}/{summary_results_filename}.csv',
         header
     )
 
+    configurations = []
     for no, elements in enumerate(
         product(hyperparameters["embedding_sizes"],
                 hyperparameters["learning_rates"],
@@ -740,7 +987,19 @@ if __name__ == "__main__":
             "perturbated_epsilon": perturbated_eps,
             "kappa": hyperparameters["kappa"],
             "dropout_rate": dropout_rate,
-            "full_interval": hyperparameters["full_interval"]
+            "full_interval": hyperparameters["full_interval"],
+            "checkpoint_interval": checkpoint_interval,
+            "mixed_precision": mixed_precision,
+            "rounding_margin": rounding_margin,
+            "profile_steps": profile_steps,
+            "profiler_trace_window": profiler_trace_window,
+            "results_store": (f'{hyperparameters["saving_folder"]}/results.sqlite'
+                              if use_results_store else None),
+            "preresized_size": preresized_size,
+            "batched_augmentation": batched_augmentation,
+            "lazy_task_loading": lazy_task_loading,
+            "packed_dataset_path": hyperparameters["packed_dataset_path"],
+            "cub_image_store": cub_image_store
         }
 
         if "no_of_validation_samples_per_class" in hyperparameters:
@@ -748,16 +1007,18 @@ if __name__ == "__main__":
                 "no_of_validation_samples_per_class"
             ]
 
-        os.makedirs(f'{parameters["saving_folder"]}', exist_ok=True)
-        # start_time = datetime.now().strftime("%Y%m%d_%H%M%S")
-        save_parameters(parameters["saving_folder"],
-                        parameters,
-                        name=f"parameters.csv")
+        configurations.append(parameters)
 
-        # Important! Seed is set before the preparation of the dataset!
-        if seed is not None:
-            set_seed(seed)
+    # Daemonic workers of the grid search decode images serially,
+    # so the store of decoded images is built in advance
+    if dataset == "CUB200" and cub_image_store and number_of_workers > 1:
+        SplitCUB200Data.prepare_image_store(path_to_datasets)
 
-        hypernetwork, target_network, dataframe = \
-            main_running_experiments(path_to_datasets,
-                                     parameters)
+    run_grid_search(
+        configurations,
+        partial(run_single_configuration, path_to_datasets),
+        number_of_workers=number_of_workers,
+        threads_per_worker=threads_per_worker,
+        shard_id=shard_id,
+        number_of_shards=number_of_shards
+    )
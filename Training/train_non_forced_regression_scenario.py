@@ -31,6 +31,7 @@ from LossFunctions.regression_loss_function import IntervalMSELoss
 from Utils.prepare_non_forced_scenario_params import set_hyperparameters
 from Utils.dataset_utils import *
 from Utils.handy_functions import *
+from Utils.grid_search_scheduler import run_grid_search, prepare_summary_file
 
 def train_single_task(hypernetwork,
                       target_network,
@@ -139,7 +140,7 @@ def train_single_task(hypernetwork,
 
         # Adjust kappa and epsilon
         if iteration < iterations_to_adjust:
-            kappa = max(1 - 0.00005*iteration, hyperparameters["kappa"])
+            kappa = max(1 - 0.00005*iteration, parameters["kappa"])
             eps   = (iteration / (iterations_to_adjust-1)) * parameters["perturbated_epsilon"]
         else:
             kappa = parameters["kappa"]
@@ -586,11 +587,43 @@ def main_running_experiments(parameters):
     return hypernetwork, target_network, dataframe
 
 
+def run_single_configuration(parameters):
+    """
+    Prepare the saving folder, set the seed and run a single experiment
+    of the grid search. It is a top-level function to be picklable
+    by worker processes.
+
+    Parameters:
+    -----------
+    parameters: dict
+        Contains multiple experiment hyperparameters.
+    """
+    os.makedirs(f'{parameters["saving_folder"]}', exist_ok=True)
+    save_parameters(parameters["saving_folder"],
+                    parameters,
+                    name=f"parameters.csv")
+
+    # Important! Seed is set before the preparation of the dataset!
+    if parameters["seed"] is not None:
+        set_seed(parameters["seed"])
+
+    main_running_experiments(parameters)
+
+
 if __name__ == "__main__":
     dataset = "GaussianDataset"  # "ToyRegression1D", "GaussianDataset"
     part = 0
-    TIMESTAMP = datetime.now().strftime("%Y-%m-%d_%H-%M-%S") # Generate timestamp
+    # A fixed name of the grid search (e.g. shared by several machines)
+    # allows to resume it, finished configurations are skipped
+    TIMESTAMP = os.environ.get(
+        "GRID_SEARCH_NAME",
+        datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    )
     create_grid_search = False
+    number_of_workers = 1
+    threads_per_worker = None
+    number_of_shards = int(os.environ.get("GRID_SEARCH_NUMBER_OF_SHARDS", 1))
+    shard_id = int(os.environ.get("GRID_SEARCH_SHARD_ID", 0))
 
     if create_grid_search:
         summary_results_filename = "grid_search_results"
@@ -609,11 +642,13 @@ if __name__ == "__main__":
         "elapsed_time"
     )
 
-    append_row_to_file(
+    os.makedirs(hyperparameters["saving_folder"], exist_ok=True)
+    prepare_summary_file(
         f'{hyperparameters["saving_folder"]}/{summary_results_filename}.csv',
         header
     )
 
+    configurations = []
     for no, elements in enumerate(
         product(hyperparameters["embedding_sizes"],
                 hyperparameters["learning_rates"],
@@ -679,15 +714,13 @@ if __name__ == "__main__":
                 "no_of_validation_samples_per_class"
             ]
 
-        os.makedirs(f'{parameters["saving_folder"]}', exist_ok=True)
-        # start_time = datetime.now().strftime("%Y%m%d_%H%M%S")
-        save_parameters(parameters["saving_folder"],
-                        parameters,
-                        name=f"parameters.csv")
-
-        # Important! Seed is set before the preparation of the dataset!
-        if seed is not None:
-            set_seed(seed)
+        configurations.append(parameters)
 
-        hypernetwork, target_network, dataframe = \
-            main_running_experiments(parameters)
+    run_grid_search(
+        configurations,
+        run_single_configuration,
+        number_of_workers=number_of_workers,
+        threads_per_worker=threads_per_worker,
+        shard_id=shard_id,
+        number_of_shards=number_of_shards
+    )
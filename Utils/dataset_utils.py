@@ -1,14 +1,33 @@
 import numpy as np
-from hypnettorch.data.special import permuted_mnist
+from functools import partial
 from hypnettorch.data.special.split_cifar import SplitCIFAR100Data, SplitCIFAR10Data
 from DatasetHandlers.split_mnist import get_split_mnist_handlers
+from DatasetHandlers.permuted_mnist import get_permuted_mnist_handlers
 from DatasetHandlers.subset_image_net import SubsetImageNet
 from DatasetHandlers.tiny_image_net import TinyImageNet
-from DatasetHandlers.cifar100_FeCAM import SplitCIFAR100Data_FeCAM
-from DatasetHandlers.split_cub200 import SplitCUB200Data
+from DatasetHandlers.cifar100_FeCAM import CIFAR100Data, SplitCIFAR100Data_FeCAM
+from DatasetHandlers.split_cub200 import CUB2002011, SplitCUB200Data
+from DatasetHandlers.lazy_task_list import LazyTaskList
+from DatasetHandlers.packed_dataset import PackedDataset
 
 from hypnettorch.data.special.regression1d_data import ToyRegression
 from DatasetHandlers.gaussian_data import get_gmm_tasks
+from DatasetHandlers.synthetic_data import get_synthetic_handlers
+
+# The order of image classes in the case of FeCAM was not 0-10, 11-20, etc.,
+# but it was chosen randomly by the authors, and was at follows:
+FECAM_CLASS_ORDER = [
+    87, 0, 52, 58, 44, 91, 68, 97, 51, 15,
+    94, 92, 10, 72, 49, 78, 61, 14, 8, 86,
+    84, 96, 18, 24, 32, 45, 88, 11, 4, 67,
+    69, 66, 77, 47, 79, 93, 29, 50, 57, 83,
+    17, 81, 41, 12, 37, 59, 25, 20, 80, 73,
+    1, 28, 6, 46, 62, 82, 53, 9, 31, 75,
+    38, 63, 33, 74, 27, 22, 36, 3, 16, 21,
+    60, 19, 70, 90, 89, 43, 5, 42, 65, 76,
+    40, 30, 23, 85, 2, 95, 56, 48, 71, 64,
+    98, 13, 99, 7, 34, 55, 54, 26, 35, 39
+]
 
 def generate_random_permutations(shape_of_data_instance,
                                  number_of_permutations):
@@ -118,7 +137,9 @@ def prepare_split_cifar100_tasks(datasets_folder,
 def prepare_CUB200_tasks(datasets_folder,
                         validation_size_per_class,
                         number_of_tasks=5,
-                        use_one_hot=True):
+                        use_one_hot=True,
+                        lazy=False,
+                        use_image_store=False):
     """
     Prepare a list of 'number_of_tasks' sequential tasks, each with equally distributed number of classes. 
     The i-th task, where i is in {0, 1, ..., 'number_of_tasks'-1}, will store samples from classes
@@ -134,22 +155,31 @@ def prepare_CUB200_tasks(datasets_folder,
         The number of sequential tasks.
     use_one_hot: bool, Optional
         If True, then one-hot encoding is applied.
+    lazy: bool, Optional
+        If True, tasks are created on first access (see LazyTaskList).
+    use_image_store: bool, Optional
+        If True, images are read from the store of decoded central squares
+        and transformed in batches, which changes the random crops.
 
     Returns:
     --------
     handlers: List[SplitCUB200Data]
         A list of SplitCUB200Data instances, each representing a task.
     """
-    handlers = []
+    factories = []
     no_classes = 200 // number_of_tasks
     for i in range(0, 200, no_classes):
-        handlers.append(SplitCUB200Data(
+        factories.append(partial(
+            SplitCUB200Data,
             datasets_folder,
             use_one_hot=use_one_hot,
             validation_size_per_class=validation_size_per_class,
-            labels=range(i, i + no_classes)
+            labels=range(i, i + no_classes),
+            use_image_store=use_image_store
         ))
-    return handlers
+    if lazy:
+        return LazyTaskList(factories)
+    return [factory() for factory in factories]
 
 def prepare_split_cifar100_tasks_aka_FeCAM(
     datasets_folder,
@@ -157,7 +187,8 @@ def prepare_split_cifar100_tasks_aka_FeCAM(
     no_of_validation_samples_per_class,
     use_augmentation,
     use_cutout=False,
-    use_one_hot=True
+    use_one_hot=True,
+    use_batched_augmentation=False
 ):
     """
     Prepare a list of incremental tasks with varying numbers of classes per task.
@@ -180,6 +211,9 @@ def prepare_split_cifar100_tasks_aka_FeCAM(
         If True, applies the "apply_cutout" option from "torch_input_transforms".
     use_one_hot: bool, Optional
         If True, then one-hot encoding is applied.
+    use_batched_augmentation: bool, Optional
+        If True, augmentations are applied to whole batches on the device
+        (see SplitCIFAR100Data_FeCAM).
 
     Returns:
     --------
@@ -189,20 +223,7 @@ def prepare_split_cifar100_tasks_aka_FeCAM(
     # FeCAM considered four scenarios: 5, 10 and 20 incremental tasks
     # and 5 tasks with the equal number of classes
     assert number_of_tasks in [5, 6, 11, 20, 21]
-    # The order of image classes in the case of FeCAM was not 0-10, 11-20, etc.,
-    # but it was chosen randomly by the authors, and was at follows:
-    class_orders = [
-        87, 0, 52, 58, 44, 91, 68, 97, 51, 15,
-        94, 92, 10, 72, 49, 78, 61, 14, 8, 86,
-        84, 96, 18, 24, 32, 45, 88, 11, 4, 67,
-        69, 66, 77, 47, 79, 93, 29, 50, 57, 83,
-        17, 81, 41, 12, 37, 59, 25, 20, 80, 73,
-        1, 28, 6, 46, 62, 82, 53, 9, 31, 75,
-        38, 63, 33, 74, 27, 22, 36, 3, 16, 21,
-        60, 19, 70, 90, 89, 43, 5, 42, 65, 76,
-        40, 30, 23, 85, 2, 95, 56, 48, 71, 64,
-        98, 13, 99, 7, 34, 55, 54, 26, 35, 39
-    ]
+    class_orders = FECAM_CLASS_ORDER
     # Incremental tasks from Table I, FeCAM
     if number_of_tasks == 6:
         numbers_of_classes_per_tasks = [50]
@@ -232,6 +253,7 @@ def prepare_split_cifar100_tasks_aka_FeCAM(
                 validation_size=validation_size,
                 use_data_augmentation=use_augmentation,
                 use_cutout=use_cutout,
+                use_batched_augmentation=use_batched_augmentation,
                 labels=class_orders[
                     (i * current_number_of_tasks) : (
                         (i + 1) * current_number_of_tasks
@@ -249,7 +271,10 @@ def prepare_subset_imagenet_tasks(
     use_augmentation = False,
     number_of_tasks = 5,
     batch_size = 16,
-    use_one_hot=True
+    use_one_hot=True,
+    preresized_size=None,
+    lazy=False,
+    use_batched_augmentation=False
     ):
     """
     Prepare a list of tasks related to the SubsetImageNet dataset according
@@ -271,6 +296,14 @@ def prepare_subset_imagenet_tasks(
         Batch size for training.
     use_one_hot: bool, Optional
         If True, then one-hot encoding is applied.
+    preresized_size: int, Optional
+        If given, images are pre-resized once to this resolution and
+        transformed at it (see SubsetImageNet).
+    lazy: bool, Optional
+        If True, tasks are created on first access (see LazyTaskList).
+    use_batched_augmentation: bool, Optional
+        If True and preresized_size is given, augmentations are applied
+        to whole batches on the device (see SubsetImageNet).
 
     Returns:
     --------
@@ -282,22 +315,27 @@ def prepare_subset_imagenet_tasks(
         raise ValueError("Only 5 incremental tasks are supported right now!")
     
 
-    handlers = []
+    factories = []
     for i in range(number_of_tasks):
 
-        handlers.append(
-            SubsetImageNet(
+        factories.append(
+            partial(
+                SubsetImageNet,
                 path=datasets_folder,
                 validation_size=no_of_validation_samples_per_class,
                 use_one_hot=use_one_hot,
                 use_data_augmentation=use_augmentation,
                 task_id = i,
                 setting = setting,
-                batch_size=batch_size
+                batch_size=batch_size,
+                preresized_size=preresized_size,
+                use_batched_augmentation=use_batched_augmentation
             )
         )
 
-    return handlers
+    if lazy:
+        return LazyTaskList(factories)
+    return [factory() for factory in factories]
 
 
 def prepare_permuted_mnist_tasks(datasets_folder,
@@ -305,9 +343,11 @@ def prepare_permuted_mnist_tasks(datasets_folder,
                                  number_of_tasks,
                                  padding,
                                  validation_size,
-                                 use_one_hot=True):
+                                 use_one_hot=True,
+                                 device=None):
     """
     Prepare a list of tasks related to the PermutedMNIST dataset.
+    All tasks share a single copy of MNIST stored on the device.
 
     Parameters:
     ----------
@@ -323,7 +363,9 @@ def prepare_permuted_mnist_tasks(datasets_folder,
         The number of validation samples.
     use_one_hot: bool, Optional
         If True, then one-hot encoding is applied.
-
+    device: str, Optional
+        The device on which images are stored and batches are assembled.
+        By default, "cuda" if it is available.
 
     Returns:
     --------
@@ -334,12 +376,13 @@ def prepare_permuted_mnist_tasks(datasets_folder,
         input_shape,
         number_of_tasks
     )
-    return permuted_mnist.PermutedMNISTList(
+    return get_permuted_mnist_handlers(
         permutations,
         datasets_folder,
         use_one_hot=use_one_hot,
         padding=padding,
-        validation_size=validation_size
+        validation_size=validation_size,
+        device=device
     )
 
 
@@ -385,7 +428,8 @@ def prepare_tinyimagenet_tasks(
     seed: int = 1993,
     validation_size: int = 100, 
     number_of_tasks: int = 40,
-    use_one_hot: bool = True
+    use_one_hot: bool = True,
+    lazy: bool = False
     ):
     """
     Prepare a list of tasks related to the TinyImageNet dataset according
@@ -405,6 +449,8 @@ def prepare_tinyimagenet_tasks(
         Defines the number of continual learning tasks. By default, it is 40.
     use_one_hot: bool, Optional
         If True, then one-hot encoding is applied.
+    lazy: bool, Optional
+        If True, tasks are created on first access (see LazyTaskList).
 
     Returns:
     --------
@@ -416,7 +462,7 @@ def prepare_tinyimagenet_tasks(
     # Set randomly the order of classes
     rng = np.random.default_rng(seed)
     class_permutation = rng.permutation(200)
-    handlers = []
+    factories = []
 
     number_of_classes = int(200 / number_of_tasks)
 
@@ -424,8 +470,9 @@ def prepare_tinyimagenet_tasks(
     for i in range(0, number_of_classes * number_of_tasks, number_of_classes):
         current_labels = class_permutation[i:(i + number_of_classes)]
         print(f"Order of classes in the current task: {current_labels}")
-        handlers.append(
-            TinyImageNet(
+        factories.append(
+            partial(
+                TinyImageNet,
                 data_path=datasets_folder,
                 validation_size=validation_size,
                 use_one_hot=use_one_hot,
@@ -433,7 +480,9 @@ def prepare_tinyimagenet_tasks(
             )
         )
 
-    return handlers
+    if lazy:
+        return LazyTaskList(factories)
+    return [factory() for factory in factories]
 
 
 def prepare_toy_regression_tasks(
@@ -555,5 +604,193 @@ def prepare_gaussian_regression_tasks(
 
     return handlers
 
+
+def prepare_synthetic_tasks(dataset,
+                            number_of_tasks=None,
+                            samples_per_class=(50, 10, 10),
+                            seed=1,
+                            use_one_hot=True,
+                            padding=None):
+    """
+    Prepare a list of synthetic tasks with the same input shapes and class
+    splits as a given dataset. It does not require any downloads.
+
+    Parameters:
+    ----------
+    dataset: str
+        The name of the imitated dataset (e.g., "CIFAR100", "TinyImageNet").
+    number_of_tasks: int, optional
+        The number of tasks. By default, as in the imitated dataset.
+    samples_per_class: Tuple[int, int, int], optional
+        The number of training, validation and test samples of each class.
+    seed: int, optional
+        Necessary for data generation.
+    use_one_hot: bool, Optional
+        If True, then one-hot encoding is applied.
+    padding: int, optional
+        Padding value for the PermutedMNIST dataset.
+
+    Returns:
+    --------
+    tasks: List[SyntheticClassificationData]
+        A list of SyntheticClassificationData objects representing the tasks.
+    """
+    num_train, num_val, num_test = samples_per_class
+    return get_synthetic_handlers(
+        dataset,
+        number_of_tasks=number_of_tasks,
+        num_train_per_class=num_train,
+        num_val_per_class=num_val,
+        num_test_per_class=num_test,
+        use_one_hot=use_one_hot,
+        seed=seed,
+        padding=padding
+    )
+
+
+def prepare_packed_tasks(packed_path,
+                         number_of_tasks,
+                         validation_size=0,
+                         class_order=None,
+                         train_transform=None,
+                         test_transform=None,
+                         use_one_hot=True):
+    """
+    Prepare a list of tasks with equal numbers of classes from a dataset
+    saved in the packed format (see DatasetHandlers/packed_dataset.py).
+    All tasks share the same memory-mapped images.
+
+    Parameters:
+    ----------
+    packed_path: str
+        The folder of the packed dataset.
+    number_of_tasks: int
+        The total number of tasks to be created.
+    validation_size: int, optional
+        The number of validation samples in each task.
+    class_order: List[int], optional
+        The order of classes in consecutive tasks. By default, 0, 1, 2, ...
+    train_transform: BatchedImageTransform, optional
+        The transformation of training batches.
+    test_transform: BatchedImageTransform, optional
+        The transformation of inference batches.
+    use_one_hot: bool, Optional
+        If True, then one-hot encoding is applied.
+
+    Returns:
+    --------
+    tasks: List[PackedDataset]
+        A list of PackedDataset objects representing the tasks.
+    """
+    _, _, metadata = PackedDataset.load(packed_path)
+    if class_order is None:
+        class_order = list(range(metadata["num_classes"]))
+    assert len(class_order) % number_of_tasks == 0
+    number_of_classes = len(class_order) // number_of_tasks
+    return [
+        PackedDataset(
+            packed_path,
+            labels=class_order[i:(i + number_of_classes)],
+            use_one_hot=use_one_hot,
+            validation_size=validation_size,
+            train_transform=train_transform,
+            test_transform=test_transform
+        )
+        for i in range(0, len(class_order), number_of_classes)
+    ]
+
+
+def prepare_packed_experiment_tasks(dataset,
+                                    packed_path,
+                                    number_of_tasks,
+                                    no_of_validation_samples,
+                                    no_of_validation_samples_per_class=None,
+                                    use_augmentation=False,
+                                    seed=1993,
+                                    use_one_hot=True):
+    """
+    Prepare tasks of a continual learning scenario from a packed dataset
+    (see DatasetHandlers/packed_dataset.py), with the same classes in
+    consecutive tasks as the handlers of the original files and their
+    transformations applied to whole batches on the device. Validation
+    sets are chosen by PackedDataset, so they differ from the original ones.
+
+    Parameters:
+    ----------
+    dataset: str
+        The name of the scenario: "SplitMNIST", "CIFAR100_FeCAM_setup",
+        "TinyImageNet", "SubsetImageNet" or "CUB200".
+    packed_path: str
+        The folder of the dataset packed from the corresponding source.
+    number_of_tasks: int
+        The total number of tasks to be created.
+    no_of_validation_samples: int
+        The number of validation samples in each task (per class
+        in the case of CUB200), as for the original handlers.
+    no_of_validation_samples_per_class: int, optional
+        The number of validation samples in each class
+        for CIFAR100_FeCAM_setup and SubsetImageNet.
+    use_augmentation: bool, optional
+        Whether training images are augmented (only in scenarios in which
+        the original handlers take this option into account).
+    seed: int, optional
+        Defines the order of classes of TinyImageNet.
+    use_one_hot: bool, Optional
+        If True, then one-hot encoding is applied.
+
+    Returns:
+    --------
+    tasks: List[PackedDataset]
+        A list of PackedDataset objects representing the tasks.
+    """
+    if dataset == "SplitMNIST":
+        # Images are only scaled to [0, 1], as in SplitMNIST
+        class_order = list(range(10))[:2 * number_of_tasks]
+        train_transform = test_transform = None
+    elif dataset == "CIFAR100_FeCAM_setup":
+        if number_of_tasks not in [5, 20]:
+            raise ValueError("Only tasks with equal numbers of classes "
+                             "are supported for packed datasets!")
+        class_order = FECAM_CLASS_ORDER
+        train_transform, test_transform = CIFAR100Data.batched_input_transforms(
+            use_augmentation
+        )
+    elif dataset == "TinyImageNet":
+        # The same order of classes as in prepare_tinyimagenet_tasks;
+        # TinyImageNet handlers are created there without augmentation
+        class_order = np.random.default_rng(seed).permutation(200).tolist()
+        _, test_transform = TinyImageNet.torch_input_transforms()
+        train_transform = test_transform
+    elif dataset == "SubsetImageNet":
+        class_order = list(range(100))
+        train_transform, test_transform = SubsetImageNet.batched_input_transforms(
+            use_augmentation
+        )
+    elif dataset == "CUB200":
+        # CUB-200 handlers always augment training images
+        class_order = list(range(200))
+        train_transform, test_transform = CUB2002011.batched_input_transforms()
+    else:
+        raise ValueError("Wrong name of the dataset!")
+
+    number_of_classes = len(class_order) // number_of_tasks
+    if dataset in ["CIFAR100_FeCAM_setup", "SubsetImageNet"]:
+        validation_size = no_of_validation_samples_per_class * number_of_classes
+    elif dataset == "CUB200":
+        validation_size = no_of_validation_samples * number_of_classes
+    else:
+        validation_size = no_of_validation_samples
+
+    return prepare_packed_tasks(
+        packed_path,
+        number_of_tasks,
+        validation_size=validation_size,
+        class_order=class_order,
+        train_transform=train_transform,
+        test_transform=test_transform,
+        use_one_hot=use_one_hot
+    )
+
+
 if __name__ == "__main__":
-    pass
\ No newline at end of file
+    pass
@@ -0,0 +1,236 @@
+"""
+This file implements a scheduler which distributes configurations of a grid search
+over a pool of worker processes and, optionally, over several machines sharing
+the same filesystem.
+"""
+
+import os
+import fcntl
+import traceback
+import multiprocessing as mp
+
+import torch
+
+# Files created in the saving folder of every configuration
+FINISHED_MARKER = "finished"
+CLAIM_FILENAME = ".claim"
+
+
+def select_shard(configurations, shard_id=0, number_of_shards=1):
+    """
+    Select configurations assigned to the given shard. The assignment depends
+    only on the position of a configuration in the grid, therefore each machine
+    which builds the same grid gets a disjoint, deterministic subset of it.
+
+    Parameters:
+    -----------
+    configurations: List[dict]
+        Dictionaries with hyperparameters of consecutive grid search runs.
+    shard_id: int, optional
+        The number of the current shard (machine), from 0 to number_of_shards - 1.
+    number_of_shards: int, optional
+        The total number of shards (machines) sharing the grid search.
+
+    Returns:
+    --------
+    List[Tuple[int, dict]]
+        Pairs of the number of the configuration in the grid and the configuration.
+    """
+    assert number_of_shards >= 1
+    assert 0 <= shard_id < number_of_shards, "Wrong number of the shard!"
+
+    return [
+        (no, parameters) for no, parameters in enumerate(configurations)
+        if no % number_of_shards == shard_id
+    ]
+
+
+def is_configuration_finished(parameters):
+    """
+    Check whether the results of a given configuration are already stored.
+
+    Parameters:
+    -----------
+    parameters: dict
+        Contains hyperparameters of the run, including "saving_folder".
+
+    Returns:
+    --------
+    bool
+        True if the run was finished earlier, False otherwise.
+    """
+    return os.path.exists(
+        os.path.join(parameters["saving_folder"], FINISHED_MARKER)
+    )
+
+
+def prepare_summary_file(filename, header):
+    """
+    Write the header of a summary file shared by many workers only when
+    the file does not contain anything yet.
+
+    Parameters:
+    -----------
+    filename: str
+        The path and name of the summary file.
+    header: str
+        The header row of the summary file.
+    """
+    if not filename.endswith(".csv"):
+        filename += ".csv"
+    with open(filename, "a+") as stream:
+        fcntl.flock(stream, fcntl.LOCK_EX)
+        stream.seek(0, os.SEEK_END)
+        if stream.tell() == 0:
+            stream.write(f"{header}\n")
+        fcntl.flock(stream, fcntl.LOCK_UN)
+
+
+def _set_thread_budget(threads_per_worker):
+    """
+    Limit the number of threads used by a single worker process, so that
+    workers do not oversubscribe the cores of the machine.
+
+    Parameters:
+    -----------
+    threads_per_worker: int
+        The number of threads available for a single worker.
+    """
+    for variable in ["OMP_NUM_THREADS", "MKL_NUM_THREADS",
+                     "OPENBLAS_NUM_THREADS"]:
+        os.environ[variable] = str(threads_per_worker)
+    torch.set_num_threads(threads_per_worker)
+    try:
+        torch.set_num_interop_threads(threads_per_worker)
+    except RuntimeError:
+        # Inter-op threads can be set only before any parallel work starts
+        pass
+
+
+def _run_configuration(arguments):
+    """
+    Run a single configuration of the grid search unless it was already
+    finished or it is currently processed by another worker.
+
+    The claim of a configuration is an exclusive lock on a file in its
+    saving folder. The lock is released by the operating system when the
+    worker dies, therefore preempted runs may be simply started again.
+
+    Parameters:
+    -----------
+    arguments: Tuple[Callable, int, dict]
+        A function running a single experiment, the number of the configuration
+        in the grid and the dictionary with hyperparameters.
+
+    Returns:
+    --------
+    Tuple[int, str]
+        The number of the configuration and its status: "finished",
+        "skipped", "claimed" or "failed".
+    """
+    experiment_function, no, parameters = arguments
+    saving_folder = parameters["saving_folder"]
+    os.makedirs(saving_folder, exist_ok=True)
+
+    claim = open(os.path.join(saving_folder, CLAIM_FILENAME), "a+")
+    try:
+        fcntl.flock(claim, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        claim.close()
+        return no, "claimed"
+
+    try:
+        # Another machine may have finished the run in the meantime
+        if is_configuration_finished(parameters):
+            return no, "skipped"
+        experiment_function(parameters)
+        open(os.path.join(saving_folder, FINISHED_MARKER), "w").close()
+        status = "finished"
+    except Exception:
+        print(f"Configuration no. {no} failed:")
+        traceback.print_exc()
+        status = "failed"
+    finally:
+        fcntl.flock(claim, fcntl.LOCK_UN)
+        claim.close()
+    return no, status
+
+
+def run_grid_search(configurations,
+                    experiment_function,
+                    number_of_workers=1,
+                    threads_per_worker=None,
+                    shard_id=0,
+                    number_of_shards=1):
+    """
+    Run consecutive configurations of a grid search in a pool of worker
+    processes. Configurations which already have results are skipped.
+
+    Parameters:
+    -----------
+    configurations: List[dict]
+        Dictionaries with hyperparameters of consecutive runs. Each of them
+        has to contain a deterministic "saving_folder" to enable skipping
+        of finished runs.
+    experiment_function: Callable[[dict], Any]
+        A top-level (picklable) function which runs a single experiment.
+    number_of_workers: int, optional
+        The number of worker processes. If 1, runs are performed
+        sequentially in the current process.
+    threads_per_worker: int, optional
+        The number of threads for a single worker. By default, cores of
+        the machine are divided equally between the workers.
+    shard_id: int, optional
+        The number of the current machine when the grid search is shared
+        between several machines.
+    number_of_shards: int, optional
+        The total number of machines sharing the grid search.
+
+    Returns:
+    --------
+    dict
+        A dictionary mapping numbers of the configurations to their statuses.
+    """
+    assert number_of_workers >= 1
+    selected_configurations = select_shard(
+        configurations, shard_id=shard_id, number_of_shards=number_of_shards
+    )
+    statuses = {
+        no: "skipped" for no, parameters in selected_configurations
+        if is_configuration_finished(parameters)
+    }
+    pending = [
+        (experiment_function, no, parameters)
+        for no, parameters in selected_configurations
+        if no not in statuses
+    ]
+    print(f"Shard {shard_id}/{number_of_shards}: "
+          f"{len(selected_configurations)} configurations, "
+          f"{len(statuses)} already finished, {len(pending)} to run.")
+
+    if threads_per_worker is None:
+        threads_per_worker = max(1, (os.cpu_count() or 1) // number_of_workers)
+
+    if number_of_workers == 1:
+        for arguments in pending:
+            no, status = _run_configuration(arguments)
+            statuses[no] = status
+    else:
+        # Spawned processes do not inherit the CUDA context of the parent
+        # and a fresh process per run releases all its memory
+        context = mp.get_context("spawn")
+        with context.Pool(processes=number_of_workers,
+                          initializer=_set_thread_budget,
+                          initargs=(threads_per_worker,),
+                          maxtasksperchild=1) as pool:
+            for no, status in pool.imap_unordered(_run_configuration, pending):
+                statuses[no] = status
+
+    failed = sorted(no for no, status in statuses.items() if status == "failed")
+    if len(failed) > 0:
+        print(f"Failed configurations: {failed}")
+    return statuses
+
+
+if __name__ == "__main__":
+    pass
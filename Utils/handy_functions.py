@@ -1,5 +1,6 @@
 import torch
 import torch.nn.functional as F
+from torch.func import vmap
 
 from IntervalNets.interval_modules import parse_logits
 
@@ -9,6 +10,7 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 from datetime import datetime
 import os
+import fcntl
 import random
 from typing import Tuple
 
@@ -42,7 +44,11 @@ def append_row_to_file(filename, elements, header=""):
         filename += ".csv"
     filename = filename.replace(".pt", "")
     with open(filename, "a+") as stream:
+        # The file may be shared by parallel runs of the grid search
+        fcntl.flock(stream, fcntl.LOCK_EX)
         np.savetxt(stream, np.array(elements)[np.newaxis], delimiter=";", fmt="%s", header=header)
+        stream.flush()
+        fcntl.flock(stream, fcntl.LOCK_UN)
 
 
 def write_pickle_file(filename, object_to_save):
@@ -62,7 +68,10 @@ def write_pickle_file(filename, object_to_save):
     --------
     None
     """
-    torch.save(object_to_save, f"{filename}.pt")
+    # Write to a temporary file first to never leave a half-written
+    # checkpoint when the process is interrupted
+    torch.save(object_to_save, f"{filename}.pt.tmp")
+    os.replace(f"{filename}.pt.tmp", f"{filename}.pt")
 
 
 def load_pickle_file(filename):
@@ -149,6 +158,48 @@ def reverse_predictions(target_network, tensor_input, lower_weights, middle_weig
     
     return lower_pred, middle_pred, upper_pred
 
+def reverse_predictions_for_tasks(target_network, tensor_input, lower_weights,
+                                  middle_weights, upper_weights, chunk_size=None):
+    """
+    Reverse predictions for lower, middle, and upper output of the
+    target network for weights of many tasks at once. The forward pass
+    is vectorized over tasks with torch.func.vmap, therefore it is
+    available only for networks without task-specific batch normalization
+    statistics (e.g., MLP or LeNet).
+
+    Parameters:
+    -----------
+    target_network: object
+        The target network for which predictions are computed.
+    tensor_input: torch.Tensor
+        The input tensor for which predictions are computed,
+        shared by all tasks.
+    lower_weights: List[torch.Tensor]
+        The lower weights generated by the hypernetwork, stacked along
+        the first dimension for consecutive tasks.
+    middle_weights: List[torch.Tensor]
+        The stacked middle weights.
+    upper_weights: List[torch.Tensor]
+        The stacked upper weights.
+    chunk_size: int, optional
+        The number of tasks evaluated simultaneously; by default all of them.
+
+    Returns:
+    --------
+    torch.Tensor
+        Predictions of the shape (tasks, batch_size, 3, output_size).
+    """
+    def predict(lower, middle, upper):
+        return torch.stack(reverse_predictions(target_network,
+                                               tensor_input,
+                                               lower,
+                                               middle,
+                                               upper), dim=1)
+
+    return vmap(predict, chunk_size=chunk_size)(lower_weights,
+                                                middle_weights,
+                                                upper_weights)
+
 def intersection_of_embeds(z_l: torch.Tensor, z_u: torch.Tensor) -> Tuple[torch.Tensor]:
     """
     Compute the intersection of lower and upper embedding bounds for each task.
@@ -258,6 +309,74 @@ def calculate_number_of_iterations(number_of_samples,
 
     return no_of_iterations_per_epoch, total_no_of_iterations
 
+def get_autocast_dtype(mixed_precision):
+    """
+    Translate the name of a mixed precision mode into a data type
+    used by torch.autocast.
+
+    Parameters:
+    -----------
+    mixed_precision: str or None
+        None for full precision training, "bf16" or "fp16".
+
+    Returns:
+    --------
+    torch.dtype or None
+        The data type of autocast or None when autocast is disabled.
+    """
+    if mixed_precision is None:
+        return None
+    elif mixed_precision == "bf16":
+        return torch.bfloat16
+    elif mixed_precision == "fp16":
+        return torch.float16
+    else:
+        raise ValueError("Wrong type of the selected mixed precision mode!")
+
+
+def widen_bounds_for_rounding(lower_pred, middle_pred, upper_pred,
+                              dtype, rounding_margin=4.0):
+    """
+    Cast lower, middle and upper predictions computed in a reduced precision
+    to float32 and widen the interval by a rounding margin. It is a heuristic
+    widening: the margin depends only on the magnitude of the output bounds,
+    while rounding errors accumulate over all layers, so the widened bounds
+    are not verified bounds of the full precision network.
+
+    Parameters:
+    -----------
+    lower_pred: torch.Tensor
+        Lower predictions of the target network.
+    middle_pred: torch.Tensor
+        Middle predictions of the target network.
+    upper_pred: torch.Tensor
+        Upper predictions of the target network.
+    dtype: torch.dtype
+        The data type in which the predictions were computed.
+    rounding_margin: float, optional
+        The margin expressed as a multiple of the unit roundoff of dtype,
+        relative to the magnitude of the bounds.
+
+    Returns:
+    --------
+    Tuple[torch.Tensor, torch.Tensor, torch.Tensor]
+        Widened lower predictions, middle predictions and widened upper predictions.
+    """
+    lower_pred = lower_pred.float()
+    middle_pred = middle_pred.float()
+    upper_pred = upper_pred.float()
+
+    # Rounding may break the order of bounds
+    lower_pred = torch.minimum(lower_pred, middle_pred)
+    upper_pred = torch.maximum(upper_pred, middle_pred)
+
+    unit_roundoff = torch.finfo(dtype).eps / 2
+    margin = rounding_margin * unit_roundoff * torch.maximum(
+        lower_pred.abs(), upper_pred.abs()
+    )
+    return lower_pred - margin, middle_pred, upper_pred + margin
+
+
 def calculate_accuracy(data,
                        target_network,
                        lower_weights,
@@ -454,6 +573,43 @@ def calculate_mse_loss(criterion,
        
     return mse_loss
 
+def append_evaluation_results(dataframe_results, after_learning_of_task,
+                              results, column="accuracy"):
+    """
+    Append results of an evaluation of consecutive tasks to a dataframe.
+    Results are collected in columns and transferred from the device
+    at once, then the dataframe is extended by a single concatenation.
+
+    Parameters:
+    -----------
+    dataframe_results: Pandas DataFrame
+        Stores results; contains the following columns: "after_learning_of_task",
+        "tested_task", and the column of results.
+    after_learning_of_task: int
+        The number of the last trained task.
+    results: List[torch.Tensor]
+        Scalar results for tasks 0, 1, ..., len(results) - 1.
+    column: str, optional
+        The name of the column with results (default: "accuracy").
+
+    Returns:
+    --------
+    Pandas DataFrame
+        A dataframe updated with the results.
+    """
+    values = torch.stack([torch.as_tensor(value) for value in results])
+    values = values.detach().cpu().tolist()
+    rows = pd.DataFrame({
+        "after_learning_of_task": [after_learning_of_task] * len(values),
+        "tested_task": list(range(len(values))),
+        column: values
+    })
+    if dataframe_results.shape[0] == 0:
+        return rows.reindex(
+            columns=list(dict.fromkeys([*dataframe_results.columns, *rows.columns]))
+        )
+    return pd.concat([dataframe_results, rows], ignore_index=True)
+
 def evaluate_previous_tasks_for_intersection(hypernetwork,
                             target_network,
                             universal_emb,
@@ -506,6 +662,7 @@ def evaluate_previous_tasks_for_intersection(hypernetwork,
                                                                         return_extended_output=True,
                                                                         universal_emb=True)
 
+    accuracies = []
     for task in range(parameters["number_of_task"] + 1):
         # Target entropy calculation should be included here: hypernetwork has to be inferred
         # for each task (together with the target network) and the task_id with the lowest entropy
@@ -523,14 +680,13 @@ def evaluate_previous_tasks_for_intersection(hypernetwork,
             parameters=parameters,
             evaluation_dataset="test"
         )
-        result = {
-            "after_learning_of_task": parameters["number_of_task"],
-            "tested_task": task,
-            "accuracy": accuracy.cpu().item()
-        }
+        accuracies.append(accuracy)
+
+    dataframe_results = append_evaluation_results(
+        dataframe_results, parameters["number_of_task"], accuracies
+    )
+    for task, accuracy in enumerate(dataframe_results["accuracy"].values[-len(accuracies):]):
         print(f"Accuracy for task {task}: {accuracy}%.")
-        dataframe_results = dataframe_results.append(
-            result, ignore_index=True)
     return dataframe_results
 
 def evaluate_previous_classification_tasks(hypernetwork,
@@ -576,6 +732,7 @@ def evaluate_previous_classification_tasks(hypernetwork,
     target_network.eval()
 
     # The case when we know task id during interference
+    accuracies = []
     for task in range(parameters["number_of_task"] + 1):
         # Target entropy calculation should be included here: hypernetwork has to be inferred
         # for each task (together with the target network) and the task_id with the lowest entropy
@@ -598,16 +755,13 @@ def evaluate_previous_classification_tasks(hypernetwork,
             parameters=parameters,
             evaluation_dataset="test"
         )
-        
-        result = {
-            "after_learning_of_task": parameters["number_of_task"],
-            "tested_task": task,
-            "accuracy": accuracy.cpu().item()
-        }
+        accuracies.append(accuracy)
+
+    dataframe_results = append_evaluation_results(
+        dataframe_results, parameters["number_of_task"], accuracies
+    )
+    for task, accuracy in enumerate(dataframe_results["accuracy"].values[-len(accuracies):]):
         print(f"Accuracy for task {task}: {accuracy}%.")
-        dataframe_results = dataframe_results.append(
-            result, ignore_index=True)
-        
     return dataframe_results
 
 
@@ -658,6 +812,7 @@ def evaluate_previous_regression_tasks(
     target_network.eval()
 
     # The case when we know task id during interference
+    mse_losses = []
     for task in range(parameters["number_of_task"] + 1):
 
         currently_tested_task = list_of_permutations[task]
@@ -676,16 +831,14 @@ def evaluate_previous_regression_tasks(
             parameters=parameters,
             evaluation_dataset="test"
         )
-        
-        result = {
-            "after_learning_of_task": parameters["number_of_task"],
-            "tested_task": task,
-            "mse_loss": mse_loss.cpu().item()
-        }
+        mse_losses.append(mse_loss)
+
+    dataframe_results = append_evaluation_results(
+        dataframe_results, parameters["number_of_task"], mse_losses,
+        column="mse_loss"
+    )
+    for task, mse_loss in enumerate(dataframe_results["mse_loss"].values[-len(mse_losses):]):
         print(f"MSE loss for task {task}: {mse_loss}.")
-        dataframe_results = dataframe_results.append(
-            result, ignore_index=True)
-        
     return dataframe_results
 
 
@@ -616,6 +616,9 @@ def set_hyperparameters(dataset,
     hyperparams["dataset"] = dataset
     hyperparams["device"] = "cuda" if torch.cuda.is_available() else "cpu"
     hyperparams["kappa"] = 0.5
+    # Folder of the dataset packed by DatasetHandlers/packed_dataset.py;
+    # if given, tasks are read from it instead of the original files
+    hyperparams["packed_dataset_path"] = None
     os.makedirs(hyperparams["saving_folder"], exist_ok=True)
     return hyperparams
 
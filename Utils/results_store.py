@@ -0,0 +1,480 @@
+"""
+This file implements an embedded store of experiment results based on SQLite.
+Runs are indexed by the dataset, the scenario, a hash of hyperparameters and
+the seed, and accuracies of consecutive evaluations are stored in a single
+table, so metrics of thousands of grid search runs (backward transfer, final
+accuracy, accuracy curves) are calculated with SQL queries and pivots instead
+of reading and filtering many CSV files.
+"""
+
+import os
+import json
+import sqlite3
+import hashlib
+from contextlib import closing
+
+import pandas as pd
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    dataset TEXT NOT NULL,
+    scenario TEXT NOT NULL,
+    seed INTEGER,
+    hyperparameters_hash TEXT NOT NULL,
+    hyperparameters TEXT NOT NULL,
+    saving_folder TEXT UNIQUE,
+    elapsed_time REAL
+);
+CREATE INDEX IF NOT EXISTS runs_index
+    ON runs (dataset, scenario, hyperparameters_hash, seed);
+CREATE TABLE IF NOT EXISTS accuracies (
+    run_id INTEGER NOT NULL REFERENCES runs (run_id),
+    evaluation TEXT NOT NULL,
+    after_learning_of_task INTEGER NOT NULL,
+    tested_task INTEGER NOT NULL,
+    accuracy REAL,
+    PRIMARY KEY (run_id, evaluation, after_learning_of_task, tested_task)
+);
+"""
+
+# Parameters which do not define the experiment, e.g. paths
+# or the seed, are excluded from the hash of hyperparameters
+NOT_HASHED_PARAMETERS = ["seed", "saving_folder", "grid_search_folder",
+                         "summary_results_filename", "device", "results_store",
+                         "profile_steps", "profiler_trace_window",
+                         "checkpoint_interval", "lazy_task_loading"]
+
+
+def connect(path):
+    """
+    Open the results store, creating it if necessary.
+
+    Parameters:
+    -----------
+    path: str
+        The path of the SQLite database.
+
+    Returns:
+    --------
+    sqlite3.Connection
+        A connection to the store.
+    """
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    # Workers of the grid search may write simultaneously; they wait for
+    # the lock of the default rollback journal, since the WAL mode requires
+    # shared memory, which does not work on network filesystems
+    connection = sqlite3.connect(path, timeout=60.0)
+    connection.execute("PRAGMA busy_timeout = 60000")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def hash_hyperparameters(parameters):
+    """
+    Calculate a hash of hyperparameters describing an experiment,
+    shared by runs with different seeds.
+
+    Parameters:
+    -----------
+    parameters: dict
+        Hyperparameters of the experiment.
+
+    Returns:
+    --------
+    Tuple[str, str]
+        The hash and hyperparameters serialized to JSON.
+    """
+    hashed = {key: value for key, value in parameters.items()
+              if key not in NOT_HASHED_PARAMETERS}
+    serialized = json.dumps(hashed, sort_keys=True, default=str)
+    return hashlib.sha1(serialized.encode()).hexdigest()[:16], serialized
+
+
+def store_experiment_results(path, parameters, dataframes, scenario,
+                             elapsed_time=None):
+    """
+    Save results of a single run into the store. A run with the same saving
+    folder (e.g. a resumed one) is replaced.
+
+    Parameters:
+    -----------
+    path: str
+        The path of the SQLite database.
+    parameters: dict
+        Hyperparameters of the experiment; "dataset", "seed"
+        and "saving_folder" are used for indexing.
+    dataframes: dict
+        Maps names of evaluations (e.g. "standard" or "intersection")
+        to DataFrames with columns "after_learning_of_task", "tested_task"
+        and "accuracy".
+    scenario: str
+        The name of the scenario, e.g. "non_forced" or "nested".
+    elapsed_time: float, optional
+        The duration of the training.
+
+    Returns:
+    --------
+    int
+        The identifier of the run.
+    """
+    hyperparameters_hash, serialized = hash_hyperparameters(parameters)
+    saving_folder = os.path.abspath(parameters["saving_folder"])
+    with closing(connect(path)) as connection, connection:
+        connection.execute(
+            "DELETE FROM accuracies WHERE run_id IN "
+            "(SELECT run_id FROM runs WHERE saving_folder = ?)",
+            (saving_folder,)
+        )
+        connection.execute("DELETE FROM runs WHERE saving_folder = ?",
+                           (saving_folder,))
+        cursor = connection.execute(
+            "INSERT INTO runs (dataset, scenario, seed, hyperparameters_hash, "
+            "hyperparameters, saving_folder, elapsed_time) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (parameters["dataset"], scenario, parameters["seed"],
+             hyperparameters_hash, serialized, saving_folder,
+             elapsed_time)
+        )
+        run_id = cursor.lastrowid
+        for evaluation, dataframe in dataframes.items():
+            rows = zip(
+                [run_id] * dataframe.shape[0],
+                [evaluation] * dataframe.shape[0],
+                dataframe["after_learning_of_task"].astype(int).tolist(),
+                dataframe["tested_task"].astype(int).tolist(),
+                dataframe["accuracy"].astype(float).tolist()
+            )
+            connection.executemany(
+                "INSERT INTO accuracies VALUES (?, ?, ?, ?, ?)", rows
+            )
+    return run_id
+
+
+def import_results_folders(path, datasets_folder):
+    """
+    Import results stored in CSV files with the structure
+    "datasets_folder/dataset/scenario/seed/results.csv", as in
+    calculate_BWT_different_datasets() of evaluation.py.
+
+    Parameters:
+    -----------
+    path: str
+        The path of the SQLite database.
+    datasets_folder: str
+        The folder with results of consecutive datasets.
+
+    Returns:
+    --------
+    int
+        The number of imported runs.
+    """
+    number_of_runs = 0
+    for root, _, files in os.walk(datasets_folder):
+        if "results.csv" not in files:
+            continue
+        relative_path = os.path.relpath(root, datasets_folder).split(os.sep)
+        if len(relative_path) < 3:
+            continue
+        dataset, scenario, seed = relative_path[-3:]
+        dataframes = {"standard": pd.read_csv(os.path.join(root, "results.csv"),
+                                              sep=";")}
+        if "results_intersection.csv" in files:
+            dataframes["intersection"] = pd.read_csv(
+                os.path.join(root, "results_intersection.csv"), sep=";"
+            )
+        store_experiment_results(
+            path,
+            {"dataset": dataset,
+             "seed": int(seed) if seed.isdigit() else None,
+             "saving_folder": os.path.abspath(root)},
+            dataframes,
+            scenario
+        )
+        number_of_runs += 1
+    return number_of_runs
+
+
+def load_runs(path, **filters):
+    """
+    Load the table of runs with hyperparameters in separate columns.
+
+    Parameters:
+    -----------
+    path: str
+        The path of the SQLite database.
+    **filters:
+        Required values of columns, e.g. dataset="PermutedMNIST"
+        or learning_rate=0.001.
+
+    Returns:
+    --------
+    pd.DataFrame
+        Runs satisfying the filters.
+    """
+    with closing(connect(path)) as connection:
+        runs = pd.read_sql_query("SELECT * FROM runs", connection)
+    hyperparameters = pd.json_normalize(
+        runs["hyperparameters"].map(json.loads).tolist(), max_level=0
+    )
+    hyperparameters = hyperparameters.drop(
+        columns=[c for c in hyperparameters.columns if c in runs.columns]
+    )
+    runs = pd.concat([runs.drop(columns="hyperparameters"), hyperparameters],
+                     axis=1)
+    for column, value in filters.items():
+        runs = runs[runs[column].map(lambda x: x == value)]
+    return runs
+
+
+def get_run_ids_of_folders(path, folders):
+    """
+    Find runs saved in given folders.
+
+    Parameters:
+    -----------
+    path: str
+        The path of the SQLite database.
+    folders: List[str]
+        Saving folders of runs.
+
+    Returns:
+    --------
+    List[int]
+        Identifiers of runs in the order of folders.
+    """
+    with closing(connect(path)) as connection:
+        runs = dict(connection.execute("SELECT saving_folder, run_id FROM runs"))
+    run_ids = []
+    for folder in folders:
+        folder = os.path.abspath(folder)
+        if folder not in runs:
+            raise ValueError(f"There are no results of {folder} in the store!")
+        run_ids.append(runs[folder])
+    return run_ids
+
+
+def load_accuracies(path, run_ids=None, evaluation="standard"):
+    """
+    Load accuracies of many runs in the format of results.csv files.
+
+    Parameters:
+    -----------
+    path: str
+        The path of the SQLite database.
+    run_ids: List[int], optional
+        Selected runs; by default all of them.
+    evaluation: str, optional
+        The name of the evaluation (e.g. "standard" or "intersection").
+
+    Returns:
+    --------
+    pd.DataFrame
+        Columns "run_id", "after_learning_of_task", "tested_task"
+        and "accuracy", sorted by runs and evaluations.
+    """
+    with closing(connect(path)) as connection:
+        condition = _run_condition(connection, run_ids)
+        return pd.read_sql_query(
+            "SELECT a.run_id, a.after_learning_of_task, a.tested_task, "
+            f"a.accuracy FROM accuracies a WHERE a.evaluation = ? {condition} "
+            "ORDER BY a.run_id, a.after_learning_of_task, a.tested_task",
+            connection, params=[evaluation]
+        )
+
+
+def _run_condition(connection, run_ids):
+    """
+    Return an SQL condition selecting given runs of the table "a". Identifiers
+    are inserted into a temporary table of the connection instead of being
+    bound one by one, since the number of bound parameters is limited.
+    """
+    if run_ids is None:
+        return ""
+    connection.execute("CREATE TEMP TABLE IF NOT EXISTS selected_runs "
+                       "(run_id INTEGER PRIMARY KEY)")
+    connection.execute("DELETE FROM selected_runs")
+    connection.executemany("INSERT OR IGNORE INTO selected_runs VALUES (?)",
+                           [(int(run_id),) for run_id in run_ids])
+    return "AND a.run_id IN (SELECT run_id FROM selected_runs)"
+
+
+def calculate_backward_transfer_of_runs(path, run_ids=None, evaluation="standard"):
+    """
+    Calculate backward transfer of many runs in a single query,
+    BWT = 1/(N-1) * sum_{i=1}^{N-1} A_{N,i} - A_{i,i},
+    as in calculate_backward_transfer() of evaluation.py.
+
+    Parameters:
+    -----------
+    path: str
+        The path of the SQLite database.
+    run_ids: List[int], optional
+        Selected runs; by default all of them.
+    evaluation: str, optional
+        The name of the evaluation (e.g. "standard" or "intersection").
+
+    Returns:
+    --------
+    pd.DataFrame
+        Columns "run_id" and "backward_transfer".
+    """
+    with closing(connect(path)) as connection:
+        condition = _run_condition(connection, run_ids)
+        query = f"""
+            WITH last AS (
+                SELECT run_id, MAX(after_learning_of_task) AS last_task
+                FROM accuracies WHERE evaluation = ? GROUP BY run_id
+            )
+            SELECT a.run_id,
+                   SUM(f.accuracy - a.accuracy) / last.last_task AS backward_transfer
+            FROM accuracies a
+            JOIN last ON last.run_id = a.run_id
+            JOIN accuracies f ON f.run_id = a.run_id
+                AND f.evaluation = a.evaluation
+                AND f.after_learning_of_task = last.last_task
+                AND f.tested_task = a.tested_task
+            WHERE a.evaluation = ? AND a.after_learning_of_task = a.tested_task
+                {condition}
+            GROUP BY a.run_id
+        """
+        return pd.read_sql_query(query, connection,
+                                 params=[evaluation, evaluation])
+
+
+def calculate_final_accuracy_of_runs(path, run_ids=None, evaluation="standard"):
+    """
+    Calculate the mean and standard deviation of accuracies of all tasks
+    after the training of the last task for many runs in a single query.
+
+    Parameters:
+    -----------
+    path: str
+        The path of the SQLite database.
+    run_ids: List[int], optional
+        Selected runs; by default all of them.
+    evaluation: str, optional
+        The name of the evaluation (e.g. "standard" or "intersection").
+
+    Returns:
+    --------
+    pd.DataFrame
+        Columns "run_id", "mean_accuracy" and "std_accuracy"
+        (population standard deviation, as in the summaries of grid searches).
+    """
+    with closing(connect(path)) as connection:
+        condition = _run_condition(connection, run_ids)
+        query = f"""
+            WITH last AS (
+                SELECT run_id, MAX(after_learning_of_task) AS last_task
+                FROM accuracies WHERE evaluation = ? GROUP BY run_id
+            )
+            SELECT a.run_id,
+                   AVG(a.accuracy) AS mean_accuracy,
+                   AVG(a.accuracy * a.accuracy) - AVG(a.accuracy) * AVG(a.accuracy)
+                       AS variance
+            FROM accuracies a
+            JOIN last ON last.run_id = a.run_id
+                AND a.after_learning_of_task = last.last_task
+            WHERE a.evaluation = ? {condition}
+            GROUP BY a.run_id
+        """
+        results = pd.read_sql_query(query, connection,
+                                    params=[evaluation, evaluation])
+    results["std_accuracy"] = results.pop("variance").clip(lower=0.0) ** 0.5
+    return results
+
+
+def get_accuracy_curves(path, run_ids=None, evaluation="standard"):
+    """
+    Get accuracies of consecutive tasks just after their training
+    and after the training of all tasks, for many runs at once.
+
+    Parameters:
+    -----------
+    path: str
+        The path of the SQLite database.
+    run_ids: List[int], optional
+        Selected runs; by default all of them.
+    evaluation: str, optional
+        The name of the evaluation (e.g. "standard" or "intersection").
+
+    Returns:
+    --------
+    Tuple[pd.DataFrame, pd.DataFrame]
+        Accuracies just after the training and after the training of all
+        tasks; rows represent runs and columns represent tested tasks.
+    """
+    accuracies = load_accuracies(path, run_ids, evaluation)
+    just_after_training = accuracies[
+        accuracies["after_learning_of_task"] == accuracies["tested_task"]
+    ].pivot(index="run_id", columns="tested_task", values="accuracy")
+    last_task = accuracies.groupby("run_id")["after_learning_of_task"].transform("max")
+    after_all_tasks = accuracies[
+        accuracies["after_learning_of_task"] == last_task
+    ].pivot(index="run_id", columns="tested_task", values="accuracy")
+    return just_after_training, after_all_tasks
+
+
+def get_accuracy_matrices(path, run_ids=None, evaluation="standard"):
+    """
+    Get full accuracy matrices of many runs, e.g. to draw mean heatmaps.
+
+    Parameters:
+    -----------
+    path: str
+        The path of the SQLite database.
+    run_ids: List[int], optional
+        Selected runs; by default all of them.
+    evaluation: str, optional
+        The name of the evaluation (e.g. "standard" or "intersection").
+
+    Returns:
+    --------
+    pd.DataFrame
+        Accuracies indexed by ("run_id", "after_learning_of_task")
+        with tested tasks in columns.
+    """
+    accuracies = load_accuracies(path, run_ids, evaluation)
+    return accuracies.pivot_table(index=["run_id", "after_learning_of_task"],
+                                  columns="tested_task", values="accuracy")
+
+
+def summarize_grid_search(path, evaluation="standard", **filters):
+    """
+    Aggregate final accuracies and backward transfer over seeds
+    for each configuration of hyperparameters.
+
+    Parameters:
+    -----------
+    path: str
+        The path of the SQLite database.
+    evaluation: str, optional
+        The name of the evaluation (e.g. "standard" or "intersection").
+    **filters:
+        Required values of columns of runs, see load_runs().
+
+    Returns:
+    --------
+    pd.DataFrame
+        Means and standard deviations of final accuracies and backward
+        transfer for consecutive configurations, sorted by the accuracy.
+    """
+    runs = load_runs(path, **filters)
+    run_ids = runs["run_id"].tolist()
+    metrics = calculate_final_accuracy_of_runs(path, run_ids, evaluation).merge(
+        calculate_backward_transfer_of_runs(path, run_ids, evaluation),
+        on="run_id"
+    )
+    metrics = runs[["run_id", "dataset", "scenario", "hyperparameters_hash"]]\
+        .merge(metrics, on="run_id")
+    summary = metrics.groupby(["dataset", "scenario", "hyperparameters_hash"]).agg(
+        number_of_seeds=("run_id", "count"),
+        mean_accuracy=("mean_accuracy", "mean"),
+        std_accuracy=("mean_accuracy", "std"),
+        mean_backward_transfer=("backward_transfer", "mean"),
+        std_backward_transfer=("backward_transfer", "std")
+    )
+    return summary.sort_values("mean_accuracy", ascending=False).reset_index()
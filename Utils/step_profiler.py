@@ -0,0 +1,185 @@
+"""
+This file implements a lightweight profiler which attributes wall-clock time
+and peak memory of training iterations to consecutive phases (data loading,
+hypernetwork forward, target network forward, regularization, backward etc.).
+"""
+
+import os
+import time
+import resource
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+
+import torch
+
+
+class StepProfiler:
+    """
+    Measure time and peak memory of named phases of training iterations.
+
+    Parameters:
+    -----------
+    enabled: bool
+        If False, phases are not measured and the profiler adds no overhead.
+    device: str
+        "cuda" or "cpu"; on GPU the device is synchronized at the boundaries
+        of phases to attribute asynchronous kernels to the proper phase.
+    trace_window: Tuple[int, int, int] or None, optional
+        (task, first iteration, number of iterations) for which a detailed
+        trace of torch.profiler is collected.
+    trace_folder: str or None, optional
+        The folder where traces of torch.profiler are saved.
+    """
+    def __init__(self, enabled, device, trace_window=None, trace_folder=None):
+        self.enabled = enabled
+        self.use_cuda = "cuda" in str(device) and torch.cuda.is_available()
+        self.trace_window = trace_window
+        self.trace_folder = trace_folder
+        self._trace = None
+        self.reset()
+
+    def reset(self):
+        """
+        Remove all measurements, e.g., before a new task.
+        """
+        self.times = OrderedDict()
+        self.calls = OrderedDict()
+        self.peak_memory = OrderedDict()
+
+    def _synchronize(self):
+        if self.use_cuda:
+            torch.cuda.synchronize()
+
+    def _current_peak_memory(self):
+        """
+        Return memory in MB: peak allocated memory of the GPU since
+        the beginning of the phase or the current resident set size
+        of the process. A CPU phase is attributed the maximum of its
+        samples taken at its boundaries, since the lifetime peak of
+        the process would be the same for all phases.
+        """
+        if self.use_cuda:
+            return torch.cuda.max_memory_allocated() / 2**20
+        try:
+            # The second field is the number of resident pages
+            with open("/proc/self/statm") as stream:
+                resident_pages = int(stream.read().split()[1])
+            return resident_pages * resource.getpagesize() / 2**20
+        except OSError:
+            # Without procfs only the lifetime peak (in kilobytes) is known
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+    @contextmanager
+    def _measure(self, name):
+        self._synchronize()
+        if self.use_cuda:
+            torch.cuda.reset_peak_memory_stats()
+        memory_at_start = self._current_peak_memory()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._synchronize()
+            elapsed = time.perf_counter() - start
+            self.times[name] = self.times.get(name, 0.0) + elapsed
+            self.calls[name] = self.calls.get(name, 0) + 1
+            self.peak_memory[name] = max(self.peak_memory.get(name, 0.0),
+                                         memory_at_start,
+                                         self._current_peak_memory())
+
+    def phase(self, name):
+        """
+        Return a context manager measuring a given phase.
+
+        Parameters:
+        -----------
+        name: str
+            The name of the phase, e.g. "hypernetwork_forward".
+        """
+        if not self.enabled:
+            return nullcontext()
+        return self._measure(name)
+
+    def start_iteration(self, task, iteration):
+        """
+        Start a detailed trace of torch.profiler if the iteration
+        begins the trace window.
+
+        Parameters:
+        -----------
+        task: int
+            The number of the current task.
+        iteration: int
+            The number of the current iteration.
+        """
+        if self.trace_window is None:
+            return
+        trace_task, first_iteration, _ = self.trace_window
+        if task == trace_task and iteration == first_iteration:
+            os.makedirs(self.trace_folder, exist_ok=True)
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if self.use_cuda:
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self._trace = torch.profiler.profile(
+                activities=activities,
+                record_shapes=True,
+                profile_memory=True,
+                on_trace_ready=torch.profiler.tensorboard_trace_handler(
+                    self.trace_folder
+                )
+            )
+            self._trace.__enter__()
+
+    def end_iteration(self, task, iteration):
+        """
+        Stop the detailed trace of torch.profiler if the iteration
+        finishes the trace window.
+
+        Parameters:
+        -----------
+        task: int
+            The number of the current task.
+        iteration: int
+            The number of the current iteration.
+        """
+        if self._trace is None:
+            return
+        _, first_iteration, number_of_iterations = self.trace_window
+        if iteration == first_iteration + number_of_iterations - 1:
+            self._trace.__exit__(None, None, None)
+            self._trace = None
+
+    def save_task_summary(self, filename, task):
+        """
+        Append measurements of a task to a CSV file and print them.
+
+        Parameters:
+        -----------
+        filename: str
+            The path and name of the CSV file.
+        task: int
+            The number of the task.
+        """
+        # The task may end in the middle of the trace window
+        if self._trace is not None:
+            self._trace.__exit__(None, None, None)
+            self._trace = None
+        if not self.enabled:
+            return
+        total_time = sum(self.times.values())
+        write_header = not os.path.exists(filename)
+        with open(filename, "a+") as stream:
+            if write_header:
+                stream.write("task;phase;calls;total_time;mean_time;"
+                             "share_of_time;peak_memory_mb\n")
+            for name, elapsed in self.times.items():
+                share = elapsed / total_time if total_time > 0 else 0.0
+                stream.write(
+                    f"{task};{name};{self.calls[name]};{elapsed};"
+                    f"{elapsed / self.calls[name]};{share};"
+                    f"{self.peak_memory[name]}\n"
+                )
+                print(f"Task {task}, {name}: {elapsed:.2f}s "
+                      f"({100 * share:.1f}%), peak memory: "
+                      f"{self.peak_memory[name]:.1f} MB")
+        self.reset()
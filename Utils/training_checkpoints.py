@@ -0,0 +1,138 @@
+"""
+This file implements periodic checkpoints of the training which allow to resume
+an interrupted experiment in the middle of a task.
+"""
+
+import os
+import random
+
+import numpy as np
+import torch
+
+
+CHECKPOINT_FILENAME = "training_checkpoint.pt"
+
+
+def get_checkpoint_path(saving_folder):
+    """
+    Get the path of the training checkpoint for a given experiment.
+
+    Parameters:
+    -----------
+    saving_folder: str
+        The folder with results of the experiment.
+
+    Returns:
+    --------
+    str
+        The path of the checkpoint file.
+    """
+    return os.path.join(saving_folder, CHECKPOINT_FILENAME)
+
+
+def get_rng_state():
+    """
+    Collect states of all random number generators used during the training.
+
+    Returns:
+    --------
+    dict
+        States of random, numpy, torch and (if available) CUDA generators.
+    """
+    state = {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+        "cuda": None
+    }
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    """
+    Restore states of random number generators collected by get_rng_state().
+
+    Parameters:
+    -----------
+    state: dict
+        States of random, numpy, torch and CUDA generators.
+    """
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if state["cuda"] is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+def save_atomically(object_to_save, filename):
+    """
+    Save an object with torch.save() in such a way that the file is
+    never left half-written, i.e. the object is saved into a temporary
+    file which then replaces the target one.
+
+    Parameters:
+    -----------
+    object_to_save: Any
+        The object to be saved.
+    filename: str
+        The path and name of the file (with extension).
+    """
+    temporary_filename = f"{filename}.tmp"
+    with open(temporary_filename, "wb") as stream:
+        torch.save(object_to_save, stream)
+        stream.flush()
+        os.fsync(stream.fileno())
+    os.replace(temporary_filename, filename)
+
+
+def save_training_checkpoint(saving_folder, state):
+    """
+    Save the state of the training into the saving folder of the experiment.
+
+    Parameters:
+    -----------
+    saving_folder: str
+        The folder with results of the experiment.
+    state: dict
+        The state of the training. It should contain at least the number
+        of the current task ("task") and the number of iterations which
+        were already performed for this task ("iteration").
+    """
+    state["rng_state"] = get_rng_state()
+    save_atomically(state, get_checkpoint_path(saving_folder))
+
+
+def load_training_checkpoint(saving_folder):
+    """
+    Load the state of the training from the saving folder of the experiment.
+
+    Parameters:
+    -----------
+    saving_folder: str
+        The folder with results of the experiment.
+
+    Returns:
+    --------
+    dict or None
+        The state of the training or None when there is no checkpoint.
+    """
+    path = get_checkpoint_path(saving_folder)
+    if not os.path.exists(path):
+        return None
+    return torch.load(path, map_location=torch.device("cpu"))
+
+
+def remove_training_checkpoint(saving_folder):
+    """
+    Remove the checkpoint of a finished experiment.
+
+    Parameters:
+    -----------
+    saving_folder: str
+        The folder with results of the experiment.
+    """
+    path = get_checkpoint_path(saving_folder)
+    if os.path.exists(path):
+        os.remove(path)
@@ -3,13 +3,15 @@ import torch
 import pandas as pd
 import numpy as np
 import torch.nn.functional as F
+from torch.func import vmap
 from datetime import datetime
 
 from evaluation import (
     prepare_and_load_weights_for_models,
 )
 
-from Utils.handy_functions import reverse_predictions
+from Utils.handy_functions import (reverse_predictions,
+                                   reverse_predictions_for_tasks)
 
 
 def translate_output_CIFAR_classes(labels, setup, task, mode):
@@ -138,20 +140,15 @@ def translate_output_MNIST_classes(relative_labels, task, mode):
     )
     return y_translated
 
-def get_target_network_representation(
+def get_target_weights_of_all_tasks(
     hypernetwork,
     hypernetwork_weights,
-    target_network,
-    target_network_type,
-    input_data,
-    task,
-    perturbated_eps,
-    full_interval
+    number_of_tasks,
+    perturbated_eps
 ):
     """
-    Calculate the output classification layer of the target network,
-    using a hypernetwork with its weights and a target network with
-    its weights, along with the number of the considered task.
+    Generate lower, middle and upper weights of the target network
+    for all tasks in a single forward pass of the hypernetwork.
 
     Parameters:
     -----------
@@ -159,78 +156,277 @@ def get_target_network_representation(
         An instance of the hypernetwork class.
     hypernetwork_weights: torch.Tensor
         Loaded weights for the hypernetwork.
-    target_network: MLP or ResNet
-        An instance of the target network class.
-    target_network_type: str
-        Represents the target network architecture ("MLP" or "ResNet").
-    input_data: torch.Tensor
-        Input data for the network.
-    task: int
-        The considered task; the corresponding embedding and batch normalization
-        statistics will be used (if applicable)
+    number_of_tasks: int
+        The number of tasks; weights for tasks 0, ..., number_of_tasks - 1
+        are generated.
     perturbated_eps: float
         Represents the taken perturbated epsilon.
-    full_interval: bool
-        Indicates whether a proper interval mechanism is used or not.
 
     Returns:
     --------
-    torch.Tensor or list of torch.Tensor
-        A tensor (or list of tensors) representing lower, middle, and upper
-        values from the output classification layer.
+    Tuple[List[torch.Tensor], List[torch.Tensor], List[torch.Tensor]]
+        Lower, middle and upper weights; each element of a list contains
+        the weights of a single layer stacked for consecutive tasks.
     """
     hypernetwork.eval()
-    target_network.eval()
 
     with torch.no_grad():
-
-        
         (
             lower_target_weights,
             middle_target_weights,
             upper_target_weights,
             _
         ) = hypernetwork.forward(
-            cond_id=task, 
+            cond_id=list(range(number_of_tasks)),
             weights=hypernetwork_weights,
             perturbated_eps=perturbated_eps,
-            return_extended_output=True
+            return_extended_output=True,
+            ret_format="sequential"
         )
 
-        if target_network_type in ["ResNet", "AlexNet"]:
-                condition = task
-        else:
-            condition = None
-        
-        if full_interval:
+    def stack_tasks(weights):
+        return [
+            torch.stack([weights[task][layer] for task in range(number_of_tasks)])
+            for layer in range(len(weights[0]))
+        ]
 
-            # Lower, middle and upper logits!
-            logits = target_network.forward(
-                                        input_data,
-                                        lower_weights=lower_target_weights,
-                                        middle_weights=middle_target_weights,
-                                        upper_weights=upper_target_weights,
-                                        condition=condition
-                                    )
-            logits = logits.rename(None)
-            
+    return (
+        stack_tasks(lower_target_weights),
+        stack_tasks(middle_target_weights),
+        stack_tasks(upper_target_weights)
+    )
+
+
+def get_target_network_representation_of_selected_task(
+    target_network,
+    target_network_type,
+    input_data,
+    target_weights_of_all_tasks,
+    task,
+    full_interval
+):
+    """
+    Calculate the output classification layer of the target network
+    for a single task, using weights generated for all tasks.
 
+    Parameters:
+    -----------
+    target_network: MLP or ResNet
+        An instance of the target network class.
+    target_network_type: str
+        Represents the target network architecture ("MLP" or "ResNet").
+    input_data: torch.Tensor
+        Input data for the network.
+    target_weights_of_all_tasks: Tuple[List[torch.Tensor]]
+        Stacked lower, middle and upper weights returned by
+        get_target_weights_of_all_tasks().
+    task: int
+        The considered task; the corresponding weights and batch normalization
+        statistics will be used (if applicable)
+    full_interval: bool
+        Indicates whether a proper interval mechanism is used or not.
+
+    Returns:
+    --------
+    torch.Tensor
+        Shape: (number of samples, 3, number of output heads), lower, middle,
+        and upper values from the output classification layer.
+    """
+    lower, middle, upper = [
+        [w[task] for w in weights] for weights in target_weights_of_all_tasks
+    ]
+    if target_network_type in ["ResNet", "AlexNet"]:
+        condition = task
+    else:
+        condition = None
+
+    with torch.no_grad():
+        if full_interval:
+            logits = target_network.forward(
+                input_data,
+                lower_weights=lower,
+                middle_weights=middle,
+                upper_weights=upper,
+                condition=condition
+            ).rename(None)
         else:
             logits = torch.stack(reverse_predictions(
-                                    target_network,
-                                    input_data,
-                                    lower_target_weights,
-                                    middle_target_weights,
-                                    upper_target_weights,
-                                    condition
-                                ), dim=1)
-            
-        
-        
-        logits = logits.detach().cpu()
-    
+                target_network, input_data, lower, middle, upper, condition
+            ), dim=1)
     return logits
 
+
+def get_target_network_representation_of_all_tasks(
+    target_network,
+    target_network_type,
+    input_data,
+    target_weights_of_all_tasks,
+    full_interval,
+    chunk_size=None,
+    keep_on_device=False
+):
+    """
+    Calculate the output classification layer of the target network
+    for all tasks at once, i.e. the target network is evaluated with
+    stacked weights of all tasks in batched operations.
+
+    Parameters:
+    -----------
+    target_network: MLP or ResNet
+        An instance of the target network class.
+    target_network_type: str
+        Represents the target network architecture ("MLP" or "ResNet").
+    input_data: torch.Tensor
+        Input data for the network.
+    target_weights_of_all_tasks: Tuple[List[torch.Tensor]]
+        Stacked lower, middle and upper weights returned by
+        get_target_weights_of_all_tasks().
+    full_interval: bool
+        Indicates whether a proper interval mechanism is used or not.
+    chunk_size: int, optional
+        The number of tasks evaluated simultaneously by vectorized
+        vanilla networks; by default all of them.
+    keep_on_device: bool, optional
+        If True, logits are not moved to CPU (default: False).
+
+    Returns:
+    --------
+    torch.Tensor
+        Shape: (number of tasks, number of samples, 3, number of output heads),
+        lower, middle, and upper values from the output classification layer.
+    """
+    target_network.eval()
+    lower_weights, middle_weights, upper_weights = target_weights_of_all_tasks
+    number_of_tasks = middle_weights[0].shape[0]
+
+    with torch.no_grad():
+        if target_network_type in ["ResNet", "AlexNet"]:
+            # Batch normalization statistics are task-specific,
+            # so tasks have to be evaluated separately
+            logits = [
+                get_target_network_representation_of_selected_task(
+                    target_network,
+                    target_network_type,
+                    input_data,
+                    target_weights_of_all_tasks,
+                    task,
+                    full_interval
+                )
+                for task in range(number_of_tasks)
+            ]
+            logits = torch.stack(logits)
+        elif full_interval:
+            logits = target_network.forward_tasks(
+                input_data,
+                upper_weights=upper_weights,
+                middle_weights=middle_weights,
+                lower_weights=lower_weights
+            )
+        else:
+            logits = reverse_predictions_for_tasks(
+                target_network,
+                input_data,
+                lower_weights,
+                middle_weights,
+                upper_weights,
+                chunk_size=chunk_size
+            )
+
+    if keep_on_device:
+        return logits.detach()
+    return logits.detach().cpu()
+
+def translate_test_classes(gt_classes, dataset, no_of_task):
+    """
+    Change relative classes of test samples of a selected task
+    into absolute classes.
+
+    Parameters:
+    -----------
+    gt_classes: Union[torch.Tensor, np.ndarray]
+        Relative classes of test samples.
+    dataset: str
+        Defines the name of the dataset used: 'PermutedMNIST', 'SplitMNIST',
+        'CIFAR10' or 'CIFAR100_FeCAM_setup'.
+    no_of_task: int
+        Represents the number of the currently analyzed task.
+
+    Returns:
+    --------
+    np.ndarray
+        Absolute classes of test samples.
+    """
+    if dataset in ["CIFAR100_FeCAM_setup", "CIFAR10"]:
+        # Currently there is an assumption that only setup with
+        # 5 tasks will be used for CIFAR100_FeCAM_setup
+        mode = "CIFAR100" if dataset == "CIFAR100_FeCAM_setup" else "CIFAR10"
+        return translate_output_CIFAR_classes(
+            gt_classes, setup=5, task=no_of_task, mode=mode
+        )
+    elif dataset in ["PermutedMNIST", "SplitMNIST"]:
+        mode = "permuted" if dataset == "PermutedMNIST" else "split"
+        return translate_output_MNIST_classes(
+            gt_classes, task=no_of_task, mode=mode
+        )
+    elif dataset == "SubsetImageNet":
+        raise NotImplementedError
+    else:
+        raise ValueError("Wrong name of the dataset!")
+
+
+def iterate_over_test_batches(tested_task, dataset, no_of_task, batch_size, device):
+    """
+    Iterate over mini-batches of the test set of a selected task. Inputs
+    are transferred to the device batch by batch, so the whole test set
+    is never stored on the device.
+
+    Parameters:
+    -----------
+    tested_task: object
+        The object containing the selected task.
+    dataset: str
+        Defines the name of the dataset used.
+    no_of_task: int
+        Represents the number of the currently analyzed task.
+    batch_size: int or None
+        The number of samples in a mini-batch; if None, the whole
+        test set forms a single batch.
+    device: str
+        Defines whether CPU or GPU will be used.
+
+    Yields:
+    -------
+    Tuple[torch.Tensor, torch.Tensor]
+        Input samples and their absolute classes (on the device).
+    """
+    input_data = tested_task.get_test_inputs()
+    output_data = tested_task.get_test_outputs()
+    gt_classes = translate_test_classes(
+        tested_task.output_to_torch_tensor(
+            output_data, "cpu", mode="inference"
+        ).max(dim=1)[1].numpy(),
+        dataset,
+        no_of_task
+    )
+    number_of_samples = input_data.shape[0]
+    if batch_size is None:
+        batch_size = number_of_samples
+    # Copies from pageable memory are synchronous even with non_blocking;
+    # inputs are transferred (and transformed) by handlers themselves
+    pin_memory = "cuda" in str(device) and torch.cuda.is_available()
+    for start in range(0, number_of_samples, batch_size):
+        X_batch = tested_task.input_to_torch_tensor(
+            input_data[start:start + batch_size], device, mode="inference"
+        )
+        y_batch = torch.from_numpy(
+            np.asarray(gt_classes[start:start + batch_size])
+        )
+        if pin_memory:
+            y_batch = y_batch.pin_memory()
+        y_batch = y_batch.to(device, non_blocking=pin_memory)
+        yield X_batch, y_batch
+
+
 def extract_test_set_from_single_task(
     dataset_CL_tasks, no_of_task, dataset, device, mode="CIFAR100"
 ):
@@ -272,23 +468,9 @@ def extract_test_set_from_single_task(
     test_output = tested_task.output_to_torch_tensor(
         output_data, device, mode="inference"
     )
-    gt_classes = test_output.max(dim=1)[1]
-    if dataset in ["CIFAR100_FeCAM_setup", "CIFAR10"]:
-        # Currently there is an assumption that only setup with
-        # 5 tasks will be used for CIFAR100_FeCAM_setup
-        mode = "CIFAR100" if dataset == "CIFAR100_FeCAM_setup" else "CIFAR10"
-        gt_classes = translate_output_CIFAR_classes(
-            gt_classes, setup=5, task=no_of_task, mode=mode
-        )
-    elif dataset in ["PermutedMNIST", "SplitMNIST"]:
-        mode = "permuted" if dataset == "PermutedMNIST" else "split"
-        gt_classes = translate_output_MNIST_classes(
-            gt_classes, task=no_of_task, mode=mode
-        )
-    elif dataset == "SubsetImageNet":
-        raise NotImplementedError
-    else:
-        raise ValueError("Wrong name of the dataset!")
+    gt_classes = translate_test_classes(
+        test_output.max(dim=1)[1], dataset, no_of_task
+    )
     gt_tasks = [no_of_task for _ in range(output_data.shape[0])]
     return X_test, gt_classes, gt_tasks
 
@@ -349,8 +531,79 @@ def extract_test_set_from_all_tasks(
     assert X_test.shape[0] == y_test.shape[0] == tasks_test.shape[0]
     return X_test, y_test, tasks_test
 
+def get_class_translation_table(dataset, setup, number_of_tasks, number_of_heads):
+    """
+    Prepare a lookup table translating relative classes of consecutive tasks
+    into absolute classes of the dataset.
+
+    Parameters:
+    -----------
+    dataset: str
+        Name of the dataset for proper class translation.
+    setup: int
+        Defines how many tasks were performed in this experiment (in total).
+    number_of_tasks: int
+        The number of tasks for which classes are translated.
+    number_of_heads: int
+        The number of output heads, i.e. classes in a single task.
+
+    Returns:
+    --------
+    torch.Tensor
+        Shape: (number of tasks, number of output heads); the element [t, c]
+        is the absolute class of the relative class c of the task t.
+    """
+    relative_classes = np.arange(number_of_heads)
+    if dataset in ["CIFAR100_FeCAM_setup", "CIFAR10"]:
+        mode = "CIFAR100" if dataset == "CIFAR100_FeCAM_setup" else "CIFAR10"
+        table = [
+            translate_output_CIFAR_classes(relative_classes, setup, task, mode=mode)
+            for task in range(number_of_tasks)
+        ]
+    elif dataset in ["PermutedMNIST", "SplitMNIST"]:
+        mode = "permuted" if dataset == "PermutedMNIST" else "split"
+        table = [
+            translate_output_MNIST_classes(relative_classes, task, mode=mode)
+            for task in range(number_of_tasks)
+        ]
+    else:
+        raise ValueError("Wrong name of the dataset!")
+    return torch.tensor(np.stack(table), dtype=torch.int32)
+
+
+def calculate_interval_entropy(lower_logits, upper_logits, vanilla_entropy=False):
+    """
+    Calculate the interval entropy of the output classification layer.
+    The softmax is applied to the centers of the logit intervals and,
+    unless the vanilla entropy is used, the summands are weighted
+    by inverses of the interval widths.
+
+    Parameters:
+    -----------
+    lower_logits: torch.Tensor
+        Lower logits, the last dimension represents output heads.
+    upper_logits: torch.Tensor
+        Upper logits of the same shape.
+    vanilla_entropy: bool, optional
+        Indicates whether vanilla entropy calculation should be used (default: False).
+
+    Returns:
+    --------
+    torch.Tensor
+        Entropies of the shape of logits without the last dimension.
+    """
+    softmaxed = F.softmax((lower_logits + upper_logits) / 2.0, dim=-1)
+    if not vanilla_entropy:
+        factor = 1 / (upper_logits - lower_logits + 1e-8).abs()
+        assert not torch.isnan(factor).any()
+    else:
+        factor = 1.0
+    return -1 * torch.sum(factor * softmaxed * torch.log(softmaxed), dim=-1)
+
+
 def get_task_and_class_prediction_based_on_logits(
-    inferenced_logits_of_all_tasks, setup, dataset, vanilla_entropy = False
+    inferenced_logits_of_all_tasks, setup, dataset, vanilla_entropy = False,
+    keep_on_device = False
 ):
     """
     Get task predictions for consecutive samples based on interval entropy values
@@ -366,6 +619,9 @@ def get_task_and_class_prediction_based_on_logits(
         Name of the dataset for proper class translation.
     vanilla_entropy: bool, optional
         Indicates whether vanilla entropy calculation should be used (default: False).
+    keep_on_device: bool, optional
+        If True, predictions stay on the device of logits instead
+        of being moved to CPU (default: False).
 
     Returns:
     --------
@@ -375,61 +631,242 @@ def get_task_and_class_prediction_based_on_logits(
         - predicted_classes: torch.Tensor with the prediction of classes for consecutive samples.
           Positions of samples in the two tensors are the same.
     """
-    predicted_classes, predicted_tasks = [], []
-    number_of_samples = inferenced_logits_of_all_tasks.shape[1]
+    number_of_tasks, number_of_samples, _, number_of_heads = \
+        inferenced_logits_of_all_tasks.shape
+
+    # Entropies of all samples for all tasks; shape: (tasks, samples)
+    task_entropies = calculate_interval_entropy(
+        inferenced_logits_of_all_tasks[:, :, 0, :],
+        inferenced_logits_of_all_tasks[:, :, 2, :],
+        vanilla_entropy=vanilla_entropy
+    )
+    predicted_tasks = torch.argmin(task_entropies, dim=0)
+
+    # We evaluate performance of classification task on middle
+    # logits only
+    sample_indices = torch.arange(number_of_samples,
+                                  device=predicted_tasks.device)
+    target_output = inferenced_logits_of_all_tasks[
+        predicted_tasks, sample_indices, 1, :
+    ]
+    output_relative_classes = target_output.argmax(dim=-1)
+
+    translation_table = get_class_translation_table(
+        dataset, setup, number_of_tasks, number_of_heads
+    ).to(predicted_tasks.device)
+    predicted_classes = translation_table[predicted_tasks,
+                                          output_relative_classes]
+
+    predicted_tasks = predicted_tasks.to(torch.int32)
+    # Kept as a column, as in the case of the per-sample translation
+    predicted_classes = predicted_classes.reshape(-1, 1)
+    if not keep_on_device:
+        predicted_tasks = predicted_tasks.cpu()
+        predicted_classes = predicted_classes.cpu()
+    return predicted_tasks, predicted_classes
 
-    for no_of_sample in range(number_of_samples):
-        task_entropies = torch.zeros((inferenced_logits_of_all_tasks.shape[0]))
 
-        all_task_single_output_sample = inferenced_logits_of_all_tasks[
-            :, no_of_sample, :, :
-        ]
+def get_proxy_logits_of_all_tasks(
+    target_network,
+    target_network_type,
+    input_data,
+    target_weights_of_all_tasks,
+    full_interval,
+    chunk_size=None
+):
+    """
+    Calculate cheap proxy logits of the target network for all tasks,
+    i.e. logits obtained only with middle weights, without interval
+    propagation.
 
-        # Calculate entropy based on results from all tasks
-        for no_of_inferred_task in range(task_entropies.shape[0]):
+    Parameters:
+    -----------
+    target_network: MLP or ResNet
+        An instance of the target network class.
+    target_network_type: str
+        Represents the target network architecture ("MLP" or "ResNet").
+    input_data: torch.Tensor
+        Input data for the network.
+    target_weights_of_all_tasks: Tuple[List[torch.Tensor]]
+        Stacked lower, middle and upper weights returned by
+        get_target_weights_of_all_tasks().
+    full_interval: bool
+        Indicates whether a proper interval mechanism is used or not.
+    chunk_size: int, optional
+        The number of tasks evaluated simultaneously by vectorized
+        vanilla networks; by default all of them.
 
-            lower_logits = all_task_single_output_sample[no_of_inferred_task, 0, :]
-            upper_logits = all_task_single_output_sample[no_of_inferred_task, 2, :]
-            
-            softmaxed_inferred_task = F.softmax((lower_logits + upper_logits)/2.0, dim=-1)
+    Returns:
+    --------
+    torch.Tensor
+        Shape: (number of tasks, number of samples, number of output heads).
+    """
+    target_network.eval()
+    middle_weights = target_weights_of_all_tasks[1]
+    number_of_tasks = middle_weights[0].shape[0]
 
+    with torch.no_grad():
+        if target_network_type in ["ResNet", "AlexNet"]:
+            logits = []
+            for task in range(number_of_tasks):
+                middle = [w[task] for w in middle_weights]
+                if full_interval:
+                    # Degenerated intervals, only the middle output is used
+                    task_logits = target_network.forward(
+                        input_data,
+                        lower_weights=middle,
+                        middle_weights=middle,
+                        upper_weights=middle,
+                        condition=task
+                    ).rename(None)[:, 1, :]
+                else:
+                    task_logits = target_network.forward(
+                        x=input_data, weights=middle, condition=task
+                    )
+                logits.append(task_logits)
+            logits = torch.stack(logits)
+        elif full_interval:
+            logits = target_network.forward_tasks(
+                input_data,
+                upper_weights=None,
+                middle_weights=middle_weights,
+                lower_weights=None,
+                middle_only=True
+            )
+        else:
+            logits = vmap(
+                lambda middle: target_network.forward(x=input_data, weights=middle),
+                chunk_size=chunk_size
+            )(middle_weights)
 
-            if not vanilla_entropy:
-                factor = 1 /(upper_logits - lower_logits + 1e-8).abs()
+    return logits.detach().cpu()
 
-                assert not torch.isnan(factor).any()
-            else:
-                factor = 1.0
-            
-            task_entropies[no_of_inferred_task] = -1 * torch.sum(factor * \
-                softmaxed_inferred_task * torch.log(softmaxed_inferred_task), dim=-1
-            )
-        
-        selected_task_id = torch.argmin(task_entropies)
-        predicted_tasks.append(selected_task_id.item())
 
-        # We evaluate performance of classification task on middle
-        # logits only 
-        target_output = all_task_single_output_sample[selected_task_id.item(), 1, :]
+def get_task_and_class_prediction_with_cascade(
+    target_network,
+    target_network_type,
+    input_data,
+    target_weights_of_all_tasks,
+    full_interval,
+    setup,
+    dataset,
+    top_k,
+    tolerance=0.0,
+    vanilla_entropy=False,
+    chunk_size=None
+):
+    """
+    Get task and class predictions with a cascade: candidate tasks are
+    scored with the entropy of cheap proxy logits (middle weights only),
+    and the full interval propagation is performed only for the top_k
+    candidates of each sample (and for all candidates whose proxy entropy
+    is within tolerance of the best one). Other candidates cannot be
+    selected. Setting top_k to the number of tasks restores the exhaustive
+    search of get_task_and_class_prediction_based_on_logits(). Otherwise,
+    predictions may differ from the exhaustive ones; the disagreement may
+    be checked on a subsample, see
+    calculate_entropy_and_predict_classes_separately().
 
-        output_relative_class = target_output.argmax().item()
+    Parameters:
+    -----------
+    target_network: MLP or ResNet
+        An instance of the target network class.
+    target_network_type: str
+        Represents the target network architecture ("MLP" or "ResNet").
+    input_data: torch.Tensor
+        Input data for the network.
+    target_weights_of_all_tasks: Tuple[List[torch.Tensor]]
+        Stacked lower, middle and upper weights returned by
+        get_target_weights_of_all_tasks().
+    full_interval: bool
+        Indicates whether a proper interval mechanism is used or not.
+    setup: int
+        Defines how many tasks were performed in this experiment (in total).
+    dataset: str
+        Name of the dataset for proper class translation.
+    top_k: int
+        The number of candidate tasks of each sample kept for the full
+        interval propagation, between 1 and the number of tasks.
+    tolerance: float, optional
+        A non-negative margin of the vanilla entropy of proxy logits:
+        candidates whose proxy entropy exceeds the lowest one by at most
+        tolerance are kept as well (default: 0.0). It is not a bound on
+        the disagreement with the exhaustive search.
+    vanilla_entropy: bool, optional
+        Indicates whether vanilla entropy calculation should be used (default: False).
+    chunk_size: int, optional
+        The number of tasks evaluated simultaneously by vectorized
+        vanilla networks; by default all of them.
 
-        if dataset in ["CIFAR100_FeCAM_setup", "CIFAR10"]:
-            mode = "CIFAR100" if dataset == "CIFAR100_FeCAM_setup" else "CIFAR10"
-            output_absolute_class = translate_output_CIFAR_classes(
-                [output_relative_class], setup, selected_task_id.item(), mode=mode
-            )
-        elif dataset in ["PermutedMNIST", "SplitMNIST"]:
-            mode = "permuted" if dataset == "PermutedMNIST" else "split"
-            output_absolute_class = translate_output_MNIST_classes(
-                [output_relative_class], selected_task_id.item(), mode=mode
-            )
-        else:
-            raise ValueError("Wrong name of the dataset!")
-        predicted_classes.append(output_absolute_class)
-    predicted_tasks = torch.tensor(predicted_tasks, dtype=torch.int32)
-    predicted_classes = torch.tensor(predicted_classes, dtype=torch.int32)
-    return predicted_tasks, predicted_classes
+    Returns:
+    --------
+    Tuple[torch.Tensor, torch.Tensor, float]
+        A tuple containing:
+        - predicted_tasks: torch.Tensor with the prediction of tasks for consecutive samples.
+        - predicted_classes: torch.Tensor with the prediction of classes for consecutive samples.
+        - evaluated_fraction: the fraction of (candidate, sample) pairs
+          evaluated with the full interval propagation.
+    """
+    number_of_tasks = target_weights_of_all_tasks[1][0].shape[0]
+    if not 1 <= top_k <= number_of_tasks:
+        raise ValueError(
+            f"top_k must be between 1 and the number of tasks ({number_of_tasks})!"
+        )
+    if tolerance < 0:
+        raise ValueError("The tolerance must be non-negative!")
+    proxy_logits = get_proxy_logits_of_all_tasks(
+        target_network,
+        target_network_type,
+        input_data,
+        target_weights_of_all_tasks,
+        full_interval,
+        chunk_size=chunk_size
+    )
+    _, number_of_samples, number_of_heads = proxy_logits.shape
+
+    # Select candidates based on the vanilla entropy of proxy logits
+    proxy_entropies = calculate_interval_entropy(
+        proxy_logits, proxy_logits, vanilla_entropy=True
+    )
+    kth_entropy = proxy_entropies.topk(top_k, dim=0, largest=False).values[-1]
+    best_entropy = proxy_entropies.min(dim=0).values
+    threshold = torch.maximum(kth_entropy, best_entropy + tolerance)
+    candidates = proxy_entropies <= threshold
+
+    # Full interval propagation only for surviving candidates
+    task_entropies = torch.full((number_of_tasks, number_of_samples), float("inf"))
+    middle_logits = torch.zeros((number_of_tasks, number_of_samples, number_of_heads))
+    for task in range(number_of_tasks):
+        samples = candidates[task].nonzero().squeeze(1)
+        if samples.shape[0] == 0:
+            continue
+        logits = get_target_network_representation_of_selected_task(
+            target_network,
+            target_network_type,
+            input_data[samples.to(input_data.device)],
+            target_weights_of_all_tasks,
+            task,
+            full_interval
+        ).detach().cpu()
+        task_entropies[task, samples] = calculate_interval_entropy(
+            logits[:, 0, :], logits[:, 2, :], vanilla_entropy=vanilla_entropy
+        )
+        middle_logits[task, samples] = logits[:, 1, :]
+
+    predicted_tasks = torch.argmin(task_entropies, dim=0)
+    output_relative_classes = middle_logits[
+        predicted_tasks, torch.arange(number_of_samples)
+    ].argmax(dim=-1)
+    translation_table = get_class_translation_table(
+        dataset, setup, number_of_tasks, number_of_heads
+    )
+    predicted_classes = translation_table[predicted_tasks,
+                                          output_relative_classes]
+
+    evaluated_fraction = candidates.float().mean().item()
+    return (predicted_tasks.to(torch.int32),
+            predicted_classes.reshape(-1, 1),
+            evaluated_fraction)
 
 
 def calculate_entropy_and_predict_classes_separately(experiment_models):
@@ -446,6 +883,20 @@ def calculate_entropy_and_predict_classes_separately(experiment_models):
         - "target_network_weights": Loaded weights for the target network.
         - "hyperparameters": A dictionary with experiment's hyperparameters.
         - "dataset_CL_tasks": List of objects containing consecutive tasks.
+        - "tasks_chunk_size": (optional) The number of candidate tasks
+          evaluated simultaneously by vanilla target networks.
+        - "cascade_top_k": (optional) If given, candidate tasks are pruned
+          with cheap proxy logits and only the top-k of them are fully evaluated.
+        - "cascade_tolerance": (optional) The tolerance of the pruning,
+          see get_task_and_class_prediction_with_cascade().
+        - "cascade_reference_samples": (optional) If given, task predictions
+          of the cascade for this number of first test samples of each task
+          are compared with the exhaustive search.
+        - "cascade_max_disagreement": (optional) If the disagreement rate
+          on reference samples exceeds this value, the remaining samples
+          of the task are evaluated with the exhaustive search.
+        - "test_batch_size": (optional) The number of test samples processed
+          at once; by default the whole test set of a task.
 
     Returns:
     --------
@@ -464,66 +915,133 @@ def calculate_entropy_and_predict_classes_separately(experiment_models):
     alpha = hyperparameters["alpha"]
     full_interval = hyperparameters["full_interval"]
     vanilla_entropy = experiment_models["vanilla_entropy"]
+    cascade_top_k = experiment_models.get("cascade_top_k", None)
 
     hypernetwork.eval()
     target_network.eval()
 
-    results = []
-    for task in range(hyperparameters["number_of_tasks"]):
+    # Weights of all candidate tasks are generated only once
+    target_weights_of_all_tasks = get_target_weights_of_all_tasks(
+        hypernetwork,
+        hypernetwork_weights,
+        hyperparameters["number_of_tasks"],
+        alpha
+    )
 
-        X_test, y_test, gt_tasks = extract_test_set_from_single_task(
-            dataset_CL_tasks, task, dataset_name, hyperparameters["device"]
+    reference_samples = experiment_models.get("cascade_reference_samples", None)
+    max_disagreement = experiment_models.get("cascade_max_disagreement", None)
+
+    def predict_exhaustively(X_batch):
+        # Try to predict task for all samples from the batch
+        all_inferenced_tasks = get_target_network_representation_of_all_tasks(
+            target_network,
+            target_network_type,
+            X_batch,
+            target_weights_of_all_tasks,
+            full_interval,
+            chunk_size=experiment_models.get("tasks_chunk_size", None),
+            keep_on_device=True
+        )
+        # Sizes of consecutive dimensions represent:
+        # number of tasks x number of samples x 3 x number of output heads
+        return get_task_and_class_prediction_based_on_logits(
+            all_inferenced_tasks,
+            hyperparameters["number_of_tasks"],
+            dataset_name,
+            vanilla_entropy=vanilla_entropy,
+            keep_on_device=True
         )
 
-        with torch.no_grad():
-            logits_outputs_for_different_tasks = []
-            for inferenced_task in range(hyperparameters["number_of_tasks"]):
-
-                # Try to predict task for all samples from "task"
-                logits = get_target_network_representation(
-                    hypernetwork,
-                    hypernetwork_weights,
-                    target_network,
-                    target_network_type,
-                    X_test,
-                    inferenced_task,
-                    alpha,
-                    full_interval
-                )
+    def predict_with_cascade(X_batch):
+        return get_task_and_class_prediction_with_cascade(
+            target_network,
+            target_network_type,
+            X_batch,
+            target_weights_of_all_tasks,
+            full_interval,
+            hyperparameters["number_of_tasks"],
+            dataset_name,
+            top_k=cascade_top_k,
+            tolerance=experiment_models.get("cascade_tolerance", 0.0),
+            vanilla_entropy=vanilla_entropy,
+            chunk_size=experiment_models.get("tasks_chunk_size", None)
+        )
 
-                logits_outputs_for_different_tasks.append(logits)
+    results = []
+    for task in range(hyperparameters["number_of_tasks"]):
 
-            all_inferenced_tasks = torch.stack(
-                logits_outputs_for_different_tasks
-            )
-            # Sizes of consecutive dimensions represent:
-            # number of tasks x number of samples x 3 x number of output heads
-        (
-            predicted_tasks,
-            predicted_classes,
-        ) = get_task_and_class_prediction_based_on_logits(
-            all_inferenced_tasks,
-            hyperparameters["number_of_tasks"],
+        correct_tasks, correct_classes, number_of_samples = 0, 0, 0
+        evaluated_fractions = []
+        pending = None
+        batches = iterate_over_test_batches(
+            dataset_CL_tasks[task],
             dataset_name,
-            vanilla_entropy=vanilla_entropy
+            task,
+            experiment_models.get("test_batch_size", None),
+            hyperparameters["device"]
         )
-        predicted_classes = predicted_classes.flatten().numpy()
-        task_prediction_accuracy = (
-            torch.sum(predicted_tasks == task).float()
-            * 100.0
-            / predicted_tasks.shape[0]
-        ).item()
+        # Correct predictions of a batch are read, which synchronizes
+        # the device, only after predictions of the next batch are queued.
+        # Inputs are converted synchronously by input_to_torch_tensor of
+        # handlers, so their transfers do not overlap with computations
+        use_cascade = cascade_top_k is not None
+        disagreement = None
+        for X_batch, y_batch in batches:
+            if use_cascade and disagreement is None and \
+               reference_samples is not None:
+                # The cascade is checked on a small subsample before
+                # it is used for the whole batch
+                X_reference = X_batch[:reference_samples]
+                exhaustive_tasks, _ = predict_exhaustively(X_reference)
+                cascade_tasks, _, _ = predict_with_cascade(X_reference)
+                disagreement = (
+                    cascade_tasks.cpu() != exhaustive_tasks.cpu()
+                ).float().mean().item()
+                if max_disagreement is not None and \
+                   disagreement > max_disagreement:
+                    print(f"Disagreement of the cascade: {disagreement}, "
+                          "falling back to the exhaustive search")
+                    use_cascade = False
+            if use_cascade:
+                (
+                    predicted_tasks,
+                    predicted_classes,
+                    evaluated_fraction
+                ) = predict_with_cascade(X_batch)
+                evaluated_fractions.append(evaluated_fraction * X_batch.shape[0])
+            else:
+                predicted_tasks, predicted_classes = predict_exhaustively(X_batch)
+                evaluated_fractions.append(float(X_batch.shape[0]))
+            if pending is not None:
+                correct_tasks += pending[0].item()
+                correct_classes += pending[1].item()
+            pending = (
+                (predicted_tasks.to(y_batch.device) == task).sum(),
+                (predicted_classes.flatten().to(y_batch.device) == y_batch).sum()
+            )
+            number_of_samples += X_batch.shape[0]
+        correct_tasks += pending[0].item()
+        correct_classes += pending[1].item()
+
+        if cascade_top_k is not None:
+            print("fraction of fully evaluated candidates: "
+                  f"{sum(evaluated_fractions) / number_of_samples}")
+            if disagreement is not None:
+                print("disagreement of task predictions with the exhaustive "
+                      f"search on reference samples: {disagreement}")
+        task_prediction_accuracy = correct_tasks * 100.0 / number_of_samples
+        sample_prediction_accuracy = correct_classes * 100.0 / number_of_samples
         print(f"task prediction accuracy: {task_prediction_accuracy}")
-        sample_prediction_accuracy = (
-            np.sum(predicted_classes == y_test) * 100.0 / y_test.shape[0]
-        ).item()
         print(f"sample prediction accuracy: {sample_prediction_accuracy}")
         results.append(
             [task, task_prediction_accuracy, sample_prediction_accuracy]
         )
-    results = pd.DataFrame(
-        results, columns=["task", "task_prediction_acc", "class_prediction_acc"]
-    )
+        if cascade_top_k is not None and reference_samples is not None:
+            results[-1].append(disagreement)
+    columns = ["task", "task_prediction_acc", "class_prediction_acc"]
+    if cascade_top_k is not None and reference_samples is not None:
+        columns.append("cascade_disagreement")
+    results = pd.DataFrame(results, columns=columns)
     results.to_csv(
         f"{saving_folder}entropy_statistics_{number_of_model}.csv", sep=";"
     )
@@ -535,6 +1053,19 @@ if __name__ == "__main__":
     # alphas = np.linspace(0.01, 0.5, 5)
     alphas = [0.1]
     vanilla_entropy = False
+    # If not None, only cascade_top_k candidate tasks with the lowest
+    # entropy of middle logits are evaluated with interval propagation
+    cascade_top_k = None
+    # A margin of the entropy of middle logits within which
+    # additional candidates are kept
+    cascade_tolerance = 0.0
+    # If not None, the cascade is compared with the exhaustive search on
+    # this number of first test samples of each task; when the disagreement
+    # exceeds cascade_max_disagreement, the exhaustive search is used
+    cascade_reference_samples = None
+    cascade_max_disagreement = None
+    # Test sets are processed in mini-batches to bound the memory
+    test_batch_size = 1000
 
     # Options for *dataset*:
     # 'PermutedMNIST', 'SplitMNIST', 'CIFAR100_FeCAM_setup', 'CIFAR10'
@@ -567,6 +1098,11 @@ if __name__ == "__main__":
             experiment_models["hyperparameters"]["saving_folder"] = path_to_save
             experiment_models["hyperparameters"]["alpha"] = alpha
             experiment_models["vanilla_entropy"] = vanilla_entropy
+            experiment_models["cascade_top_k"] = cascade_top_k
+            experiment_models["cascade_tolerance"] = cascade_tolerance
+            experiment_models["cascade_reference_samples"] = cascade_reference_samples
+            experiment_models["cascade_max_disagreement"] = cascade_max_disagreement
+            experiment_models["test_batch_size"] = test_batch_size
 
             results = calculate_entropy_and_predict_classes_separately(
                 experiment_models
@@ -1,5 +1,10 @@
 from Utils.prepare_non_forced_scenario_params import set_hyperparameters
 from Utils.dataset_utils import *
+from Utils.results_store import (
+    get_run_ids_of_folders,
+    load_accuracies,
+    calculate_backward_transfer_of_runs
+)
 
 from Training.train_non_forced_classification_scenario import (
     load_pickle_file,
@@ -892,6 +897,42 @@ def plot_intervals_around_embeddings_for_trained_models(path_to_stored_networks,
         plt.savefig(f'{save_path}/{filename}.png', dpi=300)
         plt.close()
 
+def load_results_of_runs(list_of_folders_path, mode, results_store=None):
+    """
+    Load results of consecutive runs from CSV files saved in their folders
+    or, if the results store is given, with a single query.
+
+    Parameters:
+    ---------
+        list_of_folders_path: List[str]
+            A list with paths to stored results, one path for each seed.
+        mode: int
+            - 1: Results for the non-forced intervals method.
+            - 2: Results for the universal embedding method.
+        results_store: str, optional
+            The path of the SQLite database (see Utils/results_store.py).
+
+    Returns:
+    --------
+        List[pd.DataFrame]: Results of consecutive runs with columns
+        "after_learning_of_task", "tested_task" and "accuracy".
+    """
+    if results_store is not None:
+        evaluation = "standard" if mode == 1 else "intersection"
+        run_ids = get_run_ids_of_folders(results_store, list_of_folders_path)
+        accuracies = load_accuracies(results_store, run_ids, evaluation)
+        return [
+            accuracies[accuracies["run_id"] == run_id]
+            .drop(columns="run_id").reset_index(drop=True)
+            for run_id in run_ids
+        ]
+    if mode == 1:
+        file_suffix = "results.csv"
+    else:
+        file_suffix = "results_intersection.csv"
+    return [pd.read_csv(os.path.join(folder, file_suffix), sep=";")
+            for folder in list_of_folders_path]
+
 def plot_accuracy_curve_with_confidence_intervals(
         list_of_folders_path,
         save_path,
@@ -901,7 +942,8 @@ def plot_accuracy_curve_with_confidence_intervals(
         y_lim_max=100.0,
         fontsize=10,
         figsize=(6, 4),
-        legend_loc = "upper right"
+        legend_loc = "upper right",
+        results_store=None
 ):
     """
     Saves the accuracy curve for the specified mode with 95% confidence intervals.
@@ -927,6 +969,10 @@ def plot_accuracy_curve_with_confidence_intervals(
             Tuple with width and height of the figures.
         legend_loc: str
             Location of the legend.
+        results_store: str, optional
+            The path of the SQLite database (see Utils/results_store.py)
+            from which results of runs saved in given folders are read
+            instead of their CSV files.
 
     Returns:
     --------
@@ -967,15 +1013,7 @@ def plot_accuracy_curve_with_confidence_intervals(
         
         title = f'Results for {dataset_name} (class incremental learning)'
 
-    if mode == 1:
-        file_suffix = "results.csv"
-    else:
-        file_suffix = "results_intersection.csv"
-
-    results_list = []
-    for folder in list_of_folders_path:
-        acc_path = os.path.join(folder, file_suffix)
-        results_list.append(pd.read_csv(acc_path, sep=";"))
+    results_list = load_results_of_runs(list_of_folders_path, mode, results_store)
 
     acc_just_after_training = []
     acc_after_all_training_sessions = []
@@ -1030,7 +1068,8 @@ def plot_accuracy_curve_with_barplot(
         y_lim_max=100.0,
         fontsize=10,
         figsize=(6, 4),
-        bar_width = 0.35
+        bar_width = 0.35,
+        results_store=None
 ):
     """
     Saves the accuracy curve as a bar plot for the specified mode.
@@ -1056,6 +1095,10 @@ def plot_accuracy_curve_with_barplot(
             Tuple with width and height of the figures.
         bar_width: float
             Width of the bars in the bar plot.
+        results_store: str, optional
+            The path of the SQLite database (see Utils/results_store.py)
+            from which results of runs saved in given folders are read
+            instead of their CSV files.
 
     Returns:
     --------
@@ -1089,15 +1132,7 @@ def plot_accuracy_curve_with_barplot(
     elif dataset_name == "SplitCUB-200":
         tasks_list = [i + 1 for i in range(20)]
 
-    if mode == 1:
-        file_suffix = "results.csv"
-    else:
-        file_suffix = "results_intersection.csv"
-
-    results_list = []
-    for folder_path in list_of_folders_path:
-        acc_path = os.path.join(folder_path, file_suffix)
-        results_list.append(pd.read_csv(acc_path, sep=";"))
+    results_list = load_results_of_runs(list_of_folders_path, mode, results_store)
 
     acc_just_after_training = []
     acc_after_all_training_sessions = []
@@ -1144,6 +1179,7 @@ def plot_heatmap_for_n_runs(
         dataset_name="PermutedMNIST-10",
         mode=1,
         fontsize=10,
+        results_store=None
 ):
     """
     Saves the accuracy curve for the specified mode with 95% confidence intervals.
@@ -1163,6 +1199,10 @@ def plot_heatmap_for_n_runs(
             - 2: Results for the universal embedding method.
         fontsize: int
             Font size of titles and axes.
+        results_store: str, optional
+            The path of the SQLite database (see Utils/results_store.py)
+            from which results of runs saved in given folders are read
+            instead of their CSV files.
 
     Returns:
     --------
@@ -1191,17 +1231,8 @@ def plot_heatmap_for_n_runs(
     elif dataset_name == "TinyImageNet":
         tasks_list = [i+1 for i in range(40)]
     
-    if mode == 1:
-        file_suffix = "results.csv"
-    else:
-        file_suffix = "results_intersection.csv"
-
-    results_list = []
-    for folder in list_of_folders_path:
-        acc_path = os.path.join(folder, file_suffix)
-        results_list.append(pd.read_csv(acc_path, sep=";"))
-    
-    dataframe = pd.read_csv(acc_path, sep=";")
+    results_list = load_results_of_runs(list_of_folders_path, mode, results_store)
+    dataframe = results_list[-1].copy()
 
     acc = []
 
@@ -1243,23 +1274,23 @@ def calculate_backward_transfer(dataframe):
     Reference: https://github.com/gmum/HyperMask/blob/main/evaluation.py
 
     """
-    backward_transfer = 0
-    number_of_last_task = int(dataframe.max()["after_learning_of_task"])
+    number_of_last_task = int(dataframe["after_learning_of_task"].max())
     # Indeed, number_of_last_task represents the number of tasks - 1
     # due to the numeration starting from 0
-    for i in range(number_of_last_task + 1):
-        trained_on_last_task = dataframe.loc[
-            (dataframe["after_learning_of_task"] == number_of_last_task)
-            & (dataframe["tested_task"] == i)
-        ]["accuracy"].values[0]
-        trained_on_the_same_task = dataframe.loc[
-            (dataframe["after_learning_of_task"] == i) & (dataframe["tested_task"] == i)
-        ]["accuracy"].values[0]
-        backward_transfer += trained_on_last_task - trained_on_the_same_task
+    table = dataframe.pivot_table(index="after_learning_of_task",
+                                  columns="tested_task",
+                                  values="accuracy",
+                                  aggfunc="first")
+    tasks = np.arange(number_of_last_task + 1)
+    trained_on_last_task = table.loc[number_of_last_task, tasks].values
+    trained_on_the_same_task = table.values[
+        table.index.get_indexer(tasks), table.columns.get_indexer(tasks)
+    ]
+    backward_transfer = np.sum(trained_on_last_task - trained_on_the_same_task)
     backward_transfer /= number_of_last_task
     return backward_transfer
 
-def calculate_BWT_different_files(paths, forward=True):
+def calculate_BWT_different_files(paths, forward=True, results_store=None):
     """
     Calculate mean backward transfer with corresponding
     sample standard deviations based on results saved in .csv files.
@@ -1272,16 +1303,24 @@ def calculate_BWT_different_files(paths, forward=True):
         Contains path to the results files.
       forward: Optional, Boolean
         Defines whether forward transfer will be calculated.
+      results_store: Optional, str
+        The path of the SQLite database (see Utils/results_store.py);
+        if given, paths are saving folders of runs in the store.
 
     Returns:
     --------
       BWTs: List[float]
         Contains consecutive backward transfer values.
     """
-    BWTs = []
-    for path in paths:
-        dataframe = pd.read_csv(path, sep=";", index_col=0)
-        BWTs.append(calculate_backward_transfer(dataframe))
+    if results_store is not None:
+        run_ids = get_run_ids_of_folders(results_store, paths)
+        BWTs = calculate_backward_transfer_of_runs(results_store, run_ids)\
+            .set_index("run_id").loc[run_ids, "backward_transfer"].tolist()
+    else:
+        BWTs = []
+        for path in paths:
+            dataframe = pd.read_csv(path, sep=";", index_col=0)
+            BWTs.append(calculate_backward_transfer(dataframe))
     print(
         f"Mean backward transfer: {np.mean(BWTs)}, "
         f"population standard deviation: {np.std(BWTs)}"